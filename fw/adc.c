@@ -4,6 +4,10 @@
 #include "stm32f4xx.h"
 #include "adc.h"
 
+#define ADC_SCAN_TIMEOUT_MS (100)
+
+extern volatile uint32_t tickMs;
+
 typedef struct {
 	GPIO_TypeDef* adcPort;
 	uint8_t adcPin;
@@ -32,6 +36,26 @@ static adcChannel_t adcs[] = {
 	{GPIOC, 5,  ADC1,   15},
 };
 
+//
+// Streaming
+//
+// TIM2 triggers a scan of the selected channels at a fixed rate and DMA2
+// Stream0 copies the results into streamBuff, which is used as a circular
+// double buffer. The half/full transfer interrupts mark each half as ready
+// for consoleProcess to send to the host.
+//
+#define ADC_STREAM_BUFF_SIZE (1024)
+#define ADC_STREAM_CHUNK_MS (20)
+
+static uint16_t streamBuff[ADC_STREAM_BUFF_SIZE];
+static volatile uint32_t streamReady;		// Bit 0 = first half, bit 1 = second half
+static volatile uint32_t streamHalfSeq[2];	// Sequence number of each ready half
+static volatile uint32_t streamSeq;
+static volatile uint32_t streamDrops;
+static uint32_t streamRows;					// Rows (samples per channel) per half
+static uint8_t streamChannels;
+static uint8_t streaming;
+
 int32_t adcInit() {
 	ADC_InitTypeDef adcConfig;
 
@@ -60,6 +84,11 @@ int32_t adcGetPin(GPIO_TypeDef *port, uint8_t pin) {
 int32_t adcRead(uint8_t adc) {
 	int32_t rval = -1;
 
+	// ADC1 is busy with the stream
+	if(streaming) {
+		return rval;
+	}
+
 	if(adc < sizeof(adcs)/sizeof(adcChannel_t)) {
 		ADC_RegularChannelConfig(adcs[adc].adc, adcs[adc].adcChannel, 1, ADC_SampleTime_144Cycles);
 		ADC_SoftwareStartConv(adcs[adc].adc);
@@ -71,3 +100,248 @@ int32_t adcRead(uint8_t adc) {
 
 	return rval;
 }
+
+//
+// Scan count channels, samples times, as fast as possible
+// Results are interleaved by channel in buff, which must hold
+// samples * count values
+//
+int32_t adcScan(uint8_t *adcNums, uint8_t count, uint16_t samples, uint16_t *buff) {
+	ADC_InitTypeDef adcConfig;
+	DMA_InitTypeDef dmaConfig;
+	int32_t rval = 0;
+
+	if(streaming || (count == 0) || (count > ADC_STREAM_MAX_CHANNELS) || (samples == 0)) {
+		return -1;
+	}
+
+	for(uint8_t channel = 0; channel < count; channel++) {
+		if(adcNums[channel] >= sizeof(adcs)/sizeof(adcChannel_t)) {
+			return -1;
+		}
+	}
+
+	ADC_DeInit();
+	ADC_StructInit(&adcConfig);
+	adcConfig.ADC_ScanConvMode = (count > 1) ? ENABLE : DISABLE;
+	adcConfig.ADC_ContinuousConvMode = ENABLE;
+	adcConfig.ADC_NbrOfConversion = count;
+	ADC_Init(ADC1, &adcConfig);
+
+	for(uint8_t channel = 0; channel < count; channel++) {
+		ADC_RegularChannelConfig(ADC1, adcs[adcNums[channel]].adcChannel, channel + 1, ADC_SampleTime_144Cycles);
+	}
+
+	// One-shot DMA2 Stream0 Channel0 (ADC1) transfer into buff
+	RCC_AHB1PeriphClockCmd(RCC_AHB1Periph_DMA2, ENABLE);
+	DMA_DeInit(DMA2_Stream0);
+	DMA_StructInit(&dmaConfig);
+	dmaConfig.DMA_Channel = DMA_Channel_0;
+	dmaConfig.DMA_PeripheralBaseAddr = (uint32_t)&ADC1->DR;
+	dmaConfig.DMA_Memory0BaseAddr = (uint32_t)buff;
+	dmaConfig.DMA_DIR = DMA_DIR_PeripheralToMemory;
+	dmaConfig.DMA_BufferSize = samples * count;
+	dmaConfig.DMA_PeripheralInc = DMA_PeripheralInc_Disable;
+	dmaConfig.DMA_MemoryInc = DMA_MemoryInc_Enable;
+	dmaConfig.DMA_PeripheralDataSize = DMA_PeripheralDataSize_HalfWord;
+	dmaConfig.DMA_MemoryDataSize = DMA_MemoryDataSize_HalfWord;
+	dmaConfig.DMA_Mode = DMA_Mode_Normal;
+	dmaConfig.DMA_Priority = DMA_Priority_High;
+	DMA_Init(DMA2_Stream0, &dmaConfig);
+	DMA_Cmd(DMA2_Stream0, ENABLE);
+
+	ADC_DMARequestAfterLastTransferCmd(ADC1, DISABLE);
+	ADC_DMACmd(ADC1, ENABLE);
+	ADC_Cmd(ADC1, ENABLE);
+	ADC_SoftwareStartConv(ADC1);
+
+	uint32_t timeout = tickMs + ADC_SCAN_TIMEOUT_MS;
+	while(!DMA_GetFlagStatus(DMA2_Stream0, DMA_FLAG_TCIF0)) {
+		if(tickMs >= timeout) {
+			rval = -1;
+			break;
+		}
+	}
+
+	DMA_Cmd(DMA2_Stream0, DISABLE);
+	DMA_ClearFlag(DMA2_Stream0, DMA_FLAG_TCIF0 | DMA_FLAG_HTIF0);
+
+	// Back to single conversions for adcRead
+	adcInit();
+
+	return rval;
+}
+
+int32_t adcStreamStart(uint8_t *adcNums, uint8_t count, uint32_t rate, adcStreamInfo_t *info) {
+	ADC_InitTypeDef adcConfig;
+	DMA_InitTypeDef dmaConfig;
+	TIM_TimeBaseInitTypeDef timerConfig;
+	uint32_t timerClock = SystemCoreClock / 2; // APB1 timer clock
+
+	if(streaming || (count == 0) || (count > ADC_STREAM_MAX_CHANNELS) ||
+		(rate == 0) || ((rate * count) > ADC_STREAM_MAX_RATE)) {
+		return -1;
+	}
+
+	for(uint8_t channel = 0; channel < count; channel++) {
+		if(adcNums[channel] >= sizeof(adcs)/sizeof(adcChannel_t)) {
+			return -1;
+		}
+	}
+
+	// Aim for a chunk every ADC_STREAM_CHUNK_MS, but keep an even number of
+	// rows so that every chunk packs into whole 12-bit pairs
+	streamRows = (rate * ADC_STREAM_CHUNK_MS) / 1000;
+	if(streamRows > (ADC_STREAM_BUFF_SIZE / 2 / count)) {
+		streamRows = ADC_STREAM_BUFF_SIZE / 2 / count;
+	}
+	streamRows &= ~1;
+	if(streamRows < 2) {
+		streamRows = 2;
+	}
+
+	streamChannels = count;
+	streamReady = 0;
+	streamSeq = 0;
+	streamDrops = 0;
+
+	//
+	// ADC1 scan of the selected channels, one scan per TIM2 update
+	//
+	ADC_DeInit();
+	ADC_StructInit(&adcConfig);
+	adcConfig.ADC_ScanConvMode = (count > 1) ? ENABLE : DISABLE;
+	adcConfig.ADC_ContinuousConvMode = DISABLE;
+	adcConfig.ADC_ExternalTrigConvEdge = ADC_ExternalTrigConvEdge_Rising;
+	adcConfig.ADC_ExternalTrigConv = ADC_ExternalTrigConv_T2_TRGO;
+	adcConfig.ADC_NbrOfConversion = count;
+	ADC_Init(ADC1, &adcConfig);
+
+	for(uint8_t channel = 0; channel < count; channel++) {
+		ADC_RegularChannelConfig(ADC1, adcs[adcNums[channel]].adcChannel, channel + 1, ADC_SampleTime_56Cycles);
+	}
+
+	//
+	// DMA2 Stream0 Channel0 (ADC1) into the circular double buffer
+	//
+	RCC_AHB1PeriphClockCmd(RCC_AHB1Periph_DMA2, ENABLE);
+	DMA_DeInit(DMA2_Stream0);
+	DMA_StructInit(&dmaConfig);
+	dmaConfig.DMA_Channel = DMA_Channel_0;
+	dmaConfig.DMA_PeripheralBaseAddr = (uint32_t)&ADC1->DR;
+	dmaConfig.DMA_Memory0BaseAddr = (uint32_t)streamBuff;
+	dmaConfig.DMA_DIR = DMA_DIR_PeripheralToMemory;
+	dmaConfig.DMA_BufferSize = streamRows * count * 2;
+	dmaConfig.DMA_PeripheralInc = DMA_PeripheralInc_Disable;
+	dmaConfig.DMA_MemoryInc = DMA_MemoryInc_Enable;
+	dmaConfig.DMA_PeripheralDataSize = DMA_PeripheralDataSize_HalfWord;
+	dmaConfig.DMA_MemoryDataSize = DMA_MemoryDataSize_HalfWord;
+	dmaConfig.DMA_Mode = DMA_Mode_Circular;
+	dmaConfig.DMA_Priority = DMA_Priority_High;
+	DMA_Init(DMA2_Stream0, &dmaConfig);
+
+	DMA_ITConfig(DMA2_Stream0, DMA_IT_HT | DMA_IT_TC, ENABLE);
+	NVIC_EnableIRQ(DMA2_Stream0_IRQn);
+	DMA_Cmd(DMA2_Stream0, ENABLE);
+
+	ADC_DMARequestAfterLastTransferCmd(ADC1, ENABLE);
+	ADC_DMACmd(ADC1, ENABLE);
+	ADC_Cmd(ADC1, ENABLE);
+
+	//
+	// TIM2 update event at the sample rate
+	//
+	RCC_APB1PeriphClockCmd(RCC_APB1Periph_TIM2, ENABLE);
+	TIM_TimeBaseStructInit(&timerConfig);
+	timerConfig.TIM_Prescaler = 0;
+	timerConfig.TIM_Period = (timerClock / rate) - 1;
+	timerConfig.TIM_CounterMode = TIM_CounterMode_Up;
+	TIM_TimeBaseInit(TIM2, &timerConfig);
+	TIM_SelectOutputTrigger(TIM2, TIM_TRGOSource_Update);
+
+	streaming = 1;
+
+	TIM_Cmd(TIM2, ENABLE);
+
+	info->timerClock = timerClock;
+	info->period = timerClock / rate;
+	info->rows = streamRows;
+
+	return 0;
+}
+
+void adcStreamStop() {
+	if(!streaming) {
+		return;
+	}
+
+	TIM_Cmd(TIM2, DISABLE);
+	DMA_Cmd(DMA2_Stream0, DISABLE);
+	NVIC_DisableIRQ(DMA2_Stream0_IRQn);
+	streaming = 0;
+	streamReady = 0;
+
+	// Back to single conversions for adcRead
+	adcInit();
+}
+
+//
+// Get the oldest half of the stream buffer that's ready to send
+// Returns a chunk handle for adcStreamReleaseChunk or 0 if nothing is ready
+// The chunk holds adcStreamChunkSize() samples, interleaved by channel
+//
+uint32_t adcStreamGetChunk(uint16_t **samples, uint32_t *seq, uint32_t *drops) {
+	uint32_t half;
+
+	if(!streaming || !streamReady) {
+		return 0;
+	}
+
+	if((streamReady & 3) == 3) {
+		// Both ready, send the older one first
+		half = (streamHalfSeq[0] < streamHalfSeq[1]) ? 0 : 1;
+	} else {
+		half = (streamReady & 1) ? 0 : 1;
+	}
+
+	*samples = &streamBuff[half * streamRows * streamChannels];
+	*seq = streamHalfSeq[half] * streamRows;
+	*drops = streamDrops;
+
+	return half + 1;
+}
+
+//
+// Done sending a chunk from adcStreamGetChunk
+//
+void adcStreamReleaseChunk(uint32_t chunk) {
+	__disable_irq();
+	streamReady &= ~(1 << (chunk - 1));
+	__enable_irq();
+}
+
+uint32_t adcStreamChunkSize() {
+	return streamRows * streamChannels;
+}
+
+void DMA2_Stream0_IRQHandler(void) {
+	uint32_t half = 2;
+
+	if(DMA_GetITStatus(DMA2_Stream0, DMA_IT_HTIF0)) {
+		DMA_ClearITPendingBit(DMA2_Stream0, DMA_IT_HTIF0);
+		half = 0;
+	} else if(DMA_GetITStatus(DMA2_Stream0, DMA_IT_TCIF0)) {
+		DMA_ClearITPendingBit(DMA2_Stream0, DMA_IT_TCIF0);
+		half = 1;
+	}
+
+	if(half < 2) {
+		// The host side didn't keep up, this half got overwritten
+		if(streamReady & (1 << half)) {
+			streamDrops++;
+		}
+
+		streamHalfSeq[half] = streamSeq++;
+		streamReady |= (1 << half);
+	}
+}
@@ -8,4 +8,21 @@ int32_t adcInit();
 int32_t adcGetPin(GPIO_TypeDef *port, uint8_t pin);
 int32_t adcRead(uint8_t adc);
 
+#define ADC_STREAM_MAX_CHANNELS (16)
+// Total conversions per second across all channels
+#define ADC_STREAM_MAX_RATE (250000)
+
+typedef struct {
+	uint32_t timerClock;
+	uint32_t period;
+	uint32_t rows;
+} adcStreamInfo_t;
+
+int32_t adcScan(uint8_t *adcNums, uint8_t count, uint16_t samples, uint16_t *buff);
+int32_t adcStreamStart(uint8_t *adcNums, uint8_t count, uint32_t rate, adcStreamInfo_t *info);
+void adcStreamStop();
+uint32_t adcStreamGetChunk(uint16_t **samples, uint32_t *seq, uint32_t *drops);
+void adcStreamReleaseChunk(uint32_t chunk);
+uint32_t adcStreamChunkSize();
+
 #endif
@@ -13,6 +13,9 @@
 #include "adc.h"
 #include "dac.h"
 #include "pwm.h"
+#include "script.h"
+#include "job.h"
+#include "usbd_cdc_vcp.h"
 
 typedef struct {
 	char *commandStr;
@@ -28,23 +31,68 @@ static char cmdBuff[CMD_BUFF_SIZE];
 static uint32_t argc;
 static char* argv[ARGV_MAX];
 
-static uint8_t rxBuff[TX_RX_BUFF_SIZE];
+// Aligned, since adcscan uses rxBuff for 16-bit DMA transfers
+static uint8_t rxBuff[TX_RX_BUFF_SIZE] __attribute__((aligned(4)));
 static uint8_t txBuff[TX_RX_BUFF_SIZE];
 
+extern fifo_t usbTxFifo;
+
+// Tag of the command being handled (BIN_NO_TAG if it isn't tagged)
+static int32_t cmdTag = BIN_NO_TAG;
+
+// Bytes of an oversized frame still to be dropped as they arrive
+static uint32_t rxDiscard;
+
+//
+// Tagged I2C and SPI commands are started and left running on their own, so
+// commands for other peripherals can be handled in the meantime. The
+// response is sent when they're done (see asyncProcess).
+//
+typedef struct {
+	uint8_t active;
+	uint8_t opcode;
+	uint8_t tag;
+	uint16_t rLen;
+} asyncOp_t;
+
+static asyncOp_t i2cOp;
+static asyncOp_t spiOp;
+
+// The command buffer is reused by the next command, so running transfers
+// need buffers of their own
+static uint8_t i2cWBuff[TX_RX_BUFF_SIZE];
+static uint8_t i2cRBuff[TX_RX_BUFF_SIZE];
+static uint8_t spiWBuff[TX_RX_BUFF_SIZE];
+static uint8_t spiRBuff[TX_RX_BUFF_SIZE];
+
+// Command timing telemetry (see timingCmd)
+extern uint32_t usbTxCycles;
+static uint8_t timingEnabled;
+static uint32_t timingSeq;
+static uint32_t timingRx;
+static uint32_t timingExec;
+
 static void helpFn(uint32_t argc, char *argv[]);
 static void i2cCmd(uint32_t argc, char *argv[]);
 static void adcCmd(uint32_t argc, char *argv[]);
 static void adcNumCmd(uint32_t argc, char *argv[]);
+static void adcScanCmd(uint32_t argc, char *argv[]);
 static void dacCmd(uint32_t argc, char *argv[]);
 static void dacEnableCmd(uint32_t argc, char *argv[]);
 static void spiCmd(uint32_t argc, char *argv[]);
+static void spiStreamCmd(uint32_t argc, char *argv[]);
 static void spiCfgCmd(uint32_t argc, char *argv[]);
 static void spiSetCSCmd(uint32_t argc, char *argv[]);
 static void gpioCmd(uint32_t argc, char *argv[]);
+static void gpioPortCmd(uint32_t argc, char *argv[]);
 static void gpioCfgCmd(uint32_t argc, char *argv[]);
 static void pwmCmd(uint32_t argc, char *argv[]);
 static void snCmd(uint32_t argc, char *argv[]);
 static void versionCmd(uint32_t argc, char *argv[]);
+static void binaryCmd(uint32_t argc, char *argv[]);
+static void capsCmd(uint32_t argc, char *argv[]);
+static void identCmd(uint32_t argc, char *argv[]);
+static void timingCmd(uint32_t argc, char *argv[]);
 
 static const char versionStr[] = SILTA_VERSION;
 
@@ -52,17 +100,24 @@ static command_t commands[] = {
 	{"i2c", i2cCmd, "i2c <addr> <rdlen> [wrbytes (04 D1 ..)]"},
 	{"adcnum", adcNumCmd, "adcnum <port[A-E]> <pin0-15>"},
 	{"adc", adcCmd, "adc <adc_num>"},
+	{"adcscan", adcScanCmd, "adcscan <samples> <adc_num> [adc_num ..]"},
 	{"dac", dacCmd, "dac <dac_num> <val>"},
 	{"dacenable", dacEnableCmd, "dacenable"},
 	{"spi", spiCmd, "spi <rwbytes (04 D1 ..)>"},
+	{"spistream", spiStreamCmd, "spistream <hold cs(0|1)> [rwbytes (04 D1 ..)]"},
 	{"spicfg", spiCfgCmd, "spicfg <speed> <cpol> <cpha>"},
 	{"spics", spiSetCSCmd, "<port[A-E]> <pin0-15>"},
 	{"config", cfgCmd, "<key> [value]"},
 	{"gpio", gpioCmd, "<port[A-E]> <pin0-15> [value]"},
+	{"gpioport", gpioPortCmd, "<port[A-E]> [mask value (hex)]"},
 	{"gpiocfg", gpioCfgCmd, "<port[A-E]> <pin0-15> <in|outpp|outod> [pullup|pulldown|nopull]"},
 	{"pwm", pwmCmd, "<channel> <position(1000-2000)"},
 	{"sn", snCmd, "sn"},
 	{"version", versionCmd, "version"},
+	{"binary", binaryCmd, "binary - binary protocol version"},
+	{"caps", capsCmd, "caps - buffer sizes and features"},
+	{"ident", identCmd, "ident - sn, version, binary and caps in one line"},
+	{"timing", timingCmd, "timing [0|1] - per command timing telemetry"},
 	// Add new commands here!
 	{"help", helpFn, "Print this!"},
 	{NULL, NULL, NULL}
@@ -90,6 +145,36 @@ static void helpFn(uint32_t argc, char *argv[]) {
 	}
 }
 
+//
+// Send "OK " and len bytes as hex ("%02X " each), then a newline.
+// Formatted a chunk at a time and written straight to the usb fifo, rather
+// than with a printf per byte.
+//
+#define HEX_CHUNK_SIZE (64)
+static void hexReply(const uint8_t *buff, uint32_t len) {
+	static const char hexChars[] = "0123456789ABCDEF";
+	char hex[HEX_CHUNK_SIZE * 3];
+
+	usbWrite((const uint8_t *)"OK ", 3);
+
+	while(len > 0) {
+		uint32_t chunk = (len > HEX_CHUNK_SIZE) ? HEX_CHUNK_SIZE : len;
+		char *pHex = hex;
+
+		for(uint32_t byte = 0; byte < chunk; byte++) {
+			*pHex++ = hexChars[buff[byte] >> 4];
+			*pHex++ = hexChars[buff[byte] & 0xF];
+			*pHex++ = ' ';
+		}
+
+		usbWrite((uint8_t *)hex, pHex - hex);
+		buff += chunk;
+		len -= chunk;
+	}
+
+	usbWrite((const uint8_t *)"\n", 1);
+}
+
 #define I2C_ADDR_OFFSET		(1)
 #define I2C_RLEN_OFFSET		(2)
 #define I2C_WBUFF_OFFSET	(3)
@@ -103,8 +188,8 @@ static void i2cCmd(uint32_t argc, char *argv[]) {
 		}
 
 		uint8_t addr = strtoul(argv[I2C_ADDR_OFFSET], NULL, 16);
-		uint8_t rLen = strtoul(argv[I2C_RLEN_OFFSET], NULL, 10);
-		uint8_t wLen = argc - I2C_WBUFF_OFFSET;
+		uint32_t rLen = strtoul(argv[I2C_RLEN_OFFSET], NULL, 10);
+		uint32_t wLen = argc - I2C_WBUFF_OFFSET;
 
 		if(wLen > sizeof(txBuff)) {
 			printf("ERR: I2C Not enough space in txBuff\n");
@@ -127,11 +212,7 @@ static void i2cCmd(uint32_t argc, char *argv[]) {
 		if(rval) {
 			printf("ERR %ld\n", rval);
 		} else {
-			printf("OK ");
-			for(uint32_t byte = 0; byte < rLen; byte++) {
-				printf("%02X ", rxBuff[byte]);
-			}
-			printf("\n");
+			hexReply(rxBuff, rLen);
 		}
 
 	} while (0);
@@ -198,6 +279,44 @@ static void adcCmd(uint32_t argc, char *argv[]) {
 	} while(0);
 }
 
+#define ADC_SCAN_SAMPLES_OFFSET	(1)
+#define ADC_SCAN_NUMS_OFFSET	(2)
+static void adcScanCmd(uint32_t argc, char *argv[]) {
+	do {
+		uint8_t adcNums[ADC_STREAM_MAX_CHANNELS];
+		uint16_t *values = (uint16_t *)rxBuff;
+
+		if(argc < 3) {
+			printf("ERR Invalid args\n");
+			break;
+		}
+
+		uint16_t samples = strtoul(argv[ADC_SCAN_SAMPLES_OFFSET], NULL, 10);
+		uint32_t count = argc - ADC_SCAN_NUMS_OFFSET;
+
+		if((count > ADC_STREAM_MAX_CHANNELS) || ((samples * count) > (sizeof(rxBuff)/sizeof(uint16_t)))) {
+			printf("ERR Too many samples\n");
+			break;
+		}
+
+		for(uint32_t channel = 0; channel < count; channel++) {
+			adcNums[channel] = strtoul(argv[ADC_SCAN_NUMS_OFFSET + channel], NULL, 10);
+		}
+
+		if(adcScan(adcNums, count, samples, values)) {
+			printf("ERR Scan failed\n");
+			break;
+		}
+
+		printf("OK");
+		for(uint32_t value = 0; value < (samples * count); value++) {
+			printf(" %d", values[value]);
+		}
+		printf("\n");
+
+	} while(0);
+}
+
 static void dacEnableCmd(uint32_t argc, char *argv[]) {
 	dacInit();
 	printf("OK\n");
@@ -248,11 +367,41 @@ static void spiCmd(uint32_t argc, char *argv[]) {
 		if(rval) {
 			printf("ERR %ld\n", rval);
 		} else {
-			printf("OK ");
-			for(uint32_t byte = 0; byte < rwLen; byte++) {
-				printf("%02X ", rxBuff[byte]);
-			}
-			printf("\n");
+			hexReply(rxBuff, rwLen);
+		}
+
+	} while (0);
+}
+
+#define SPI_STREAM_HOLD_OFFSET (1)
+#define SPI_STREAM_WBUFF_OFFSET (2)
+
+//
+// Part of a longer SPI transaction. CS stays asserted after the transfer if
+// hold is set, until a transfer without it (which can be empty)
+//
+static void spiStreamCmd(uint32_t argc, char *argv[]) {
+	int32_t rval = 0;
+
+	do {
+		if(argc < 2) {
+			printf("ERR: SPI Not enough arguments\n");
+			break;
+		}
+
+		uint32_t rwLen = argc - SPI_STREAM_WBUFF_OFFSET;
+		uint32_t flags = (argv[SPI_STREAM_HOLD_OFFSET][0] != '0') ? SPI_HOLD_CS : 0;
+
+		for(uint32_t byte = 0; byte < rwLen; byte++) {
+			txBuff[byte] = strtoul(argv[SPI_STREAM_WBUFF_OFFSET + byte], NULL, 16);
+		}
+
+		rval = spiTransfer(0, rwLen, txBuff, rxBuff, flags);
+
+		if(rval) {
+			printf("ERR %ld\n", rval);
+		} else {
+			hexReply(rxBuff, rwLen);
 		}
 
 	} while (0);
@@ -349,6 +498,35 @@ static void gpioCmd(uint32_t argc, char *argv[]) {
 	}
 }
 
+//
+// Read a whole GPIO port, or set several of its pins at once
+//
+static void gpioPortCmd(uint32_t argc, char *argv[]) {
+	if((argc == 2) || (argc == 4)) {
+		char port = toupper((uint32_t)argv[1][0]);
+
+		if ((port < 'A') || (port > 'E')) {
+			printf("ERR Invalid port\n");
+			return;
+		}
+
+		GPIO_TypeDef *GPIOx = (GPIO_TypeDef *)(GPIOA_BASE + (uint32_t)(port - 'A') * (GPIOB_BASE - GPIOA_BASE));
+
+		if(argc == 2) {
+			printf("OK %04X\n", gpioPortGet(GPIOx));
+		} else {
+			uint16_t mask = strtoul(argv[2], NULL, 16);
+			uint16_t value = strtoul(argv[3], NULL, 16);
+
+			gpioPortSet(GPIOx, mask, value);
+
+			printf("OK\n");
+		}
+	} else {
+		printf("ERR Invalid args\n");
+	}
+}
+
 //
 // Configure GPIO pins as input/output(open drain or push-pull)
 // and set pull-up/down resistors
@@ -437,21 +615,671 @@ static void pwmCmd(uint32_t argc, char *argv[]) {
 
 
 static void snCmd(uint32_t argc, char *argv[]) {
-	printf("OK ");
-
 	// Print 96-bit serial number
+	hexReply(uid, 12);
+}
+
+static void versionCmd(uint32_t argc, char *argv[]) {
+	printf("OK %s\n", versionStr);
+}
+
+static void binaryCmd(uint32_t argc, char *argv[]) {
+	printf("OK %d\n", BIN_VERSION);
+}
+
+static void printCaps() {
+	printf(" cmdbuf=%d txrxbuf=%d maxargs=%d rxfifo=%d txfifo=%d binmax=%d",
+		CMD_BUFF_SIZE, TX_RX_BUFF_SIZE, ARGV_MAX - 1, USB_RX_FIFO_SIZE, USB_TX_FIFO_SIZE, BIN_MAX_PAYLOAD);
+	printf(" scripts=%d scriptmax=%d jobs=%d", SCRIPT_SLOTS, SCRIPT_MAX_SIZE, JOB_SLOTS);
+	printf(" protocols=ascii,binary features=" CAPS_FEATURES);
+}
+
+//
+// Report buffer sizes (so the host can size its commands) and features
+//
+static void capsCmd(uint32_t argc, char *argv[]) {
+	printf("OK");
+	printCaps();
+	printf("\n");
+}
+
+//
+// Everything the host needs to know when connecting, in a single response
+//
+static void identCmd(uint32_t argc, char *argv[]) {
+	printf("OK sn=");
 	for(uint8_t byte = 0; byte < 12; byte++) {
-		printf("%02X ", uid[byte]);
+		printf("%02X", uid[byte]);
 	}
+
+	printf(" version=%s binary=%d", versionStr, BIN_VERSION);
+	printCaps();
 	printf("\n");
 }
 
-static void versionCmd(uint32_t argc, char *argv[]) {
-	printf("OK %s\n", versionStr);
+//
+// Enable/disable command timing telemetry (see timingReport)
+//
+static void timingCmd(uint32_t argc, char *argv[]) {
+	if(argc > 1) {
+		timingEnabled = strtoul(argv[1], NULL, 10) != 0;
+		timingSeq = 0;
+	}
+
+	printf("OK %d\n", timingEnabled);
+}
+
+//
+// CRC-16/CCITT-FALSE (poly 0x1021), start with crc = 0xFFFF
+//
+static uint16_t crc16(uint16_t crc, const uint8_t *buff, uint32_t len) {
+	while(len--) {
+		crc ^= (uint16_t)(*buff++) << 8;
+		for(uint8_t bit = 0; bit < 8; bit++) {
+			if(crc & 0x8000) {
+				crc = (crc << 1) ^ 0x1021;
+			} else {
+				crc <<= 1;
+			}
+		}
+	}
+
+	return crc;
+}
+
+//
+// Send binary protocol response frame
+// Responses to tagged commands are tagged too (unsolicited frames never are)
+//
+static void binReply(uint8_t opcode, int8_t status, const uint8_t *buff, uint16_t len) {
+	uint8_t header[BIN_RESP_HEADER_SIZE + BIN_TAG_SIZE] = {BIN_SYNC, opcode, (uint8_t)status, len & 0xFF, len >> 8, 0};
+	uint32_t headerLen = BIN_RESP_HEADER_SIZE;
+
+	if((cmdTag != BIN_NO_TAG) && !(opcode & BIN_OP_ASYNC)) {
+		header[1] |= BIN_OP_TAGGED;
+		header[3] = (len + BIN_TAG_SIZE) & 0xFF;
+		header[4] = (len + BIN_TAG_SIZE) >> 8;
+		header[5] = cmdTag;
+		headerLen += BIN_TAG_SIZE;
+	}
+
+	uint16_t crc = crc16(0xFFFF, &header[1], headerLen - 1);
+	crc = crc16(crc, buff, len);
+	uint8_t footer[BIN_CRC_SIZE] = {crc & 0xFF, crc >> 8};
+
+	usbWrite(header, headerLen);
+	if(len > 0) {
+		usbWrite(buff, len);
+	}
+	usbWrite(footer, sizeof(footer));
+}
+
+//
+// Command timing telemetry
+// timingRx is set when a command has been fully received. timingExecStart
+// marks the start of its execution, right before the handler is called.
+//
+static void timingExecStart() {
+	usbTxCycles = 0;
+	timingExec = DWT->CYCCNT;
+}
+
+//
+// Send the timing of the command that was just handled (right after its
+// response), if telemetry was enabled before and after it ran.
+// Payload: sequence (u32) | parse cycles (u32) | execute cycles (u32) |
+//          format cycles (u32) | core clock in Hz (u32)
+// Format cycles are the ones spent writing the response out. Execute cycles
+// are the rest of the time spent in the handler.
+//
+static void timingReport(uint8_t wasEnabled) {
+	uint32_t end = DWT->CYCCNT;
+
+	if(!wasEnabled || !timingEnabled) {
+		return;
+	}
+
+	uint32_t timing[5] = {
+		timingSeq++,
+		timingExec - timingRx,
+		end - timingExec - usbTxCycles,
+		usbTxCycles,
+		SystemCoreClock
+	};
+
+	binReply(BIN_OP_TIMING_DATA, BIN_OK, (uint8_t *)timing, sizeof(timing));
+}
+
+static uint32_t asyncBusy() {
+	return i2cOp.active || spiOp.active;
+}
+
+//
+// Keep track of a tagged command that was left running (if it could be
+// started, the response is sent right away otherwise)
+//
+static void asyncStart(asyncOp_t *op, uint8_t opcode, uint16_t rLen, int32_t rval) {
+	if(rval) {
+		binReply(opcode, rval, NULL, 0);
+		return;
+	}
+
+	op->opcode = opcode;
+	op->tag = cmdTag;
+	op->rLen = rLen;
+	op->active = 1;
+}
+
+static void asyncFinish(asyncOp_t *op, int32_t rval, const uint8_t *rBuff) {
+	cmdTag = op->tag;
+
+	if(rval) {
+		binReply(op->opcode, rval, NULL, 0);
+	} else {
+		binReply(op->opcode, BIN_OK, rBuff, op->rLen);
+	}
+
+	cmdTag = BIN_NO_TAG;
+	op->active = 0;
+}
+
+//
+// Send the responses of the tagged commands that are done
+//
+static void asyncProcess() {
+	if(i2cOp.active && i2cPoll()) {
+		asyncFinish(&i2cOp, i2cResult(), i2cRBuff);
+	}
+
+	if(spiOp.active && spiPoll()) {
+		asyncFinish(&spiOp, spiResult(), spiRBuff);
+	}
+}
+
+//
+// Whether a command can be started yet. Tagged commands only wait for the
+// peripheral they use (scripts use them all). Everything else waits for all
+// the tagged commands to finish, so untagged responses stay in order.
+//
+static uint32_t binCanStart(uint8_t opcode) {
+	if(!(opcode & BIN_OP_TAGGED)) {
+		return !asyncBusy();
+	}
+
+	switch(opcode & ~BIN_OP_TAGGED) {
+		case BIN_OP_I2C: return !i2cOp.active;
+		case BIN_OP_SPI: return !spiOp.active;
+		case BIN_OP_SPI_STREAM: return !spiOp.active;
+		case BIN_OP_SCRIPT_RUN: return !asyncBusy();
+		default: return 1;
+	}
 }
 
-void consoleProcess() {
+static void binI2c(uint8_t *payload, uint16_t len) {
+	if(len < 3) {
+		binReply(BIN_OP_I2C, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	uint8_t addr = payload[0];
+	uint16_t rLen = payload[1] | (payload[2] << 8);
+	uint16_t wLen = len - 3;
+
+	if((wLen > sizeof(txBuff)) || (rLen > sizeof(rxBuff))) {
+		binReply(BIN_OP_I2C, BIN_ERR_LEN, NULL, 0);
+		return;
+	}
+
+	if(cmdTag != BIN_NO_TAG) {
+		memcpy(i2cWBuff, &payload[3], wLen);
+		asyncStart(&i2cOp, BIN_OP_I2C, rLen, i2cStart(I2C1, addr, wLen, i2cWBuff, rLen, i2cRBuff));
+		return;
+	}
+
+	int32_t rval = i2c(I2C1, addr, wLen, &payload[3], rLen, rxBuff);
+
+	if(rval) {
+		binReply(BIN_OP_I2C, rval, NULL, 0);
+	} else {
+		binReply(BIN_OP_I2C, BIN_OK, rxBuff, rLen);
+	}
+}
+
+static void binSpi(uint8_t *payload, uint16_t len) {
+	if(len > sizeof(rxBuff)) {
+		binReply(BIN_OP_SPI, BIN_ERR_LEN, NULL, 0);
+		return;
+	}
+
+	if((cmdTag != BIN_NO_TAG) && (len > 0)) {
+		memcpy(spiWBuff, payload, len);
+		asyncStart(&spiOp, BIN_OP_SPI, len, spiStart(0, len, spiWBuff, spiRBuff, 0));
+		return;
+	}
+
+	int32_t rval = spi(0, len, payload, rxBuff);
+
+	if(rval) {
+		binReply(BIN_OP_SPI, rval, NULL, 0);
+	} else {
+		binReply(BIN_OP_SPI, BIN_OK, rxBuff, len);
+	}
+}
+
+static void binSpiStream(uint8_t *payload, uint16_t len) {
+	if(len < 1) {
+		binReply(BIN_OP_SPI_STREAM, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	if((len - 1) > sizeof(rxBuff)) {
+		binReply(BIN_OP_SPI_STREAM, BIN_ERR_LEN, NULL, 0);
+		return;
+	}
+
+	uint32_t flags = payload[0] ? SPI_HOLD_CS : 0;
+
+	if(cmdTag != BIN_NO_TAG) {
+		memcpy(spiWBuff, &payload[1], len - 1);
+		asyncStart(&spiOp, BIN_OP_SPI_STREAM, len - 1, spiStart(0, len - 1, spiWBuff, spiRBuff, flags));
+		return;
+	}
+
+	int32_t rval = spiTransfer(0, len - 1, &payload[1], rxBuff, flags);
+
+	if(rval) {
+		binReply(BIN_OP_SPI_STREAM, rval, NULL, 0);
+	} else {
+		binReply(BIN_OP_SPI_STREAM, BIN_OK, rxBuff, len - 1);
+	}
+}
+
+static void binGpio(uint8_t *payload, uint16_t len) {
+	if((len < 2) || (payload[0] > ('E' - 'A')) || (payload[1] > 15)) {
+		binReply(BIN_OP_GPIO, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	GPIO_TypeDef *GPIOx = (GPIO_TypeDef *)(GPIOA_BASE + (uint32_t)payload[0] * (GPIOB_BASE - GPIOA_BASE));
+	uint8_t pin = payload[1];
+
+	if(len == 2) {
+		int32_t value = gpioGet(GPIOx, pin);
+
+		if(value < 0) {
+			binReply(BIN_OP_GPIO, BIN_ERR_ARGS, NULL, 0);
+		} else {
+			uint8_t data = value;
+			binReply(BIN_OP_GPIO, BIN_OK, &data, sizeof(data));
+		}
+	} else if(gpioSet(GPIOx, pin, payload[2]) < 0) {
+		binReply(BIN_OP_GPIO, BIN_ERR_ARGS, NULL, 0);
+	} else {
+		binReply(BIN_OP_GPIO, BIN_OK, NULL, 0);
+	}
+}
+
+static void binGpioPort(uint8_t *payload, uint16_t len) {
+	if(((len != 1) && (len != 5)) || (payload[0] > ('E' - 'A'))) {
+		binReply(BIN_OP_GPIO_PORT, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	GPIO_TypeDef *GPIOx = (GPIO_TypeDef *)(GPIOA_BASE + (uint32_t)payload[0] * (GPIOB_BASE - GPIOA_BASE));
+
+	if(len == 1) {
+		uint16_t value = gpioPortGet(GPIOx);
+		uint8_t data[2] = {value & 0xFF, value >> 8};
+		binReply(BIN_OP_GPIO_PORT, BIN_OK, data, sizeof(data));
+	} else {
+		gpioPortSet(GPIOx, payload[1] | (payload[2] << 8), payload[3] | (payload[4] << 8));
+		binReply(BIN_OP_GPIO_PORT, BIN_OK, NULL, 0);
+	}
+}
+
+static void binAdc(uint8_t *payload, uint16_t len) {
+	int32_t adcVal = -1;
+
+	if(len == 1) {
+		adcVal = adcRead(payload[0]);
+	}
+
+	if(adcVal < 0) {
+		binReply(BIN_OP_ADC, BIN_ERR_ARGS, NULL, 0);
+	} else {
+		uint8_t value[2] = {adcVal & 0xFF, adcVal >> 8};
+		binReply(BIN_OP_ADC, BIN_OK, value, sizeof(value));
+	}
+}
+
+static void binDac(uint8_t *payload, uint16_t len) {
+	if((len < 3) || (payload[0] > 1)) {
+		binReply(BIN_OP_DAC, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	dacSet(payload[0], payload[1] | (payload[2] << 8));
+	binReply(BIN_OP_DAC, BIN_OK, NULL, 0);
+}
+
+static void binPwm(uint8_t *payload, uint16_t len) {
+	if((len < 3) || (pwmSetCCR(payload[0], payload[1] | (payload[2] << 8)) < 0)) {
+		binReply(BIN_OP_PWM, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	binReply(BIN_OP_PWM, BIN_OK, NULL, 0);
+}
+
+//
+// Scan samples (u16) times over the adc numbers that follow
+//
+static void binAdcScan(uint8_t *payload, uint16_t len) {
+	uint16_t *values = (uint16_t *)rxBuff;
+
+	if((len < 3) || ((len - 2) > ADC_STREAM_MAX_CHANNELS)) {
+		binReply(BIN_OP_ADC_SCAN, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	uint16_t samples = payload[0] | (payload[1] << 8);
+	uint32_t count = len - 2;
+
+	if((samples * count) > (sizeof(rxBuff)/sizeof(uint16_t))) {
+		binReply(BIN_OP_ADC_SCAN, BIN_ERR_LEN, NULL, 0);
+		return;
+	}
+
+	if(adcScan(&payload[2], count, samples, values)) {
+		binReply(BIN_OP_ADC_SCAN, BIN_ERR_ARGS, NULL, 0);
+	} else {
+		binReply(BIN_OP_ADC_SCAN, BIN_OK, rxBuff, samples * count * sizeof(uint16_t));
+	}
+}
+
+//
+// Start (rate + adc numbers) or stop (no payload) ADC streaming
+//
+static void binAdcStream(uint8_t *payload, uint16_t len) {
+	if(len == 0) {
+		adcStreamStop();
+		binReply(BIN_OP_ADC_STREAM, BIN_OK, NULL, 0);
+		return;
+	}
+
+	if(len < 5) {
+		binReply(BIN_OP_ADC_STREAM, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	adcStreamInfo_t info;
+	uint32_t rate = payload[0] | (payload[1] << 8) | (payload[2] << 16) | (payload[3] << 24);
+
+	if(adcStreamStart(&payload[4], len - 4, rate, &info)) {
+		binReply(BIN_OP_ADC_STREAM, BIN_ERR_ARGS, NULL, 0);
+	} else {
+		binReply(BIN_OP_ADC_STREAM, BIN_OK, (uint8_t *)&info, sizeof(info));
+	}
+}
+
+//
+// Store a script (id + steps) to be run later with binScriptRun
+//
+static void binScriptLoad(uint8_t *payload, uint16_t len) {
+	if(len < 1) {
+		binReply(BIN_OP_SCRIPT_LOAD, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	int32_t rval = scriptLoad(payload[0], &payload[1], len - 1, sizeof(rxBuff));
+
+	binReply(BIN_OP_SCRIPT_LOAD, rval, NULL, 0);
+}
+
+//
+// Run a script (id). Replies with everything its steps read, or with the
+// failing step's error code and index (u8)
+//
+static void binScriptRun(uint8_t *payload, uint16_t len) {
+	if(len != 1) {
+		binReply(BIN_OP_SCRIPT_RUN, BIN_ERR_ARGS, NULL, 0);
+		return;
+	}
+
+	uint32_t rLen;
+	uint32_t stepIndex;
+	int32_t rval = scriptRun(payload[0], rxBuff, &rLen, &stepIndex);
+
+	if(rval == BIN_ERR_ARGS) {
+		binReply(BIN_OP_SCRIPT_RUN, rval, NULL, 0);
+	} else if(rval) {
+		uint8_t step = stepIndex;
+		binReply(BIN_OP_SCRIPT_RUN, rval, &step, sizeof(step));
+	} else {
+		binReply(BIN_OP_SCRIPT_RUN, BIN_OK, rxBuff, rLen);
+	}
+}
+
+//
+// Start (job id + script id + period in ms) or stop (job id) a periodic job.
+// No payload stops all of them.
+//
+static void binJob(uint8_t *payload, uint16_t len) {
+	int32_t rval = 0;
+
+	if(len == 0) {
+		jobStopAll();
+	} else if(len == 1) {
+		rval = jobStop(payload[0]);
+	} else if((len == 6) && scriptLoaded(payload[1])) {
+		uint32_t periodMs = payload[2] | (payload[3] << 8) | (payload[4] << 16) | (payload[5] << 24);
+		rval = jobStart(payload[0], payload[1], periodMs);
+	} else {
+		rval = -1;
+	}
+
+	binReply(BIN_OP_JOB, rval ? BIN_ERR_ARGS : BIN_OK, NULL, 0);
+}
+
+//
+// Run the periodic jobs that are due and send their results
+// Payload: job id (u8) | sequence (u32) | time in us (u32) | drops (u32) |
+//          bytes read by the script (or the failed step's index, u8)
+// Results that don't fit in the tx fifo are dropped (and counted).
+//
+#define JOB_HEADER_SIZE (13)
+static void jobProcess() {
+	jobRun_t run;
+
+	while(jobNext(&run)) {
+		uint32_t rLen;
+		uint32_t stepIndex;
+		int32_t rval = scriptRun(run.scriptId, rxBuff, &rLen, &stepIndex);
+
+		if(rval) {
+			rxBuff[0] = stepIndex;
+			rLen = 1;
+		} else if(rLen > (sizeof(txBuff) - JOB_HEADER_SIZE)) {
+			rval = BIN_ERR_LEN;
+			rLen = 0;
+		}
+
+		uint32_t frameLen = BIN_RESP_HEADER_SIZE + JOB_HEADER_SIZE + rLen + BIN_CRC_SIZE;
+		if(fifoFree(&usbTxFifo) < frameLen) {
+			jobDropped(run.id);
+			continue;
+		}
+
+		txBuff[0] = run.id;
+		memcpy(&txBuff[1], &run.seq, sizeof(run.seq));
+		memcpy(&txBuff[5], &run.timeUs, sizeof(run.timeUs));
+		memcpy(&txBuff[9], &run.drops, sizeof(run.drops));
+		memcpy(&txBuff[JOB_HEADER_SIZE], rxBuff, rLen);
+
+		binReply(BIN_OP_JOB_DATA, rval, txBuff, JOB_HEADER_SIZE + rLen);
+	}
+}
+
+//
+// Send any ADC stream chunks that are ready
+// Payload: first sample index (u32) | drops (u32) | packed 12-bit samples
+// Samples are packed in pairs, a and b, as three bytes:
+// a[7:0] | b[3:0] a[11:8] | b[11:4]
+//
+static void adcStreamProcess() {
+	uint16_t *samples;
+	uint32_t seq;
+	uint32_t drops;
+	uint32_t chunk;
+
+	while((chunk = adcStreamGetChunk(&samples, &seq, &drops)) != 0) {
+		uint32_t count = adcStreamChunkSize();
+		uint8_t *pBuf = txBuff;
+
+		memcpy(pBuf, &seq, sizeof(seq));
+		pBuf += sizeof(seq);
+		memcpy(pBuf, &drops, sizeof(drops));
+		pBuf += sizeof(drops);
+
+		for(uint32_t sample = 0; sample < count; sample += 2) {
+			uint16_t a = samples[sample];
+			uint16_t b = samples[sample + 1];
+			*pBuf++ = a & 0xFF;
+			*pBuf++ = ((a >> 8) & 0x0F) | ((b & 0x0F) << 4);
+			*pBuf++ = b >> 4;
+		}
+
+		adcStreamReleaseChunk(chunk);
+
+		binReply(BIN_OP_ADC_STREAM_DATA, BIN_OK, txBuff, pBuf - txBuff);
+	}
+}
+
+//
+// Process binary protocol frame at the start of the rx fifo
+// (Waits until the whole frame has been received, and until it can start)
+// Returns 1 if a frame was handled
+//
+static uint32_t binaryProcess() {
+	uint32_t inBytes = fifoSize(&usbRxFifo);
+	uint8_t timing = timingEnabled;
+
+	if(inBytes < BIN_CMD_HEADER_SIZE) {
+		return 0;
+	}
+
+	uint8_t opcode = fifoPeek(&usbRxFifo, 1);
+	uint16_t len = fifoPeek(&usbRxFifo, 2) | (fifoPeek(&usbRxFifo, 3) << 8);
+
+	if(len > BIN_MAX_PAYLOAD) {
+		if(asyncBusy()) {
+			return 0;
+		}
+
+		// Too long to handle. Drop the whole frame (the rest of it as it
+		// comes in), so its payload isn't taken for commands.
+		timingRx = DWT->CYCCNT;
+		rxDiscard = BIN_CMD_HEADER_SIZE + len + BIN_CRC_SIZE;
+		rxDiscard -= fifoDiscard(&usbRxFifo, rxDiscard);
+		timingExecStart();
+		binReply(opcode & ~BIN_OP_TAGGED, BIN_ERR_LEN, NULL, 0);
+		timingReport(timing);
+		return 1;
+	}
+
+	if(inBytes < (BIN_CMD_HEADER_SIZE + len + BIN_CRC_SIZE)) {
+		return 0;
+	}
+
+	if(!binCanStart(opcode)) {
+		return 0;
+	}
+
+	timingRx = DWT->CYCCNT;
+
+	fifoRead(&usbRxFifo, (uint8_t *)cmdBuff, BIN_CMD_HEADER_SIZE + len + BIN_CRC_SIZE);
+
+	uint8_t *payload = (uint8_t *)&cmdBuff[BIN_CMD_HEADER_SIZE];
+	uint16_t crc = crc16(0xFFFF, (uint8_t *)&cmdBuff[1], BIN_CMD_HEADER_SIZE - 1 + len);
+
+	timingExecStart();
+
+	// The tag can't be trusted if the CRC is wrong, so that reply isn't
+	// tagged
+	if(crc != (payload[len] | (payload[len + 1] << 8))) {
+		binReply(opcode & ~BIN_OP_TAGGED, BIN_ERR_CRC, NULL, 0);
+		timingReport(timing);
+		return 1;
+	}
+
+	if(opcode & BIN_OP_TAGGED) {
+		opcode &= ~BIN_OP_TAGGED;
+
+		if(len < BIN_TAG_SIZE) {
+			binReply(opcode, BIN_ERR_ARGS, NULL, 0);
+			timingReport(timing);
+			return 1;
+		}
+
+		cmdTag = payload[0];
+		payload += BIN_TAG_SIZE;
+		len -= BIN_TAG_SIZE;
+	}
+
+	switch(opcode) {
+		case BIN_OP_I2C: binI2c(payload, len); break;
+		case BIN_OP_SPI: binSpi(payload, len); break;
+		case BIN_OP_GPIO: binGpio(payload, len); break;
+		case BIN_OP_ADC: binAdc(payload, len); break;
+		case BIN_OP_DAC: binDac(payload, len); break;
+		case BIN_OP_PWM: binPwm(payload, len); break;
+		case BIN_OP_ADC_STREAM: binAdcStream(payload, len); break;
+		case BIN_OP_ADC_SCAN: binAdcScan(payload, len); break;
+		case BIN_OP_GPIO_PORT: binGpioPort(payload, len); break;
+		case BIN_OP_SPI_STREAM: binSpiStream(payload, len); break;
+		case BIN_OP_SCRIPT_LOAD: binScriptLoad(payload, len); break;
+		case BIN_OP_SCRIPT_RUN: binScriptRun(payload, len); break;
+		case BIN_OP_JOB: binJob(payload, len); break;
+		default:
+			binReply(opcode, BIN_ERR_OPCODE, NULL, 0);
+			break;
+	}
+
+	cmdTag = BIN_NO_TAG;
+
+	timingReport(timing);
+
+	return 1;
+}
+
+//
+// Handle the next command, and anything else that's due
+// Returns 1 if a command was handled (there could be more waiting)
+//
+uint32_t consoleProcess() {
+	asyncProcess();
+	adcStreamProcess();
+
+	// Scripts use the buses directly, so jobs wait for tagged commands
+	if(!asyncBusy()) {
+		jobProcess();
+	}
+
+	if(rxDiscard) {
+		rxDiscard -= fifoDiscard(&usbRxFifo, rxDiscard);
+
+		if(rxDiscard) {
+			return 0;
+		}
+	}
+
 	uint32_t inBytes = fifoSize(&usbRxFifo);
+
+	// Binary frames start with a byte that can't start a text command
+	if((inBytes > 0) && (fifoPeek(&usbRxFifo, 0) == BIN_SYNC)) {
+		return binaryProcess();
+	}
+
 	if(inBytes > 0) {
 		uint32_t newLine = 0;
 		for(int32_t index = 0; index < inBytes; index++){
@@ -465,11 +1293,14 @@ void consoleProcess() {
 			newLine = sizeof(cmdBuff) - 1;
 		}
 
-		if(newLine) {
+		// Console commands wait for the tagged ones too
+		if(newLine && !asyncBusy()) {
+			uint8_t timing = timingEnabled;
 			uint8_t *pBuf = (uint8_t *)cmdBuff;
-			while(newLine--){
-				*pBuf++ = fifoPop(&usbRxFifo);
-			}
+
+			timingRx = DWT->CYCCNT;
+
+			pBuf += fifoRead(&usbRxFifo, pBuf, newLine);
 
 			// If it's an \r\n combination, discard the second one
 			if((fifoPeek(&usbRxFifo, 0) == '\n') || (fifoPeek(&usbRxFifo, 0) == '\r')) {
@@ -484,7 +1315,7 @@ void consoleProcess() {
 			argv[argc] = strtok(cmdBuff, " ");
 
 			// Get arguments (if any)
-			while ((argc < sizeof(argv)/sizeof(char *)) && (argv[argc] != NULL)){
+			while ((argc < (sizeof(argv)/sizeof(char *) - 1)) && (argv[argc] != NULL)){
 				argc++;
 				argv[argc] = strtok(NULL, " ");
 			}
@@ -493,16 +1324,25 @@ void consoleProcess() {
 				command_t *command = commands;
 				while(command->commandStr != NULL) {
 					if(strcmp(command->commandStr, argv[0]) == 0) {
-						command->fn(argc, argv);
 						break;
 					}
 					command++;
 				}
 
-				if(command->commandStr == NULL) {
+				timingExecStart();
+
+				if(command->commandStr != NULL) {
+					command->fn(argc, argv);
+				} else {
 					printf("ERR Unknown command '%s'\n", argv[0]);
 				}
+
+				timingReport(timing);
 			}
+
+			return 1;
 		}
 	}
+
+	return 0;
 }
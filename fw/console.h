@@ -7,6 +7,62 @@
 #define TX_RX_BUFF_SIZE (2048)
 #define ARGV_MAX (1024)
 
-void consoleProcess();
+//
+// Binary protocol (see sw/silta/protocol.py for the frame format)
+//
+#define BIN_VERSION (1)
+#define BIN_SYNC (0xA5)
+
+// SYNC + opcode + length
+#define BIN_CMD_HEADER_SIZE (4)
+// SYNC + opcode + status + length
+#define BIN_RESP_HEADER_SIZE (5)
+#define BIN_CRC_SIZE (2)
+
+#define BIN_OP_ASYNC (0x80)
+
+// Tagged commands have a tag byte at the start of the payload, which is sent
+// back at the start of their response's payload
+#define BIN_OP_TAGGED (0x40)
+#define BIN_TAG_SIZE (1)
+#define BIN_NO_TAG (-1)
+
+// Largest payload: tag + i2c address + read length + TX_RX_BUFF_SIZE write
+// bytes
+#define BIN_MAX_PAYLOAD (BIN_TAG_SIZE + 3 + TX_RX_BUFF_SIZE)
+
+typedef enum {
+	BIN_OP_I2C = 0x01,
+	BIN_OP_SPI = 0x02,
+	BIN_OP_GPIO = 0x03,
+	BIN_OP_ADC = 0x04,
+	BIN_OP_DAC = 0x05,
+	BIN_OP_PWM = 0x06,
+	BIN_OP_ADC_STREAM = 0x07,
+	BIN_OP_ADC_SCAN = 0x08,
+	BIN_OP_GPIO_PORT = 0x09,
+	BIN_OP_SPI_STREAM = 0x0A,
+	BIN_OP_SCRIPT_LOAD = 0x0C,
+	BIN_OP_SCRIPT_RUN = 0x0D,
+	BIN_OP_JOB = 0x0E,
+
+	// Unsolicited frames (not a response to a command) have the top bit set
+	BIN_OP_ADC_STREAM_DATA = BIN_OP_ASYNC | BIN_OP_ADC_STREAM,
+	BIN_OP_TIMING_DATA = BIN_OP_ASYNC | 0x0B,
+	BIN_OP_JOB_DATA = BIN_OP_ASYNC | BIN_OP_JOB,
+} binOpcode_t;
+
+typedef enum {
+	BIN_OK = 0,
+	BIN_ERR_CRC = -100,
+	BIN_ERR_OPCODE = -101,
+	BIN_ERR_ARGS = -102,
+	BIN_ERR_LEN = -103,
+} binStatus_t;
+
+// Optional commands this firmware supports (reported by caps)
+#define CAPS_FEATURES "adcscan,adcstream,gpioport,spistream,timing,script,jobs,tagged"
+
+uint32_t consoleProcess();
 
 #endif
@@ -5,6 +5,7 @@
 // by Alvaro Prieto
 //
 ///////////////////////////////////////////////////////////////////////////////
+#include <string.h>
 #include "fifo.h"
 #include "stm32f4xx.h"
 
@@ -33,6 +34,13 @@ uint32_t fifoSize(fifo_t *fifo) {
 	return (fifo->end - fifo->start) & fifo->sizeMask;
 }
 
+//
+// Return number of bytes that can be pushed without dropping any
+//
+uint32_t fifoFree(fifo_t *fifo) {
+	return fifo->sizeMask - fifoSize(fifo);
+}
+
 //
 // Push character into fifo
 //
@@ -83,3 +91,86 @@ uint8_t fifoPeek(fifo_t *fifo, uint32_t byte) {
 	return fifo->buff[(fifo->start + byte) & fifo->sizeMask];
 }
 
+//
+// Push len bytes into fifo (like fifoPush, the oldest ones are dropped if
+// they don't fit). Returns the number of bytes dropped.
+//
+uint32_t fifoWrite(fifo_t *fifo, const uint8_t *buff, uint32_t len) {
+	uint32_t dropped = 0;
+
+	// Only the last sizeMask bytes can fit
+	if(len > fifo->sizeMask) {
+		dropped = len - fifo->sizeMask;
+		buff += dropped;
+		len = fifo->sizeMask;
+	}
+
+	__disable_irq();
+
+	uint32_t free = fifoFree(fifo);
+	uint32_t first = fifo->sizeMask + 1 - fifo->end;
+
+	if(first > len) {
+		first = len;
+	}
+
+	memcpy(&fifo->buff[fifo->end], buff, first);
+	memcpy(fifo->buff, &buff[first], len - first);
+	fifo->end = (fifo->end + len) & fifo->sizeMask;
+
+	if(len > free) {
+		fifo->start = (fifo->start + len - free) & fifo->sizeMask;
+		dropped += len - free;
+	}
+
+	__enable_irq();
+
+	return dropped;
+}
+
+//
+// Pop up to len bytes from fifo. Returns the number of bytes read.
+//
+uint32_t fifoRead(fifo_t *fifo, uint8_t *buff, uint32_t len) {
+
+	__disable_irq();
+
+	uint32_t size = fifoSize(fifo);
+	uint32_t first = fifo->sizeMask + 1 - fifo->start;
+
+	if(len > size) {
+		len = size;
+	}
+
+	if(first > len) {
+		first = len;
+	}
+
+	memcpy(buff, &fifo->buff[fifo->start], first);
+	memcpy(&buff[first], fifo->buff, len - first);
+	fifo->start = (fifo->start + len) & fifo->sizeMask;
+
+	__enable_irq();
+
+	return len;
+}
+
+//
+// Drop up to len bytes from the start of fifo. Returns the number dropped.
+//
+uint32_t fifoDiscard(fifo_t *fifo, uint32_t len) {
+
+	__disable_irq();
+
+	uint32_t size = fifoSize(fifo);
+
+	if(len > size) {
+		len = size;
+	}
+
+	fifo->start = (fifo->start + len) & fifo->sizeMask;
+
+	__enable_irq();
+
+	return len;
+}
@@ -19,8 +19,12 @@ typedef struct {
 
 int32_t fifoInit(fifo_t *fifo, uint32_t size, void *buff);
 uint32_t fifoSize(fifo_t *fifo);
+uint32_t fifoFree(fifo_t *fifo);
 uint8_t fifoPush(fifo_t *fifo, uint8_t byte);
 uint8_t fifoPop(fifo_t *fifo);
 uint8_t fifoPeek(fifo_t *fifo, uint32_t byte);
+uint32_t fifoWrite(fifo_t *fifo, const uint8_t *buff, uint32_t len);
+uint32_t fifoRead(fifo_t *fifo, uint8_t *buff, uint32_t len);
+uint32_t fifoDiscard(fifo_t *fifo, uint32_t len);
 
 #endif
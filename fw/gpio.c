@@ -25,3 +25,16 @@ int32_t gpioSet(GPIO_TypeDef *GPIOx, uint8_t pin, uint8_t value) {
 int32_t gpioGet(GPIO_TypeDef *GPIOx, uint8_t pin) {
 	return GPIO_ReadInputDataBit(GPIOx, (1 << pin));
 }
+
+uint16_t gpioPortGet(GPIO_TypeDef *GPIOx) {
+	return GPIOx->IDR;
+}
+
+//
+// Set the pins in mask to the matching bits in value, leaving the rest alone.
+// Done with a single BSRR write, so all pins change at the same time.
+//
+void gpioPortSet(GPIO_TypeDef *GPIOx, uint16_t mask, uint16_t value) {
+	// BSRRL (set) and BSRRH (reset) are the two halves of the 32-bit BSRR
+	*(__IO uint32_t *)&GPIOx->BSRRL = (uint32_t)(mask & value) | ((uint32_t)(mask & ~value) << 16);
+}
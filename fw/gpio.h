@@ -6,5 +6,7 @@
 void gpioInit();
 int32_t gpioSet(GPIO_TypeDef *GPIOx, uint8_t pin, uint8_t value);
 int32_t gpioGet(GPIO_TypeDef *GPIOx, uint8_t pin);
+uint16_t gpioPortGet(GPIO_TypeDef *GPIOx);
+void gpioPortSet(GPIO_TypeDef *GPIOx, uint16_t mask, uint16_t value);
 
 #endif
@@ -10,21 +10,173 @@
 #define I2C_TIMEOUT_MS (50)
 
 extern volatile uint32_t tickMs;
-static volatile uint32_t i2cErr = 0;
+extern volatile uint32_t wakeEvent;
 I2C_InitTypeDef i2cConfig;
 
+typedef enum {
+	I2C_STATE_IDLE = 0,
+	I2C_STATE_WAIT_BUS,	// Waiting for the bus to be free before starting
+	I2C_STATE_WRITE,
+	I2C_STATE_READ,
+	I2C_STATE_DONE,
+} i2cState_t;
+
+//
+// Transfer in progress. It's run by the event/error interrupts, one step per
+// interrupt, so the main loop is free to do other things in the meantime.
+//
+static volatile struct {
+	i2cState_t state;
+	int32_t status;
+	uint32_t lastMs;	// Last time the transfer made progress
+	uint8_t addr;
+	uint8_t addressed;	// Address was ACKed (a NACK after this is a data NACK)
+	uint16_t wLeft;
+	uint16_t rLeft;
+	uint8_t *wBuff;
+	uint8_t *rBuff;
+} xfer;
+
 void i2cSelectPin(GPIO_TypeDef *GPIOx, uint32_t pin);
 
+static void i2cFinish(int32_t status) {
+	I2C1->CR2 &= ~(I2C_CR2_ITEVTEN | I2C_CR2_ITBUFEN | I2C_CR2_ITERREN);
+	I2C1->CR1 &= ~I2C_CR1_POS;
+
+	xfer.status = status;
+	xfer.state = I2C_STATE_DONE;
+
+	wakeEvent = 1;
+}
+
+static void i2cBegin() {
+	xfer.addressed = 0;
+	xfer.state = (xfer.wLeft > 0) ? I2C_STATE_WRITE : I2C_STATE_READ;
+
+	I2C1->CR2 |= I2C_CR2_ITEVTEN | I2C_CR2_ITBUFEN | I2C_CR2_ITERREN;
+	I2C1->CR1 |= I2C_CR1_START;
+}
+
+//
+// Reads follow the sequences in the reference manual: the last bytes are
+// read on BTF (with SCL stretched), so ACK and STOP can be set in time no
+// matter how late the interrupt is serviced.
+//
+static void i2cReadEvent(uint32_t sr1) {
+	if((xfer.rLeft > 3) && (sr1 & I2C_SR1_RXNE)) {
+		*xfer.rBuff++ = I2C1->DR;
+
+		if(--xfer.rLeft == 3) {
+			I2C1->CR2 &= ~I2C_CR2_ITBUFEN;
+		}
+	} else if((xfer.rLeft == 1) && (sr1 & I2C_SR1_RXNE)) {
+		// STOP was set when the address was sent
+		*xfer.rBuff++ = I2C1->DR;
+		xfer.rLeft = 0;
+		i2cFinish(I2C_OK);
+	} else if((xfer.rLeft == 3) && (sr1 & I2C_SR1_BTF)) {
+		// N-2 in DR, N-1 in the shift register. NACK the last one
+		I2C1->CR1 &= ~I2C_CR1_ACK;
+		*xfer.rBuff++ = I2C1->DR;
+		xfer.rLeft = 2;
+	} else if((xfer.rLeft == 2) && (sr1 & I2C_SR1_BTF)) {
+		I2C1->CR1 |= I2C_CR1_STOP;
+		*xfer.rBuff++ = I2C1->DR;
+		*xfer.rBuff++ = I2C1->DR;
+		xfer.rLeft = 0;
+		i2cFinish(I2C_OK);
+	}
+}
+
+static void i2cWriteEvent(uint32_t sr1) {
+	if(!(sr1 & (I2C_SR1_TXE | I2C_SR1_BTF))) {
+		return;
+	}
+
+	if(xfer.wLeft > 0) {
+		I2C1->DR = *xfer.wBuff++;
+		xfer.wLeft--;
+	} else if(!(sr1 & I2C_SR1_BTF)) {
+		// Last byte is on its way out, wait for it without TXE interrupts
+		I2C1->CR2 &= ~I2C_CR2_ITBUFEN;
+	} else if(xfer.rLeft > 0) {
+		// Repeated start for the read
+		xfer.state = I2C_STATE_READ;
+		xfer.addressed = 0;
+		I2C1->CR2 |= I2C_CR2_ITBUFEN;
+		I2C1->CR1 |= I2C_CR1_START;
+	} else {
+		I2C1->CR1 |= I2C_CR1_STOP;
+		i2cFinish(I2C_OK);
+	}
+}
+
 void I2C1_EV_IRQHandler(void) {
+	uint32_t sr1 = I2C1->SR1;
+
+	if((xfer.state != I2C_STATE_WRITE) && (xfer.state != I2C_STATE_READ)) {
+		// Nothing to do (e.g. the transfer timed out). Don't keep firing.
+		I2C1->CR2 &= ~(I2C_CR2_ITEVTEN | I2C_CR2_ITBUFEN);
+		return;
+	}
 
+	// The timeout is for a stalled transfer, not a long one
+	xfer.lastMs = tickMs;
+
+	if(sr1 & I2C_SR1_SB) {
+		if(xfer.state == I2C_STATE_WRITE) {
+			I2C1->DR = xfer.addr & 0xFE;
+		} else {
+			I2C1->DR = xfer.addr | 1;
+		}
+	} else if(sr1 & I2C_SR1_ADDR) {
+		xfer.addressed = 1;
+
+		if(xfer.state == I2C_STATE_WRITE) {
+			(void)I2C1->SR2; // Clear ADDR bit
+		} else if(xfer.rLeft == 1) {
+			I2C1->CR1 &= ~I2C_CR1_ACK;
+			(void)I2C1->SR2;
+			I2C1->CR1 |= I2C_CR1_STOP;
+		} else if(xfer.rLeft == 2) {
+			I2C1->CR1 &= ~I2C_CR1_ACK;
+			I2C1->CR1 |= I2C_CR1_POS;
+			I2C1->CR2 &= ~I2C_CR2_ITBUFEN;
+			(void)I2C1->SR2;
+		} else {
+			I2C1->CR1 |= I2C_CR1_ACK;
+			if(xfer.rLeft == 3) {
+				I2C1->CR2 &= ~I2C_CR2_ITBUFEN;
+			}
+			(void)I2C1->SR2;
+		}
+	} else if(!xfer.addressed) {
+		// BTF from the write can still be set until the repeated start
+		return;
+	} else if(xfer.state == I2C_STATE_WRITE) {
+		i2cWriteEvent(sr1);
+	} else {
+		i2cReadEvent(sr1);
+	}
 }
 
 void I2C1_ER_IRQHandler(void) {
 	uint32_t sr1 = I2C1->SR1;
-	uint32_t sr2 = I2C1->SR2;
+	int32_t status = I2C_ERR;
+
+	// Error flags are cleared by writing 0 to them
+	I2C1->SR1 = ~(sr1 & (I2C_SR1_AF | I2C_SR1_BERR | I2C_SR1_ARLO | I2C_SR1_OVR));
+
+	if((xfer.state != I2C_STATE_WRITE) && (xfer.state != I2C_STATE_READ)) {
+		return;
+	}
+
+	if(sr1 & I2C_SR1_AF) {
+		status = xfer.addressed ? I2C_DNACK : I2C_ANACK;
+	}
 
-	i2cErr = sr1 | (sr2 << 16);
-	I2C_ITConfig(I2C1, I2C_IT_ERR, DISABLE);
+	I2C1->CR1 |= I2C_CR1_STOP;
+	i2cFinish(status);
 }
 
 void i2cSetSpeed(uint32_t speed) {
@@ -46,9 +198,13 @@ void i2cSetup() {
 
 	I2C_Init(I2C1, &i2cConfig);
 
-	I2C_ITConfig(I2C1, I2C_IT_ERR, ENABLE);
+	// Left at the highest priority (0), so USB can't delay the reads' ACK
+	// and STOP changes
+	NVIC_EnableIRQ(I2C1_EV_IRQn);
 	NVIC_EnableIRQ(I2C1_ER_IRQn);
 
+	xfer.state = I2C_STATE_IDLE;
+
 	I2C_Cmd(I2C1, ENABLE);
 
 }
@@ -97,158 +253,92 @@ void i2c1SelectPins(uint32_t GPIO_Pins) {
 	i2cSetup();
 }
 
-int32_t i2c(I2C_TypeDef* I2Cx, uint8_t addr, uint16_t wLen, uint8_t *wBuff, uint16_t rLen, uint8_t *rBuff) {
-	int32_t rval = 0;
-	uint32_t reg;
-	uint32_t timeout;
+//
+// Start a transfer (write wLen bytes, then read rLen with a repeated start)
+// and return right away. Use i2cPoll to find out when it's done. The buffers
+// have to stay around until then.
+// Only I2C1 is supported.
+//
+int32_t i2cStart(I2C_TypeDef* I2Cx, uint8_t addr, uint16_t wLen, uint8_t *wBuff, uint16_t rLen, uint8_t *rBuff) {
+	if((I2Cx != I2C1) || i2cBusy()) {
+		return I2C_ERR;
+	}
 
-	do {
-		i2cErr = 0;
+	xfer.addr = addr;
+	xfer.wLeft = wLen;
+	xfer.wBuff = wBuff;
+	xfer.rLeft = rLen;
+	xfer.rBuff = rBuff;
+	xfer.lastMs = tickMs;
+
+	if((wLen == 0) && (rLen == 0)) {
+		xfer.status = I2C_OK;
+		xfer.state = I2C_STATE_DONE;
+	} else if(I2C1->SR2 & I2C_SR2_BUSY) {
+		// Someone else is holding the bus, try again from i2cPoll
+		xfer.state = I2C_STATE_WAIT_BUS;
+	} else {
+		i2cBegin();
+	}
 
-		timeout = tickMs + I2C_TIMEOUT_MS;
-		while((I2Cx->SR2 & I2C_SR2_BUSY) && (tickMs < timeout)) {
-		}
+	return I2C_OK;
+}
 
-		if (tickMs >= timeout) {
-			rval = I2C_TIMEOUT;
-			break;
+//
+// Check on the transfer in progress (called from the main loop)
+// Returns 1 once it's done (see i2cResult), 0 if it's still going.
+//
+uint32_t i2cPoll() {
+	if(xfer.state == I2C_STATE_WAIT_BUS) {
+		if(!(I2C1->SR2 & I2C_SR2_BUSY)) {
+			i2cBegin();
+		} else if((tickMs - xfer.lastMs) >= I2C_TIMEOUT_MS) {
+			xfer.status = I2C_TIMEOUT;
+			xfer.state = I2C_STATE_DONE;
 		}
+	}
 
-		I2C_ITConfig(I2C1, I2C_IT_ERR, ENABLE);
-
-		if(wLen > 0) {
-			// Generate start condition
-			I2Cx->CR1 |= I2C_CR1_START;
-
-			// Wait for start condition to be generated
-			while(!(I2Cx->SR1 & I2C_SR1_SB) && (tickMs < timeout)) {
-
-			}
-
-			if (tickMs >= timeout) {
-				rval = I2C_ERR;
-				break;
-			}
-
-			// Write address
-			I2Cx->DR = addr & 0xFE;
-
-			// Wait for address to be sent
-			do {
-				reg = I2Cx->SR1;
-			} while(!(reg & I2C_SR1_ADDR) && !i2cErr && (tickMs < timeout));
-
-			if (tickMs >= timeout) {
-				rval = I2C_ERR;
-				break;
-			}
-
-			if((reg & I2C_SR1_AF) || (i2cErr & I2C_SR1_AF)) {
-				I2Cx->SR1 &= ~I2C_SR1_AF; // Clear ack failure bit
-				rval = I2C_ANACK;
-				break;
-			}
-
-			reg = I2Cx->SR2; // Clear ADDR bit
-
-			while(wLen--) {
-				I2Cx->DR = *wBuff++;
-
-				// Wait for address to be sent
-				do {
-					reg = I2Cx->SR1;
-				} while(!(reg & (I2C_SR1_BTF | I2C_SR1_AF)) && !i2cErr && (tickMs < timeout));
-
-				if (tickMs >= timeout) {
-					rval = I2C_ERR;
-					break;
-				}
-
-				if(reg & I2C_SR1_AF || (i2cErr & I2C_SR1_AF)) {
-					I2Cx->SR1 &= ~I2C_SR1_AF; // Clear ack failure bit
-					rval = I2C_DNACK;
-					break;
-				}
-			}
-
-			// Some error occurred
-			if(rval) {
-				break;
-			}
+	if(((xfer.state == I2C_STATE_WRITE) || (xfer.state == I2C_STATE_READ)) &&
+			((tickMs - xfer.lastMs) >= I2C_TIMEOUT_MS)) {
+		// The interrupts could finish it in the meantime
+		__disable_irq();
+		if(xfer.state != I2C_STATE_DONE) {
+			I2C1->CR1 |= I2C_CR1_STOP;
+			i2cFinish(I2C_ERR);
 		}
+		__enable_irq();
+	}
 
-		if(rLen > 0) {
-			// Generate start condition
-			I2Cx->CR1 |= I2C_CR1_START;
-
-			// Wait for start condition to be generated
-			while(!(I2Cx->SR1 & I2C_SR1_SB) && (tickMs < timeout)) {
-			}
-
-			if (tickMs >= timeout) {
-				rval = I2C_ERR;
-				break;
-			}
-
-			// Write address
-			I2Cx->DR = addr | 1;
-
-			// Wait for address to be sent
-			do {
-				reg = I2Cx->SR1;
-			} while(!(reg & I2C_SR1_ADDR) && !i2cErr && (tickMs < timeout));
-
-			if (tickMs >= timeout) {
-				rval = I2C_ERR;
-				break;
-			}
-
-			if((reg & I2C_SR1_AF) || (i2cErr & I2C_SR1_AF)) {
-				I2Cx->SR1 &= ~I2C_SR1_AF; // Clear ack failure bit
-				rval = I2C_ANACK;
-				break;
-			}
-
-			if(rLen > 1) {
-				I2Cx->CR1 |= I2C_CR1_ACK;
-			} else {
-				I2Cx->CR1 &= ~I2C_CR1_ACK;
-				// I2Cx->CR1 |= I2C_CR1_POS;
-			}
-
-			reg = I2Cx->SR1;
-			reg = I2Cx->SR2; // Clear ADDR bit
-
-			while(rLen--) {
-				do {
-					reg = I2Cx->SR1;
-				} while(!(reg & (I2C_SR1_RXNE)) && !i2cErr && (tickMs < timeout));
+	return (xfer.state == I2C_STATE_DONE) || (xfer.state == I2C_STATE_IDLE);
+}
 
-				if (tickMs >= timeout) {
-					rval = I2C_ERR;
-					break;
-				}
+uint32_t i2cBusy() {
+	return (xfer.state != I2C_STATE_IDLE) && (xfer.state != I2C_STATE_DONE);
+}
 
-				if(reg & I2C_SR1_AF || (i2cErr & I2C_SR1_AF)) {
-					I2Cx->SR1 &= ~I2C_SR1_AF; // Clear ack failure bit
-					rval = I2C_DNACK;
-					break;
-				}
+//
+// Result of the last transfer (frees the driver for the next one)
+//
+int32_t i2cResult() {
+	int32_t status = xfer.status;
 
-				if(rLen == 1) {
-					I2Cx->CR1 &= ~I2C_CR1_ACK;
-				}
+	xfer.state = I2C_STATE_IDLE;
 
-				*rBuff++ = I2Cx->DR;
-			}
-		}
+	return status;
+}
 
-	} while(0);
+//
+// Blocking transfer
+//
+int32_t i2c(I2C_TypeDef* I2Cx, uint8_t addr, uint16_t wLen, uint8_t *wBuff, uint16_t rLen, uint8_t *rBuff) {
+	int32_t rval = i2cStart(I2Cx, addr, wLen, wBuff, rLen, rBuff);
 
-	// Generate stop condition
-	I2Cx->CR1 |= I2C_CR1_STOP;
+	if(rval) {
+		return rval;
+	}
 
-	I2C_ITConfig(I2C1, I2C_IT_ERR, DISABLE);
+	while(!i2cPoll()) {
+	}
 
-	return rval;
+	return i2cResult();
 }
@@ -22,4 +22,10 @@ void i2cSetSpeed(uint32_t speed);
 void i2c1SelectPins(uint32_t GPIO_Pins);
 int32_t i2c(I2C_TypeDef* I2Cx, uint8_t addr, uint16_t wLen, uint8_t *wBuff, uint16_t rLen, uint8_t *rBuff);
 
+// Non-blocking transfers (see i2c.c)
+int32_t i2cStart(I2C_TypeDef* I2Cx, uint8_t addr, uint16_t wLen, uint8_t *wBuff, uint16_t rLen, uint8_t *rBuff);
+uint32_t i2cPoll();
+uint32_t i2cBusy();
+int32_t i2cResult();
+
 #endif
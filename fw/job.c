@@ -0,0 +1,118 @@
+#include <stdint.h>
+#include "stm32f4xx_conf.h"
+#include "stm32f4xx.h"
+#include "job.h"
+
+extern volatile uint32_t tickMs;
+
+typedef struct {
+	uint8_t active;
+	uint8_t scriptId;
+	uint32_t periodMs;
+	uint32_t nextMs;
+	uint32_t seq;
+	uint32_t drops;
+} job_t;
+
+static job_t jobs[JOB_SLOTS];
+
+// Where jobNext starts looking, so a busy job can't starve the others
+static uint8_t nextJob;
+
+//
+// Microseconds since boot (wraps around every ~71 minutes)
+//
+uint32_t jobTimeUs() {
+	uint32_t ms;
+	uint32_t count;
+
+	// Read again if the tick changed in the middle
+	do {
+		ms = tickMs;
+		count = SysTick->VAL;
+	} while(ms != tickMs);
+
+	// SysTick counts down from LOAD to 0 every ms
+	return ms * 1000 + (SysTick->LOAD - count) / (SystemCoreClock / 1000000);
+}
+
+//
+// Run script scriptId every periodMs, starting now
+// (replaces job id if it's already running)
+//
+int32_t jobStart(uint8_t id, uint8_t scriptId, uint32_t periodMs) {
+	if((id >= JOB_SLOTS) || (periodMs == 0)) {
+		return -1;
+	}
+
+	jobs[id].active = 0;
+	jobs[id].scriptId = scriptId;
+	jobs[id].periodMs = periodMs;
+	jobs[id].nextMs = tickMs;
+	jobs[id].seq = 0;
+	jobs[id].drops = 0;
+	jobs[id].active = 1;
+
+	return 0;
+}
+
+int32_t jobStop(uint8_t id) {
+	if(id >= JOB_SLOTS) {
+		return -1;
+	}
+
+	jobs[id].active = 0;
+
+	return 0;
+}
+
+void jobStopAll() {
+	for(uint8_t id = 0; id < JOB_SLOTS; id++) {
+		jobs[id].active = 0;
+	}
+}
+
+//
+// Get the next job that's due (returns 0 if there aren't any)
+// Runs that were missed, because the main loop was busy for longer than a
+// period, are skipped and counted as drops.
+//
+uint32_t jobNext(jobRun_t *run) {
+	uint32_t now = tickMs;
+
+	for(uint8_t count = 0; count < JOB_SLOTS; count++) {
+		uint8_t id = (nextJob + count) % JOB_SLOTS;
+		job_t *job = &jobs[id];
+
+		if(!job->active || ((int32_t)(now - job->nextMs) < 0)) {
+			continue;
+		}
+
+		uint32_t missed = (now - job->nextMs) / job->periodMs;
+
+		job->seq += missed;
+		job->drops += missed;
+		job->nextMs += (missed + 1) * job->periodMs;
+
+		run->id = id;
+		run->scriptId = job->scriptId;
+		run->seq = job->seq++;
+		run->timeUs = jobTimeUs();
+		run->drops = job->drops;
+
+		nextJob = (id + 1) % JOB_SLOTS;
+
+		return 1;
+	}
+
+	return 0;
+}
+
+//
+// A run's results couldn't be sent
+//
+void jobDropped(uint8_t id) {
+	if(id < JOB_SLOTS) {
+		jobs[id].drops++;
+	}
+}
@@ -0,0 +1,28 @@
+#ifndef __JOB_H__
+#define __JOB_H__
+
+#include <stdint.h>
+
+//
+// Periodic jobs: run a script (see script.h) every period ms, with the
+// results pushed to the host as they come in
+//
+
+#define JOB_SLOTS (8)
+
+typedef struct {
+	uint8_t id;
+	uint8_t scriptId;
+	uint32_t seq;
+	uint32_t timeUs;
+	uint32_t drops;
+} jobRun_t;
+
+int32_t jobStart(uint8_t id, uint8_t scriptId, uint32_t periodMs);
+int32_t jobStop(uint8_t id);
+void jobStopAll();
+uint32_t jobNext(jobRun_t *run);
+void jobDropped(uint8_t id);
+uint32_t jobTimeUs();
+
+#endif
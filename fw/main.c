@@ -20,6 +20,10 @@
 #define LED_OFF_MS	(990)
 
 volatile uint32_t tickMs = 0;
+
+// Set by interrupts that leave work for the main loop (received data, a
+// finished transfer), so it doesn't go to sleep with work pending
+volatile uint32_t wakeEvent = 0;
 __ALIGN_BEGIN USB_OTG_CORE_HANDLE  USB_OTG_dev __ALIGN_END;
 
 extern char usbSerialNo[];
@@ -46,8 +50,13 @@ int main(void) {
 
 	nextBlink = tickMs + LED_OFF_MS;
 	for(;;) {
+		uint32_t busy;
+
+		wakeEvent = 0;
+		busy = consoleProcess();
 
-		consoleProcess();
+		// Send what this pass wrote out (in as few packets as possible)
+		usbTxFlush();
 
 		if(tickMs > nextBlink) {
 
@@ -61,7 +70,14 @@ int main(void) {
 			blinkState ^= 1;
 		}
 
-		__WFI();
+		// Sleep until the next interrupt, unless there's more to do already.
+		// With interrupts masked, one that fires after the check still
+		// wakes WFI up (it's handled right after).
+		__disable_irq();
+		if(!busy && !wakeEvent) {
+			__WFI();
+		}
+		__enable_irq();
 
 	}
 
@@ -88,6 +104,11 @@ void init() {
 		while (1){};
 	}
 
+	// ---------- DWT cycle counter (command timing) -------- //
+	CoreDebug->DEMCR |= CoreDebug_DEMCR_TRCENA_Msk;
+	DWT->CYCCNT = 0;
+	DWT->CTRL |= DWT_CTRL_CYCCNTENA_Msk;
+
 	// ---------- GPIO -------- //
 	// GPIOD Periph clock enable
 	RCC_AHB1PeriphClockCmd(RCC_AHB1Periph_GPIOD, ENABLE);
@@ -0,0 +1,215 @@
+#include <stdint.h>
+#include <string.h>
+#include "stm32f4xx_conf.h"
+#include "stm32f4xx.h"
+#include "console.h"
+#include "script.h"
+#include "i2c.h"
+#include "spi.h"
+#include "gpio.h"
+#include "adc.h"
+
+static uint8_t scripts[SCRIPT_SLOTS][SCRIPT_MAX_SIZE];
+static uint16_t scriptLens[SCRIPT_SLOTS];
+
+static uint16_t getU16(const uint8_t *buff) {
+	return buff[0] | (buff[1] << 8);
+}
+
+static uint32_t getU32(const uint8_t *buff) {
+	return buff[0] | (buff[1] << 8) | (buff[2] << 16) | ((uint32_t)buff[3] << 24);
+}
+
+static GPIO_TypeDef *getPort(uint8_t port) {
+	return (GPIO_TypeDef *)(GPIOA_BASE + (uint32_t)port * (GPIOB_BASE - GPIOA_BASE));
+}
+
+//
+// Size of the step at the start of step (len bytes left in the script), and
+// how many bytes it reads. Returns 0 if the step is invalid.
+//
+static uint32_t stepSize(const uint8_t *step, uint32_t len, uint32_t *readLen) {
+	uint32_t size = 0;
+
+	*readLen = 0;
+
+	switch(step[0]) {
+		case SCRIPT_STEP_I2C:
+			// addr | rlen | wlen | wbytes
+			if(len >= 6) {
+				size = 6 + getU16(&step[4]);
+				*readLen = getU16(&step[2]);
+			}
+			break;
+
+		case SCRIPT_STEP_SPI:
+			// hold cs | len | wbytes
+			if(len >= 4) {
+				size = 4 + getU16(&step[2]);
+				*readLen = getU16(&step[2]);
+			}
+			break;
+
+		case SCRIPT_STEP_GPIO:
+			// port | pin | value
+			if((len >= 4) && (step[1] <= ('E' - 'A')) && (step[2] <= 15)) {
+				size = 4;
+				*readLen = (step[3] == SCRIPT_GPIO_READ) ? 1 : 0;
+			}
+			break;
+
+		case SCRIPT_STEP_SPI_CS:
+			// port | pin
+			if((len >= 3) && (step[1] <= ('E' - 'A')) && (step[2] <= 15)) {
+				size = 3;
+			}
+			break;
+
+		case SCRIPT_STEP_DELAY:
+			// microseconds
+			if((len >= 5) && (getU32(&step[1]) <= SCRIPT_MAX_DELAY_US)) {
+				size = 5;
+			}
+			break;
+
+		case SCRIPT_STEP_ADC:
+			// adc number
+			if(len >= 2) {
+				size = 2;
+				*readLen = sizeof(uint16_t);
+			}
+			break;
+	}
+
+	if(size > len) {
+		size = 0;
+	}
+
+	return size;
+}
+
+//
+// Busy wait (the cycle counter is enabled in init())
+//
+static void delayUs(uint32_t us) {
+	uint32_t start = DWT->CYCCNT;
+	uint32_t cycles = us * (SystemCoreClock / 1000000);
+
+	while((DWT->CYCCNT - start) < cycles);
+}
+
+//
+// Store a script in slot id. An empty script deletes it.
+// Every step is checked here, so scriptRun doesn't have to.
+// maxRead is the most a script can read (the size of scriptRun's buffer)
+//
+int32_t scriptLoad(uint8_t id, const uint8_t *steps, uint32_t len, uint32_t maxRead) {
+	uint32_t offset = 0;
+	uint32_t totalRead = 0;
+
+	if(id >= SCRIPT_SLOTS) {
+		return BIN_ERR_ARGS;
+	}
+
+	if(len > SCRIPT_MAX_SIZE) {
+		return BIN_ERR_LEN;
+	}
+
+	while(offset < len) {
+		uint32_t readLen;
+		uint32_t size = stepSize(&steps[offset], len - offset, &readLen);
+
+		if(size == 0) {
+			return BIN_ERR_ARGS;
+		}
+
+		offset += size;
+		totalRead += readLen;
+	}
+
+	if(totalRead > maxRead) {
+		return BIN_ERR_LEN;
+	}
+
+	memcpy(scripts[id], steps, len);
+	scriptLens[id] = len;
+
+	return BIN_OK;
+}
+
+uint32_t scriptLoaded(uint8_t id) {
+	return (id < SCRIPT_SLOTS) && (scriptLens[id] != 0);
+}
+
+//
+// Run script id, reading into rBuff. Stops at the first step that fails.
+// Returns that step's error code (and its index in stepIndex), or 0 if they
+// all succeeded. rLen is set to the number of bytes read either way.
+//
+int32_t scriptRun(uint8_t id, uint8_t *rBuff, uint32_t *rLen, uint32_t *stepIndex) {
+	int32_t rval = 0;
+	uint32_t offset = 0;
+	uint8_t *rPtr = rBuff;
+
+	*rLen = 0;
+	*stepIndex = 0;
+
+	if(!scriptLoaded(id)) {
+		return BIN_ERR_ARGS;
+	}
+
+	while(offset < scriptLens[id]) {
+		uint8_t *step = &scripts[id][offset];
+		uint32_t readLen;
+
+		offset += stepSize(step, scriptLens[id] - offset, &readLen);
+
+		switch(step[0]) {
+			case SCRIPT_STEP_I2C:
+				rval = i2c(I2C1, step[1], getU16(&step[4]), &step[6], readLen, rPtr);
+				break;
+
+			case SCRIPT_STEP_SPI:
+				rval = spiTransfer(0, readLen, &step[4], rPtr, step[1] ? SPI_HOLD_CS : 0);
+				break;
+
+			case SCRIPT_STEP_GPIO:
+				if(step[3] == SCRIPT_GPIO_READ) {
+					*rPtr = gpioGet(getPort(step[1]), step[2]);
+				} else {
+					gpioSet(getPort(step[1]), step[2], step[3]);
+				}
+				break;
+
+			case SCRIPT_STEP_SPI_CS:
+				rval = spiSetCS(0, getPort(step[1]), step[2]);
+				break;
+
+			case SCRIPT_STEP_DELAY:
+				delayUs(getU32(&step[1]));
+				break;
+
+			case SCRIPT_STEP_ADC: {
+				int32_t value = adcRead(step[1]);
+				if(value < 0) {
+					rval = value;
+				} else {
+					rPtr[0] = value & 0xFF;
+					rPtr[1] = value >> 8;
+				}
+				break;
+			}
+		}
+
+		if(rval) {
+			break;
+		}
+
+		rPtr += readLen;
+		(*stepIndex)++;
+	}
+
+	*rLen = rPtr - rBuff;
+
+	return rval;
+}
@@ -0,0 +1,34 @@
+#ifndef __SCRIPT_H__
+#define __SCRIPT_H__
+
+#include <stdint.h>
+
+//
+// Device scripts: short sequences of i2c/spi/gpio/delay steps that are
+// uploaded once and then run with a single command
+// (see sw/silta/protocol.py for the step format)
+//
+
+#define SCRIPT_SLOTS (16)
+#define SCRIPT_MAX_SIZE (256)
+
+// Longest single delay step
+#define SCRIPT_MAX_DELAY_US (1000000)
+
+// GPIO step value that reads the pin instead of setting it
+#define SCRIPT_GPIO_READ (0xFF)
+
+typedef enum {
+	SCRIPT_STEP_I2C = 0x01,
+	SCRIPT_STEP_SPI = 0x02,
+	SCRIPT_STEP_GPIO = 0x03,
+	SCRIPT_STEP_SPI_CS = 0x04,
+	SCRIPT_STEP_DELAY = 0x05,
+	SCRIPT_STEP_ADC = 0x06,
+} scriptStep_t;
+
+int32_t scriptLoad(uint8_t id, const uint8_t *steps, uint32_t len, uint32_t maxRead);
+uint32_t scriptLoaded(uint8_t id);
+int32_t scriptRun(uint8_t id, uint8_t *rBuff, uint32_t *rLen, uint32_t *stepIndex);
+
+#endif
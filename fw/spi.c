@@ -7,6 +7,16 @@
 
 #define CS_PIN (3)
 
+// Shorter transfers are polled, DMA setup takes longer than they do
+#define SPI_DMA_MIN_LEN (16)
+#define SPI_DMA_TIMEOUT_MS (1000)
+
+#define SPI_DMA_RX_STREAM (DMA2_Stream2)
+#define SPI_DMA_TX_STREAM (DMA2_Stream3)
+
+extern volatile uint32_t tickMs;
+extern volatile uint32_t wakeEvent;
+
 typedef struct {
 	SPI_TypeDef *SPIx;
 	uint32_t speed;
@@ -41,6 +51,17 @@ spiSpeedLUT_t speedLUT[] = {
 
 spiConfig_t spiConfigs[] = {{SPI1, 1000000, GPIOE, 3, 1, 1}};
 
+// Transfer in progress (see spiStart)
+static volatile struct {
+	uint8_t active;
+	uint8_t dma;
+	uint8_t dmaDone;
+	int32_t status;
+	uint32_t flags;
+	uint32_t startMs;
+	SPI_TypeDef *SPIx;
+} xfer;
+
 static uint32_t spiPrescalerFromSpeed(uint32_t device, uint32_t speed) {
 	uint32_t prescaler = SPI_BaudRatePrescaler_256; // Slow default
 	
@@ -136,59 +157,221 @@ int32_t spiSetCS(uint32_t device, GPIO_TypeDef* csPort, uint16_t csPin) {
 	return rval;
 }
 
-int32_t spi(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff) {
-	int32_t rval = -1;
+//
+// Polled transfer, for short transfers where setting up DMA isn't worth it
+//
+static void spiPolled(SPI_TypeDef *SPIx, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff) {
+	uint32_t i = 0;  // TX index
+	uint32_t j = 0;  // RX index
+
+	// Transmit the first TX
+	while(!(SPIx->SR & SPI_I2S_FLAG_TXE)){};
+	SPIx->DR = wBuff[i++];
+
+	while(i < rwLen){
+
+		// Wait until TX buffer is empty
+		while(!(SPIx->SR & SPI_I2S_FLAG_TXE)){};
+		SPIx->DR = wBuff[i++];
+
+		// Wait until RX data register is ready (Not Empty)
+		while(!(SPIx->SR & SPI_I2S_FLAG_RXNE)){};
+		rBuff[j++] = SPIx->DR;
+	}
+
+	// Receive the last RX
+	while(!(SPIx->SR & SPI_I2S_FLAG_RXNE)){};
+		rBuff[j++] = SPIx->DR;
+}
+
+//
+// Start a DMA transfer. SPI1 RX is on DMA2 Stream2 and TX on DMA2 Stream3
+// (both channel 3). Stream0 is left for the ADC.
+// RX gets the higher priority so it can't fall behind and overrun. Its
+// transfer complete interrupt marks the end of the transfer.
+//
+static void spiDmaStart(SPI_TypeDef *SPIx, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff) {
+	DMA_InitTypeDef dmaConfig;
+
+	RCC_AHB1PeriphClockCmd(RCC_AHB1Periph_DMA2, ENABLE);
+
+	DMA_DeInit(SPI_DMA_RX_STREAM);
+	DMA_DeInit(SPI_DMA_TX_STREAM);
+
+	DMA_StructInit(&dmaConfig);
+	dmaConfig.DMA_Channel = DMA_Channel_3;
+	dmaConfig.DMA_PeripheralBaseAddr = (uint32_t)&SPIx->DR;
+	dmaConfig.DMA_BufferSize = rwLen;
+	dmaConfig.DMA_PeripheralInc = DMA_PeripheralInc_Disable;
+	dmaConfig.DMA_MemoryInc = DMA_MemoryInc_Enable;
+	dmaConfig.DMA_PeripheralDataSize = DMA_PeripheralDataSize_Byte;
+	dmaConfig.DMA_MemoryDataSize = DMA_MemoryDataSize_Byte;
+	dmaConfig.DMA_Mode = DMA_Mode_Normal;
+
+	dmaConfig.DMA_Memory0BaseAddr = (uint32_t)rBuff;
+	dmaConfig.DMA_DIR = DMA_DIR_PeripheralToMemory;
+	dmaConfig.DMA_Priority = DMA_Priority_VeryHigh;
+	DMA_Init(SPI_DMA_RX_STREAM, &dmaConfig);
+
+	dmaConfig.DMA_Memory0BaseAddr = (uint32_t)wBuff;
+	dmaConfig.DMA_DIR = DMA_DIR_MemoryToPeripheral;
+	dmaConfig.DMA_Priority = DMA_Priority_High;
+	DMA_Init(SPI_DMA_TX_STREAM, &dmaConfig);
+
+	DMA_ITConfig(SPI_DMA_RX_STREAM, DMA_IT_TC, ENABLE);
+	NVIC_EnableIRQ(DMA2_Stream2_IRQn);
+
+	// Drop anything left in the data register
+	(void)SPIx->DR;
+
+	DMA_Cmd(SPI_DMA_RX_STREAM, ENABLE);
+	DMA_Cmd(SPI_DMA_TX_STREAM, ENABLE);
+	SPI_I2S_DMACmd(SPIx, SPI_I2S_DMAReq_Rx | SPI_I2S_DMAReq_Tx, ENABLE);
+}
+
+static void spiDmaStop(SPI_TypeDef *SPIx) {
+	DMA_ITConfig(SPI_DMA_RX_STREAM, DMA_IT_TC, DISABLE);
+	SPI_I2S_DMACmd(SPIx, SPI_I2S_DMAReq_Rx | SPI_I2S_DMAReq_Tx, DISABLE);
+	DMA_Cmd(SPI_DMA_RX_STREAM, DISABLE);
+	DMA_Cmd(SPI_DMA_TX_STREAM, DISABLE);
+	DMA_ClearFlag(SPI_DMA_RX_STREAM, DMA_FLAG_TCIF2 | DMA_FLAG_HTIF2 | DMA_FLAG_TEIF2);
+	DMA_ClearFlag(SPI_DMA_TX_STREAM, DMA_FLAG_TCIF3 | DMA_FLAG_HTIF3 | DMA_FLAG_TEIF3);
+}
+
+void DMA2_Stream2_IRQHandler(void) {
+	if(DMA_GetITStatus(SPI_DMA_RX_STREAM, DMA_IT_TCIF2)) {
+		DMA_ClearITPendingBit(SPI_DMA_RX_STREAM, DMA_IT_TCIF2);
+		DMA_ITConfig(SPI_DMA_RX_STREAM, DMA_IT_TC, DISABLE);
+
+		// The last byte is in. The rest is done in spiPoll
+		xfer.dmaDone = 1;
+		wakeEvent = 1;
+	}
+}
+
+//
+// End the transfer: wait for the last byte to go out, and release CS
+// unless it's being held
+//
+static void spiFinish(int32_t status) {
+	SPI_TypeDef *SPIx = xfer.SPIx;
+
+	if(xfer.dma) {
+		spiDmaStop(SPIx);
+	}
+
+	// This appears redundant with BSY, however the manual states:
+	// Wait until TXE=1 and then wait until BSY=0 before disabling the SPI.
+	while(!(SPIx->SR & SPI_I2S_FLAG_TXE)){};
+
+	// Wait for SPI comms to finish
+	while(SPIx->SR & SPI_I2S_FLAG_BSY){};
+
+	SPI_Cmd(SPIx, DISABLE);
+
+	if(spiConfigs[0].csPort && (!(xfer.flags & SPI_HOLD_CS) || status)) {
+		// Disable CS, since it's active low
+		GPIO_SetBits(spiConfigs[0].csPort, (1 << spiConfigs[0].csPin));
+	}
+
+	xfer.status = status;
+	xfer.active = 0;
+}
 
+int32_t spi(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff) {
 	if(!(rwLen > 0)){
 		return 0;
 	}
-		
-	if(device < sizeof(spiConfigs)/sizeof(spiConfig_t)) {
-		SPI_TypeDef *SPIx = spiConfigs[device].SPIx;
-        SPI_Cmd(SPIx, ENABLE);
+
+	return spiTransfer(device, rwLen, wBuff, rBuff, 0);
+}
+
+//
+// Start an SPI transfer and return without waiting for it (if it's long
+// enough to use DMA, shorter ones are done right away). Use spiPoll to find
+// out when it's done. The buffers have to stay around until then.
+// With SPI_HOLD_CS, CS is left asserted afterwards so the next transfer
+// continues the same transaction. A zero length transfer without it just
+// releases CS.
+//
+int32_t spiStart(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff, uint32_t flags) {
+	if((device >= sizeof(spiConfigs)/sizeof(spiConfig_t)) || xfer.active) {
+		return -1;
+	}
+
+	SPI_TypeDef *SPIx = spiConfigs[device].SPIx;
+
+	xfer.active = 1;
+	xfer.dma = 0;
+	xfer.dmaDone = 0;
+	xfer.flags = flags;
+	xfer.SPIx = SPIx;
+	xfer.startMs = tickMs;
+
+	if(rwLen > 0) {
+		SPI_Cmd(SPIx, ENABLE);
 
 		if(spiConfigs[0].csPort) {
-			// Disable CS, since it's active low
+			// Enable CS, since it's active low
 			GPIO_ResetBits(spiConfigs[0].csPort, (1 << spiConfigs[0].csPin));
 		}
 
-		uint32_t i = 0;  // TX index
-		uint32_t j = 0;  // RX index
+		if(rwLen >= SPI_DMA_MIN_LEN) {
+			xfer.dma = 1;
+			spiDmaStart(SPIx, rwLen, wBuff, rBuff);
+			return 0;
+		}
 
-		// Transmit the first TX
-		while(!(SPIx->SR & SPI_I2S_FLAG_TXE)){};
-		SPIx->DR = wBuff[i++];
+		spiPolled(SPIx, rwLen, wBuff, rBuff);
+		spiFinish(0);
+	} else {
+		if(spiConfigs[0].csPort && !(flags & SPI_HOLD_CS)) {
+			GPIO_SetBits(spiConfigs[0].csPort, (1 << spiConfigs[0].csPin));
+		}
 
-		while(i < rwLen){
+		xfer.status = 0;
+		xfer.active = 0;
+	}
 
-			// Wait until TX buffer is empty
-			while(!(SPIx->SR & SPI_I2S_FLAG_TXE)){};
-			SPIx->DR = wBuff[i++];
+	return 0;
+}
 
-			// Wait until RX data register is ready (Not Empty)
-			while(!(SPIx->SR & SPI_I2S_FLAG_RXNE)){};
-			rBuff[j++] = SPIx->DR;
+//
+// Check on the transfer in progress (called from the main loop)
+// Returns 1 once it's done (see spiResult), 0 if it's still going.
+//
+uint32_t spiPoll() {
+	if(xfer.active) {
+		if(xfer.dmaDone) {
+			spiFinish(0);
+		} else if((tickMs - xfer.startMs) >= SPI_DMA_TIMEOUT_MS) {
+			spiFinish(-1);
 		}
+	}
 
-		// Receive the last RX
-		while(!(SPIx->SR & SPI_I2S_FLAG_RXNE)){};
-			rBuff[j++] = SPIx->DR;
+	return !xfer.active;
+}
 
-		// This appears redundant with BSY, however the manual states:
-		// Wait until TXE=1 and then wait until BSY=0 before disabling the SPI.
-		while(!(SPIx->SR & SPI_I2S_FLAG_TXE)){};
+uint32_t spiBusy() {
+	return xfer.active;
+}
 
-		// Wait for SPI comms to finish
-		while(SPIx->SR & SPI_I2S_FLAG_BSY){};
+int32_t spiResult() {
+	return xfer.status;
+}
 
-		if(spiConfigs[0].csPort) {
-			// Disable CS, since it's active low
-			GPIO_SetBits(spiConfigs[0].csPort, (1 << spiConfigs[0].csPin));
-		}
+//
+// Blocking transfer (see spiStart)
+//
+int32_t spiTransfer(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff, uint32_t flags) {
+	int32_t rval = spiStart(device, rwLen, wBuff, rBuff, flags);
 
-        SPI_Cmd(SPIx, DISABLE);
-		rval = 0;
+	if(rval) {
+		return rval;
 	}
-	
-	return rval;
+
+	while(!spiPoll()) {
+	}
+
+	return spiResult();
 }
@@ -7,5 +7,15 @@ int32_t spiInit(uint32_t device);
 int32_t spiConfig(uint32_t device, uint32_t speed, uint8_t cpol, uint8_t cpha);
 int32_t spiSetCS(uint32_t device, GPIO_TypeDef* csPort, uint16_t csPin);
 int32_t spi(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff);
+int32_t spiTransfer(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff, uint32_t flags);
+
+// Non-blocking transfers (see spi.c)
+int32_t spiStart(uint32_t device, uint32_t rwLen, uint8_t *wBuff, uint8_t *rBuff, uint32_t flags);
+uint32_t spiPoll();
+uint32_t spiBusy();
+int32_t spiResult();
+
+// spiTransfer flags
+#define SPI_HOLD_CS (1 << 0)
 
 #endif
@@ -35,16 +35,21 @@
 #include "fifo.h"
 #include <stdio.h>
 
-#define FIFO_BUFF_SIZE  (4096)
-
 fifo_t usbRxFifo;
 fifo_t usbTxFifo;
 
-static uint8_t inBuff[FIFO_BUFF_SIZE];
-static uint8_t outBuff[FIFO_BUFF_SIZE];
+// DWT cycles spent writing console output (reset by the console per command)
+uint32_t usbTxCycles;
+
+static uint8_t inBuff[USB_RX_FIFO_SIZE];
+static uint8_t outBuff[USB_TX_FIFO_SIZE];
+
+// Data of the IN transfer in progress, and its length
+__ALIGN_BEGIN static uint8_t cdcTxBuff[USB_TX_TRANSFER_SIZE] __ALIGN_END;
+static volatile uint32_t usbTxInProgress = 0;
+static uint32_t usbTxLen;
 
-extern uint8_t cdcTxBuff[CDC_DATA_MAX_PACKET_SIZE];
-extern volatile uint32_t usbTxInProgress;
+extern volatile uint32_t wakeEvent;
 
 extern USB_OTG_CORE_HANDLE  USB_OTG_dev;
 
@@ -86,8 +91,8 @@ CDC_IF_Prop_TypeDef VCP_fops =
 static uint16_t VCP_Init(void)
 {
   // Setup fifos
-  fifoInit(&usbRxFifo, FIFO_BUFF_SIZE, inBuff);
-  fifoInit(&usbTxFifo, FIFO_BUFF_SIZE, outBuff);
+  fifoInit(&usbRxFifo, USB_RX_FIFO_SIZE, inBuff);
+  fifoInit(&usbTxFifo, USB_TX_FIFO_SIZE, outBuff);
   return USBD_OK;
 }
 
@@ -158,6 +163,69 @@ static uint16_t VCP_Ctrl (uint32_t Cmd, uint8_t* Buf, uint32_t Len)
   return USBD_OK;
 }
 
+//
+// Start an IN transfer with as much of the tx fifo as fits in one
+// (called with no transfer in progress, or from the IN endpoint interrupt
+// when the last one is done)
+//
+static void usbTxStart(void *pdev) {
+  uint32_t txLen = fifoRead(&usbTxFifo, cdcTxBuff, USB_TX_TRANSFER_SIZE);
+
+  // A transfer that ends with a full packet isn't over for the host until
+  // it gets a shorter one, so finish it with a zero length packet if
+  // there's nothing else to send
+  if(txLen || (usbTxInProgress && usbTxLen && !(usbTxLen % CDC_DATA_MAX_PACKET_SIZE))) {
+    usbTxInProgress = 1;
+    usbTxLen = txLen;
+
+    /* Prepare the available data buffer to be sent on IN endpoint */
+    DCD_EP_Tx (pdev,
+               CDC_IN_EP,
+               (uint8_t*)cdcTxBuff,
+               txLen);
+  } else {
+    // Transaction done
+    usbTxInProgress = 0;
+    usbTxLen = 0;
+  }
+}
+
+//
+// Called when an IN transfer is done
+//
+void usbTxContinue(void *pdev) {
+  if(usbTxInProgress) {
+    usbTxStart(pdev);
+  }
+}
+
+//
+// Send whatever is in the tx fifo, even if it's less than a packet
+// (the main loop calls this once per pass, so everything written during
+// one pass can go out together)
+//
+void usbTxFlush(void) {
+  if(!usbTxInProgress && fifoSize(&usbTxFifo)) {
+    usbTxStart(&USB_OTG_dev);
+  }
+}
+
+//
+// Queue data to send. A transfer is only started here once there's at
+// least a full packet, partial ones wait for usbTxFlush.
+//
+void usbWrite(const uint8_t *buff, uint32_t len) {
+  uint32_t start = DWT->CYCCNT;
+
+  fifoWrite(&usbTxFifo, buff, len);
+
+  if(!usbTxInProgress && (fifoSize(&usbTxFifo) >= CDC_DATA_MAX_PACKET_SIZE)) {
+    usbTxStart(&USB_OTG_dev);
+  }
+
+  usbTxCycles += DWT->CYCCNT - start;
+}
+
 /**
   * @brief  VCP_DataTx
   *         CDC received data to be send over USB IN endpoint are managed in
@@ -168,36 +236,7 @@ static uint16_t VCP_Ctrl (uint32_t Cmd, uint8_t* Buf, uint32_t Len)
   */
 static uint16_t VCP_DataTx (uint8_t* Buf, uint32_t Len)
 {
-  uint32_t i = 0;
-  while (i < Len) {
-    fifoPush(&usbTxFifo, *(Buf + i++));
-  }
-
-  if(!usbTxInProgress) {
-    uint32_t txLen = fifoSize(&usbTxFifo);
-    uint8_t *pBuf = cdcTxBuff;
-
-    if(txLen) {
-
-      if(txLen > CDC_DATA_MAX_PACKET_SIZE) {
-        txLen = CDC_DATA_MAX_PACKET_SIZE;
-      }
-
-      usbTxInProgress = 1;
-
-      for(uint32_t x = 0; x < txLen; x++) {
-        *pBuf++ = fifoPop(&usbTxFifo);
-      }
-
-      /* Prepare the available data buffer to be sent on IN endpoint */
-      DCD_EP_Tx (&USB_OTG_dev,
-                 CDC_IN_EP,
-                 (uint8_t*)cdcTxBuff,
-                 txLen);
-    } else {
-      usbTxInProgress = 0;
-    }
-  }
+  usbWrite(Buf, Len);
 
   return USBD_OK;
 }
@@ -218,9 +257,9 @@ static uint16_t VCP_DataTx (uint8_t* Buf, uint32_t Len)
   * @retval Result of the opeartion: USBD_OK if all operations are OK else VCP_FAIL
   */
 static uint16_t VCP_DataRx(uint8_t* Buf, uint32_t Len) {
-  for (uint32_t i = 0; i < Len; i++) {
-    fifoPush(&usbRxFifo, *(Buf + i));
-  }
+  fifoWrite(&usbRxFifo, Buf, Len);
+
+  wakeEvent = 1;
 
   return USBD_OK;
 }
@@ -234,7 +273,7 @@ int _write (int fd, char *ptr, int len)
   //
   // If planning on supporting both serial and usb-serial, check fd here!
   //
-  VCP_DataTx((uint8_t *)ptr, len);
+  usbWrite((uint8_t *)ptr, len);
   return len;
 }
 
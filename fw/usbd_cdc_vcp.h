@@ -41,6 +41,16 @@
 /* The following structures groups all needed parameters to be configured for the 
    ComPort. These parameters can modified on the fly by the host through CDC class
    command class requests. */
+// Size of the USB receive and transmit fifos (powers of 2)
+// The transmit fifo holds the longest ASCII response (3 characters per byte
+// of a TX_RX_BUFF_SIZE transfer) with room to spare for pipelined ones
+#define USB_RX_FIFO_SIZE  (8192)
+#define USB_TX_FIFO_SIZE  (16384)
+
+// Most data sent in one IN transfer (a multiple of the packet size, the
+// core splits it into packets)
+#define USB_TX_TRANSFER_SIZE  (16 * CDC_DATA_MAX_PACKET_SIZE)
+
 typedef struct
 {
   uint32_t bitrate;
@@ -55,6 +65,9 @@ typedef struct
 
 /* Exported macro ------------------------------------------------------------*/
 /* Exported functions ------------------------------------------------------- */
+void usbWrite(const uint8_t *buff, uint32_t len);
+void usbTxFlush(void);
+void usbTxContinue(void *pdev);
 
 #endif /* __USBD_CDC_VCP_H */
 
@@ -67,13 +67,10 @@
 #include "usbd_core.h"
 #include "usbd_desc.h"
 #include "usbd_req.h"
+#include "usbd_cdc_vcp.h"
 #include "fifo.h"
 
 extern fifo_t usbRxFifo;
-extern fifo_t usbTxFifo;
-
-uint8_t cdcTxBuff[CDC_DATA_MAX_PACKET_SIZE];
-volatile uint32_t usbTxInProgress = 0;
 
 /** @addtogroup STM32_USB_OTG_DEVICE_LIBRARY
   * @{
@@ -621,34 +618,9 @@ static uint8_t  usbd_cdc_EP0_RxReady (void  *pdev)
   */
 static uint8_t  usbd_cdc_DataIn (void *pdev, uint8_t epnum)
 {
-  if(usbTxInProgress) {
-
-    uint32_t txLen = fifoSize(&usbTxFifo);
-    uint8_t *pBuf = cdcTxBuff;
-
-    if(txLen) {
-      
-      if(txLen > CDC_DATA_MAX_PACKET_SIZE) {
-        txLen = CDC_DATA_MAX_PACKET_SIZE;
-      }
-
-      usbTxInProgress = 1;
+  // Send the next part of the tx fifo (if there's any left)
+  usbTxContinue(pdev);
 
-      for(uint32_t x = 0; x < txLen; x++) {
-        *pBuf++ = fifoPop(&usbTxFifo);
-      }
-
-      /* Prepare the available data buffer to be sent on IN endpoint */
-      DCD_EP_Tx (pdev,
-                 CDC_IN_EP,
-                 (uint8_t*)cdcTxBuff,
-                 txLen);
-    } else {
-      // Transaction done
-      usbTxInProgress = 0;
-    }
-  }
-    
   return USBD_OK;
 }
 
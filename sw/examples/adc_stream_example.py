@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+#
+# Stream PA1 at 10kHz for one second and plot it
+#
+
+import sys
+from silta import stm32f407
+import matplotlib.pyplot as plt
+import numpy
+
+ADC_PIN = 'PA1'
+
+SAMPLE_RATE = 10000
+NUM_SAMPLES = 10000
+
+if len(sys.argv) < 2:
+    print('Usage: ' + sys.argv[0] + '/path/to/serial/device')
+    sys.exit()
+
+stream_file = sys.argv[1]
+
+bridge = stm32f407.bridge(stream_file)
+
+# Configure pin as an analog input
+bridge.gpiocfg(ADC_PIN, 'analog')
+
+times = []
+chunks = []
+with bridge.adc_stream([ADC_PIN], SAMPLE_RATE) as stream:
+    for start, samples in stream:
+        times.append(start + numpy.arange(len(samples)) / stream.rate)
+        chunks.append(samples[:, 0])
+
+        if sum(len(chunk) for chunk in chunks) >= NUM_SAMPLES:
+            break
+
+    if stream.dropped:
+        print('Dropped ' + str(stream.dropped) + ' chunks')
+
+plt.plot(numpy.concatenate(times), numpy.concatenate(chunks))
+plt.title(ADC_PIN)
+plt.show()
+
+bridge.close()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+#
+# Read PA1 on several boards at once, from a single thread
+#
+
+import asyncio
+import sys
+from silta import aio
+
+ADC_PIN = 'PA1'
+
+if len(sys.argv) < 2:
+    print('Usage: ' + sys.argv[0] + ' /path/to/serial/device [...]')
+    sys.exit()
+
+
+async def read_board(board):
+    # Configure pin as an analog input
+    await board.gpiocfg(ADC_PIN, 'analog')
+
+    return await board.adc(ADC_PIN)
+
+
+async def main(devices):
+    boards = await asyncio.gather(*[aio.connect(dev) for dev in devices])
+
+    values = await asyncio.gather(*[read_board(board) for board in boards])
+
+    for board, value in zip(boards, values):
+        print(board.serial_number + ' ' + ADC_PIN + ' Voltage: ' + str(value))
+
+    await asyncio.gather(*[board.close() for board in boards])
+
+asyncio.run(main(sys.argv[1:]))
@@ -4,8 +4,8 @@
  https://github.com/adafruit/Adafruit_AM2315
 '''
 
-import time
 import tca9548a
+from silta import scheduler
 
 AM2315_ADDR = 0xB8
 
@@ -16,7 +16,10 @@ class AM2315:
         self.mux_channel = mux_channel
 
     def read(self):
+        return scheduler.run_steps(self.read_steps())
 
+    def read_steps(self):
+        ''' read(), split into trigger/fetch phases (see silta.scheduler) '''
         self.mux.set_channel(self.mux_channel)
 
         # Make sure we're running at 100kHz
@@ -29,9 +32,10 @@ class AM2315:
         self.bridge.i2c(AM2315_ADDR, 0, [0x03, 0x00, 4])
 
         # Wait ~10ms for measurement
-        time.sleep(0.01)
+        yield 0.01
 
         # Get measurement data
+        self.mux.set_channel(self.mux_channel)
         reply = self.bridge.i2c(AM2315_ADDR, 8, [])
 
 
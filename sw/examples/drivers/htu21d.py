@@ -4,7 +4,7 @@
 
 import time
 import tca9548a
-import time
+from silta import scheduler
 
 HTU21D_ADDR = 0x40 << 1
 
@@ -44,9 +44,14 @@ class HTU21D:
             raise IOError('Error resetting HTU21D ({})'.format(rval))
 
     def read_temp(self):
+        return scheduler.run_steps(self.read_temp_steps())
+
+    def read_temp_steps(self):
         self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(HTU21D_ADDR, 0, [CMD['MEASTEMP_NOHOLD']])
-        time.sleep(0.050)
+        yield 0.050
+
+        self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(HTU21D_ADDR, 2)
         if isinstance(rval, list) and (len(rval) == 2):
             tempcode = rval[0] << 8 | rval[1]
@@ -57,9 +62,14 @@ class HTU21D:
         return round(temp,1)
 
     def read_humidity(self):
+        return scheduler.run_steps(self.read_humidity_steps())
+
+    def read_humidity_steps(self):
         self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(HTU21D_ADDR, 0, [CMD['MEASRH_NOHOLD']])
-        time.sleep(0.050)
+        yield 0.050
+
+        self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(HTU21D_ADDR, 2)
         if isinstance(rval, list) and (len(rval) == 2):
             rhcode = rval[0] << 8 | rval[1]
@@ -71,3 +81,9 @@ class HTU21D:
 
     def read(self):
         return self.read_humidity(), self.read_temp()
+
+    def read_steps(self):
+        ''' read(), split into trigger/fetch phases (see silta.scheduler) '''
+        humidity = yield from self.read_humidity_steps()
+        temp = yield from self.read_temp_steps()
+        return humidity, temp
@@ -7,7 +7,7 @@
 import sys
 import time
 import ctypes
-from silta import stm32f407
+from silta import scheduler, stm32f407
 
 def bytes_to_int(byte_list):
     num = 0
@@ -33,6 +33,18 @@ class MAX31855(object):
         self.bridge.gpio(self.cs_pin, 1)
 
     def read(self):
+        return scheduler.run_steps(self.read_steps())
+
+    def read_steps(self):
+        ''' read() as a single phase job, for silta.scheduler
+            (the MAX31855 converts continuously, there's nothing to wait for)
+        '''
+        return self.__read()
+
+        # Never reached, but makes this a generator
+        yield
+
+    def __read(self):
         # Read 32 bits
         txbuff = [0x00, 0x00, 0x00, 0x00]
 
@@ -4,7 +4,7 @@
 
 import time
 import tca9548a
-import time
+from silta import scheduler, script
 
 SHT31_ADDR = 0x44 << 1
 
@@ -28,6 +28,7 @@ class SHT31:
         self.bridge = bridge
         self.mux = tca9548a.TCA9548A(bridge)
         self.mux_channel = mux_channel
+        self.script_id = None
         self.reset()
         time.sleep(0.5)
 
@@ -47,11 +48,48 @@ class SHT31:
         else:
             raise IOError('Error resetting SHT31 ({})'.format(rval))
 
+    def load_script(self, script_id):
+        ''' Have the bridge do the whole read() on its own (one command
+            instead of four, see silta.script)
+
+            Args:
+                script_id: Bridge script slot to use
+        '''
+        read_script = script.Script()
+        read_script.i2c(self.mux.address, 0, [1 << self.mux_channel])
+        read_script.i2c(SHT31_ADDR, 0, CMD['RD_TH_HIGH_NOHOLD'])
+        read_script.delay(0.015)
+        read_script.i2c(SHT31_ADDR, 6)
+
+        self.bridge.script_load(script_id, read_script)
+        self.script_id = script_id
+
     def read(self):
+        if self.script_id is None:
+            return scheduler.run_steps(self.read_steps())
+
+        try:
+            rval, = self.bridge.script_run(self.script_id)
+        except IOError:
+            # Don't know how far it got
+            self.mux.router.invalidate()
+            raise
+
+        self.mux.router.set_selected(self.mux.address, self.mux_channel)
+
+        return self.__convert(rval)
+
+    def read_steps(self):
+        ''' read(), split into trigger/fetch phases (see silta.scheduler) '''
         self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(SHT31_ADDR, 0, CMD['RD_TH_HIGH_NOHOLD'])
-        time.sleep(0.015)
+        yield 0.015
+
+        self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(SHT31_ADDR, 6)
+        return self.__convert(rval)
+
+    def __convert(self, rval):
         if isinstance(rval, list) and (len(rval) == 6):
             tempcode = rval[0] << 8 | rval[1]
             temp = -45 + 175 * tempcode/65535.0
@@ -4,7 +4,7 @@
 
 import time
 import tca9548a
-import time
+from silta import scheduler
 
 SI7021_ADDR = 0x40 << 1
 
@@ -62,14 +62,19 @@ class SI7021:
             elif fw == 0x20:
                 self.fw_version = 2.0
 
-        except TypeError, IOError:
+        except (TypeError, IOError):
             print('Error reading information from SI7021')
             raise
 
     def read_temp(self):
+        return scheduler.run_steps(self.read_temp_steps())
+
+    def read_temp_steps(self):
         self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(SI7021_ADDR, 0, [CMD['MEASTEMP_NOHOLD']])
-        time.sleep(0.025)
+        yield 0.025
+
+        self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(SI7021_ADDR, 2)
         if isinstance(rval, list) and (len(rval) == 2):
             tempcode = rval[0] << 8 | rval[1]
@@ -80,9 +85,14 @@ class SI7021:
         return round(temp,1)
 
     def read_humidity(self):
+        return scheduler.run_steps(self.read_humidity_steps())
+
+    def read_humidity_steps(self):
         self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(SI7021_ADDR, 0, [CMD['MEASRH_NOHOLD']])
-        time.sleep(0.025)
+        yield 0.025
+
+        self.mux.set_channel(self.mux_channel)
         rval = self.bridge.i2c(SI7021_ADDR, 2)
         if isinstance(rval, list) and (len(rval) == 2):
             rhcode = rval[0] << 8 | rval[1]
@@ -94,3 +104,9 @@ class SI7021:
 
     def read(self):
         return self.read_humidity(), self.read_temp()
+
+    def read_steps(self):
+        ''' read(), split into trigger/fetch phases (see silta.scheduler) '''
+        humidity = yield from self.read_humidity_steps()
+        temp = yield from self.read_temp_steps()
+        return humidity, temp
@@ -6,7 +6,7 @@
 
 import sys
 import time
-from silta import stm32f407
+from silta import stm32f407, script
 import matplotlib.pyplot as plt
 
 def readRegs(bridge, reg, count):
@@ -35,6 +35,12 @@ def writeReg(bridge, reg, val):
 
 def accel(bridge):
     regs = readRegs(bridge, OUT_X_MSB, 6)
+    if regs:
+        return convert(regs)
+    else:
+        return []
+
+def convert(regs):
     rval = []
     if regs:
         for byte in range(0,6,2):
@@ -92,13 +98,28 @@ writeReg(bridge, CTRL_REG1, (reg1 | 0x01))
 
 points = {'x':[], 'y':[], 'z':[]}
 
-for i in range(1000):
-    values = accel(bridge)
+def add_point(values):
     points['x'].append(values[0])
     points['y'].append(values[1])
     points['z'].append(values[2])
 
-    time.sleep(0.001)
+if 'jobs' in bridge.caps.get('features', []):
+    # Have the bridge read every 1ms, timed by its own clock
+    bridge.script_load(0, script.Script().i2c(MMA_I2C_ADDR, 6, [OUT_X_MSB]))
+
+    with bridge.job(0, 0.001) as runs:
+        for t, (regs,) in runs:
+            add_point(convert(regs))
+            if len(points['x']) == 1000:
+                break
+
+    if runs.dropped:
+        print('Dropped ' + str(runs.dropped) + ' samples')
+else:
+    for i in range(1000):
+        add_point(accel(bridge))
+
+        time.sleep(0.001)
 
 f, plots = plt.subplots(3, sharex=True)
 plots[0].plot(points['x'])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+#
+# Log PA1 every 10ms into a ring file that holds the last 24 hours.
+# Memory and disk use stay the same no matter how long it runs.
+#
+# Watch it from another terminal while it's running with:
+#   recorder_example.py --plot adc.rec
+#
+
+import sys
+from silta import recorder
+
+ADC_PIN = 'PA1'
+
+INTERVAL = 0.01
+CAPACITY = int(24 * 60 * 60 / INTERVAL)
+
+if len(sys.argv) < 3:
+    print('Usage: ' + sys.argv[0] + ' /path/to/serial/device file.rec')
+    print('       ' + sys.argv[0] + ' --plot file.rec')
+    sys.exit()
+
+if sys.argv[1] == '--plot':
+    import matplotlib.pyplot as plt
+
+    reader = recorder.Reader(sys.argv[2])
+
+    # Start from what's already there, then follow new records
+    records = reader.latest(10000)
+
+    line, = plt.plot(records['time'] - records['time'][-1],
+                     records['values'][:, 0])
+    plt.title(reader.names[0])
+    plt.ion()
+    plt.show()
+
+    for chunk in reader.tail():
+        records = reader.latest(10000)
+        line.set_data(records['time'] - records['time'][-1],
+                      records['values'][:, 0])
+        plt.gca().relim()
+        plt.gca().autoscale_view()
+        plt.pause(0.1)
+else:
+    from silta import stm32f407
+
+    bridge = stm32f407.bridge(sys.argv[1])
+
+    # Configure pin as an analog input
+    bridge.gpiocfg(ADC_PIN, 'analog')
+
+    with recorder.Recorder(sys.argv[2], [ADC_PIN], CAPACITY) as rec:
+        print('Recording, Ctrl+C to stop')
+        rec.capture(lambda: [bridge.adc(ADC_PIN)], INTERVAL)
+
+    bridge.close()
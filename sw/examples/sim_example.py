@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+#
+# Talk to a simulated bridge, no hardware needed
+#
+
+from silta import stm32f407, sim
+
+SENSOR_ADDR = 0x40 << 1
+ADC_PIN = 'PA1'
+
+simulator = sim.Simulator(latency=0.0005)
+
+# Virtual I2C device with a couple of registers set
+simulator.i2c_devices[SENSOR_ADDR] = sim.RegisterI2CDevice({0xE3: [0x66, 0x4C]})
+
+# 1.2V on the ADC pin
+simulator.adc[ADC_PIN] = 1.2
+
+bridge = stm32f407.bridge(simulator.url)
+
+print('Serial number: ' + bridge.serial_number)
+print('Register 0xE3: ' + str(bridge.i2c(SENSOR_ADDR, 2, [0xE3])))
+print(ADC_PIN + ' Voltage: ' + str(bridge.adc(ADC_PIN)))
+
+bridge.close()
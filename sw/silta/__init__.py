@@ -1 +1,9 @@
 ''' Silta: a python to circuit bridge providing low-level interfaces '''
+
+import serial
+
+# Lets pyserial open simulated bridges (sim:// URLs, see silta.sim)
+if 'silta' not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append('silta')
+
+from silta.pool import BridgePool
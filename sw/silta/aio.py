@@ -0,0 +1,1024 @@
+''' Silta asyncio client
+
+Same commands as silta.stm32f407.bridge, but as coroutines on top of a
+non-blocking serial port, so a single event loop can drive many boards and
+overlap their I/O:
+
+    async def main(devices):
+        boards = await asyncio.gather(*[aio.connect(dev) for dev in devices])
+        values = await asyncio.gather(*[board.adc('PA1') for board in boards])
+
+Every command is written as soon as it's called and responses are matched to
+commands in order (see silta.pipeline), so concurrent calls on the same board
+are pipelined as well.
+'''
+
+import asyncio
+import collections
+import struct
+
+import serial
+
+from silta import console
+from silta import protocol as proto
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+async def connect(serial_device, baud_rate=None, protocol='auto',
+                  timeout=1.0):
+    ''' Connect to a Silta STM32F407 Bridge
+
+        Args:
+            serial_device: USB serial device path (e.g. /dev/ttyACMX)
+            baud_rate: Optional baud rate
+            protocol: Wire protocol for data transfers (see
+                stm32f407.bridge)
+            timeout: Seconds to wait for each response
+
+        Returns:
+            Connected Bridge
+    '''
+    board = Bridge(serial_device, baud_rate, protocol, timeout)
+
+    try:
+        await board._identify()
+    except Exception:
+        board._close_stream()
+        raise
+
+    return board
+
+
+class Bridge(object):
+    ''' Asyncio Silta STM32F407 Discovery Bridge
+
+        Create it with connect(). Command methods take the same arguments
+        and return the same values as their stm32f407.bridge counterparts.
+    '''
+
+    __pinModes = {
+        'input': 'in',
+        'output': 'outpp',
+        'output-od': 'outod',
+        'analog': 'analog'
+    }
+
+    __pullModes = {
+        'up': 'pullup',
+        'down': 'pulldown',
+        'none': 'nopull'
+    }
+
+    __dacs = {
+        'PA4': 0,
+        'PA5': 1
+    }
+
+    __pwms = {
+        'PE5': 0,
+        'PE6': 1
+    }
+
+    __ADC_MAX_VOLTAGE = 3.0
+    __ADC_MAX_VAL = 4095
+
+    __DAC_MAX_VOLTAGE = 3.0
+    __DAC_MAX_VAL = 4095
+
+    DEBUG = False
+
+    # Limits for firmware without the caps command (see console.limits)
+    __CMD_MAX_STR_LEN = 4095
+    __SPI_MAX_BYTES = 1024
+    __I2C_MAX_BYTES = 1024
+    __ADC_SCAN_MAX_VALUES = 1024
+    __ADC_SCAN_MAX_ASCII_VALUES = (4096 - 1 - len('OK')) // 5
+
+    # Size of the device's USB receive fifo (see stm32f407.bridge)
+    __RX_FIFO_SIZE = 4096
+
+    # Seconds between reads (and retried writes) for ports that can't be
+    # watched by the event loop (e.g. pyserial URL handlers without a file
+    # descriptor)
+    POLL_INTERVAL = 0.001
+
+    PIN = [1 << i for i in range(15)]
+
+    def __init__(self, serial_device, baud_rate=None, protocol='auto',
+                 timeout=1.0):
+        if protocol not in ('auto', 'binary', 'ascii'):
+            raise ValueError('Invalid protocol. Valid protocols: '
+                             '<auto|binary|ascii>')
+
+        self.__loop = asyncio.get_event_loop()
+        self.__requested_protocol = protocol
+
+        self.protocol = 'ascii'
+        self.timeout = timeout
+        self.serial_number = None
+        self.firmware_version = None
+        self.caps = {}
+        self.lastcspin = None
+
+        self.__adcs = {}
+
+        # (future, parse, length) for commands waiting for a response,
+        # oldest first
+        self.__pending = collections.deque()
+        self.__pending_bytes = 0
+
+        # Set every time a response is read
+        self.__response = asyncio.Event()
+
+        self.__txbuf = bytearray()
+        self.__rxbuf = bytearray()
+        self.__async_handlers = {}
+
+        self.__fd = None
+        self.__writer = False
+        self.__poller = None
+
+        try:
+            self.stream = serial.serial_for_url(serial_device,
+                                                do_not_open=True)
+            self.stream.timeout = 0
+            if baud_rate:
+                self.stream.baudrate = baud_rate
+            self.stream.open()
+        except (OSError, serial.SerialException):
+            raise IOError('could not open ' + serial_device)
+
+        try:
+            self.__fd = self.stream.fileno()
+        except Exception:
+            self.__fd = None
+
+        if self.__fd is not None:
+            self.stream.write_timeout = 0
+            self.__loop.add_reader(self.__fd, self.__on_readable)
+        else:
+            self.__poller = self.__loop.create_task(self.__poll())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _identify(self):
+        ''' Read serial number/firmware version and pick the protocol '''
+
+        # Flush any remaining data in the silta's buffer. There might not be
+        # a response, so just give the device a moment and drop whatever it
+        # sent back.
+        self.__write(b'\n')
+        await asyncio.sleep(0.1)
+        self.__rxbuf = bytearray()
+
+        # Everything in one response on firmware with the ident command
+        result = (await self.__send_cmd('ident')).strip().split(' ')
+        identity = console.parse_ident(result)
+
+        if identity is not None:
+            self.serial_number = identity['serial_number']
+            self.firmware_version = identity['firmware_version']
+            binary = identity['binary']
+            self.caps = identity['caps']
+        else:
+            sn, version, binary, caps = await asyncio.gather(
+                self.__send_cmd('sn'), self.__send_cmd('version'),
+                self.__send_cmd('binary'), self.__send_cmd('caps'))
+
+            result = sn.strip().split(' ')
+
+            if result[0] == 'OK':
+                self.serial_number = ''.join(result[1:])
+            else:
+                print('Warning: Could not read device serial number.')
+                print('You might want to update firmware on your board')
+
+            result = version.strip().split(' ')
+
+            if result[0] == 'OK':
+                self.firmware_version = result[1]
+            else:
+                print('Warning: Could not read device firmware version.')
+                print('You might want to update firmware on your board')
+
+            result = binary.strip().split(' ')
+            binary = int(result[1]) if result[0] == 'OK' else 0
+
+            self.caps = console.parse_caps(caps.strip().split(' '))
+
+        if self.__requested_protocol != 'ascii':
+            if binary == proto.VERSION:
+                self.protocol = 'binary'
+            elif self.__requested_protocol == 'binary':
+                raise IOError('Device does not support binary protocol')
+
+        limits = console.limits(self.caps, self.protocol)
+        if limits is not None:
+            self.__CMD_MAX_STR_LEN = limits['cmd']
+            self.__RX_FIFO_SIZE = limits['rx_fifo']
+            self.__SPI_MAX_BYTES = limits['spi']
+            self.__I2C_MAX_BYTES = limits['i2c']
+            self.__ADC_SCAN_MAX_VALUES = limits['adc_scan']
+        elif self.protocol == 'ascii':
+            self.__ADC_SCAN_MAX_VALUES = self.__ADC_SCAN_MAX_ASCII_VALUES
+
+    async def close(self):
+        ''' Wait for in-flight commands, then disconnect '''
+        try:
+            await self.drain()
+        finally:
+            self._close_stream()
+
+    def _close_stream(self):
+        ''' Stop watching the port and close it '''
+        if self.__fd is not None:
+            self.__loop.remove_reader(self.__fd)
+            if self.__writer:
+                self.__loop.remove_writer(self.__fd)
+                self.__writer = False
+
+        if self.__poller is not None:
+            self.__poller.cancel()
+            self.__poller = None
+
+        self.stream.close()
+
+    async def drain(self):
+        ''' Wait for the responses to all in-flight commands '''
+        while self.__pending:
+            await self.__wait_response()
+
+    def _set_async_handler(self, opcode, handler):
+        ''' Call handler(status, payload) for each unsolicited frame with
+            the given opcode (None removes the handler)
+        '''
+        if handler is None:
+            self.__async_handlers.pop(opcode, None)
+        else:
+            self.__async_handlers[opcode] = handler
+
+    def _in_flight(self):
+        ''' Number of commands still waiting for a response '''
+        return len(self.__pending)
+
+    def _write_cmd(self, cmd, parse=None, split=True):
+        ''' Send terminal command without waiting for the response
+
+            Doesn't check the device's receive fifo, see __request.
+
+            Args:
+                cmd: Command string (without newline)
+                parse: Function converting the split response line into a
+                    return value. If None, the raw response line is returned
+                split: If False, parse gets the whole response line instead
+
+            Returns:
+                Future for the command's result
+        '''
+        if (len(cmd) + 1) > self.__CMD_MAX_STR_LEN:
+            raise RuntimeError('Command string too long')
+
+        if self.DEBUG is True:
+            print('CMD : {}'.format(cmd))
+
+        if parse is not None and split:
+            split_parse = lambda line: parse(line.strip().split(' '))
+        else:
+            split_parse = parse
+
+        return self.__queue((cmd + '\n').encode(), split_parse)
+
+    def _write_frame(self, opcode, payload, parse=None):
+        ''' Send binary protocol command without waiting for the response
+
+            Args:
+                opcode: Command opcode (see silta.protocol)
+                payload: Command payload bytes
+                parse: Function converting the (status, payload) response
+                    into a return value. If None, the tuple is returned
+
+            Returns:
+                Future for the command's result
+        '''
+        frame = proto.encode_cmd(opcode, payload)
+
+        if len(frame) > self.__CMD_MAX_STR_LEN:
+            raise RuntimeError('Command frame too long')
+
+        if self.DEBUG is True:
+            print('CMD : {:02X} {}'.format(opcode, payload.hex()))
+
+        return self.__queue(frame, parse)
+
+    async def _result(self, future):
+        ''' Wait (up to timeout) for a command's result '''
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise IOError('Timed out waiting for response')
+
+    def __queue(self, data, parse):
+        future = self.__loop.create_future()
+
+        self.__pending.append((future, parse, len(data)))
+        self.__pending_bytes += len(data)
+
+        self.__write(data)
+
+        return future
+
+    async def __reserve(self, length):
+        ''' Wait until length more bytes fit in the device's receive fifo
+
+            Callers must queue their commands right after this returns,
+            without awaiting anything else in between.
+        '''
+        while self.__pending and \
+                (self.__pending_bytes + length) > self.__RX_FIFO_SIZE:
+            await self.__wait_response()
+
+    async def __wait_response(self):
+        ''' Wait for the next response to be read '''
+        self.__response.clear()
+        try:
+            await asyncio.wait_for(self.__response.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise IOError('Timed out waiting for response')
+
+    # Send terminal command and return the raw response line
+    async def __send_cmd(self, cmd):
+        await self.__reserve(len(cmd) + 1)
+        return await self._result(self._write_cmd(cmd))
+
+    # Send terminal command and parse the response
+    async def __request(self, cmd, parse, split=True):
+        await self.__reserve(len(cmd) + 1)
+        return await self._result(self._write_cmd(cmd, parse, split))
+
+    # Same as __request, for binary protocol commands
+    async def __request_frame(self, opcode, payload, parse):
+        await self.__reserve(
+            proto.CMD_HEADER_LEN + len(payload) + proto.CRC_LEN)
+        return await self._result(self._write_frame(opcode, payload, parse))
+
+    def __write(self, data):
+        self.__txbuf += data
+        if not self.__writer:
+            self.__on_writable()
+
+    def __on_writable(self):
+        ''' Write as much of the output buffer as the port will take '''
+        try:
+            written = self.stream.write(bytes(self.__txbuf))
+        except serial.SerialException as e:
+            self.__fail(IOError(str(e)))
+            return
+
+        if written is None:
+            written = len(self.__txbuf)
+
+        del self.__txbuf[:written]
+
+        # Wait for the port to drain before writing the rest (ports without
+        # a file descriptor retry from __poll)
+        if self.__txbuf and not self.__writer:
+            if self.__fd is not None:
+                self.__loop.add_writer(self.__fd, self.__on_writable)
+            self.__writer = True
+        elif not self.__txbuf and self.__writer:
+            if self.__fd is not None:
+                self.__loop.remove_writer(self.__fd)
+            self.__writer = False
+
+    def __on_readable(self):
+        try:
+            data = self.stream.read(self.stream.in_waiting or 1)
+        except serial.SerialException as e:
+            self.__fail(IOError(str(e)))
+            return
+
+        if data:
+            self.__rxbuf += data
+            self.__process()
+
+    async def __poll(self):
+        while True:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            if self.__writer:
+                self.__on_writable()
+            if self.stream.in_waiting:
+                self.__on_readable()
+
+    def __process(self):
+        ''' Hand every complete line/frame in the input to its owner '''
+        while self.__rxbuf:
+            if self.__rxbuf[0] == proto.SYNC:
+                if len(self.__rxbuf) < proto.RESP_HEADER_LEN:
+                    return
+
+                header = bytes(self.__rxbuf[:proto.RESP_HEADER_LEN])
+                opcode, status, length = proto.decode_resp_header(header)
+
+                end = proto.RESP_HEADER_LEN + length + proto.CRC_LEN
+                if len(self.__rxbuf) < end:
+                    return
+
+                payload = bytes(self.__rxbuf[proto.RESP_HEADER_LEN:end])
+                del self.__rxbuf[:end]
+
+                crc_ok = proto.check_crc(
+                    header, payload[:length], payload[length:])
+
+                if opcode & proto.ASYNC:
+                    handler = self.__async_handlers.get(opcode)
+                    if crc_ok and handler is not None:
+                        handler(status, payload[:length])
+                    continue
+
+                if crc_ok:
+                    response = (status, payload[:length])
+                else:
+                    response = IOError('Response CRC mismatch')
+            else:
+                index = self.__rxbuf.find(b'\n')
+                if index < 0:
+                    return
+
+                response = bytes(self.__rxbuf[:index + 1]).decode()
+                del self.__rxbuf[:index + 1]
+
+            self.__resolve(response)
+
+    def __resolve(self, response):
+        ''' Hand a response (or exception) to the oldest command '''
+        if not self.__pending:
+            # Nobody asked for it (e.g. leftovers from before connecting)
+            return
+
+        future, parse, length = self.__pending.popleft()
+        self.__pending_bytes -= length
+        self.__response.set()
+
+        if self.DEBUG is True:
+            print('RESP: {}'.format(response))
+
+        # The caller gave up on this one (timed out or cancelled)
+        if future.done():
+            return
+
+        if isinstance(response, Exception):
+            future.set_exception(response)
+        elif parse is None:
+            future.set_result(response)
+        else:
+            try:
+                future.set_result(parse(response))
+            except Exception as e:
+                future.set_exception(e)
+
+    def __fail(self, exception):
+        ''' Fail every in-flight command '''
+        while self.__pending:
+            self.__resolve(exception)
+
+    async def i2c_speed(self, speed):
+        ''' Alias of i2c1_speed method '''
+        return await self.i2c1_speed(speed)
+
+    async def i2c1_speed(self, speed):
+        ''' Set I2C speed in Hz. '''
+        cmd = 'config i2cspeed ' + str(speed)
+
+        return await self.__request(cmd, console.parse_ok)
+
+    async def i2c1_pins(self, pins):
+        ''' Set I2C1 pins on GPIOB (see stm32f407.bridge.i2c1_pins) '''
+        cmd = 'config i2cpins ' + str(pins)
+
+        return await self.__request(cmd, console.parse_ok)
+
+    async def i2c(self, addr, rlen, wbytes=[]):
+        ''' Alias of i2c1 method '''
+        return await self.i2c1(addr, rlen, wbytes)
+
+    async def i2c1(self, addr, rlen, wbytes=[]):
+        ''' I2C Transaction (write-then-read)
+
+            Args:
+                addr: 8 bit I2C address
+                rlen: Number of bytes to read
+                wbytes: List of bytes (or bytes-like object) to write
+
+            Return value:
+                Integer with error code
+                or
+                List with read bytes (or empty list if write-only command)
+        '''
+        return await self.__i2c_request(
+            addr, rlen, wbytes, console.parse_bytes, proto.parse_frame_bytes)
+
+    async def i2c_read_into(self, addr, rbuf, wbytes=b''):
+        ''' I2C Transaction (write-then-read) into a caller-supplied buffer
+
+            Args:
+                addr: 8 bit I2C address
+                rbuf: Writable buffer. Its length is the number of bytes to
+                    read
+                wbytes: Bytes-like object (or list of bytes) to write
+
+            Return value:
+                Integer with error code
+                or
+                Number of bytes read into rbuf
+        '''
+        rbuf = memoryview(rbuf).cast('B')
+
+        return await self.__i2c_request(
+            addr, len(rbuf), wbytes,
+            console.parse_bytes_into(rbuf), proto.parse_frame_bytes_into(rbuf))
+
+    async def __i2c_request(self, addr, rlen, wbytes, parse, parse_frame):
+        wbytes = console.as_bytes(wbytes)
+
+        if len(wbytes) > self.__I2C_MAX_BYTES:
+            raise ValueError('wbytes too long. Max:', self.__I2C_MAX_BYTES)
+
+        if rlen > self.__I2C_MAX_BYTES:
+            raise ValueError('rlen too long. Max:', self.__I2C_MAX_BYTES)
+
+        if self.protocol == 'binary':
+            payload = struct.pack('<BH', addr, rlen) + wbytes
+            return await self.__request_frame(
+                proto.OP_I2C, payload, parse_frame)
+
+        cmd = 'i2c ' + format(addr, '02X') + ' ' + str(rlen) + \
+            console.encode_bytes(wbytes)
+
+        return await self.__request(cmd, parse, split=False)
+
+    async def spi(self, cspin, wbytes=[]):
+        ''' SPI Transaction
+
+            Args:
+                cspin: Chip/Slave select pin for transaction
+                wbytes: List of bytes (or bytes-like object) to write out
+
+            Returns:
+                Integer error code
+                or
+                List of read bytes
+        '''
+        return await self.__spi_request(
+            cspin, wbytes, console.parse_bytes, proto.parse_frame_bytes)
+
+    async def spi_into(self, cspin, wbytes, rbuf):
+        ''' SPI Transaction into a caller-supplied buffer
+
+            Args:
+                cspin: Chip/Slave select pin for transaction
+                wbytes: Bytes-like object (or list of bytes) to write out
+                rbuf: Writable buffer for the read bytes. Must be at least
+                    as long as wbytes
+
+            Returns:
+                Integer error code
+                or
+                Number of bytes read into rbuf
+        '''
+        rbuf = memoryview(rbuf).cast('B')
+
+        if len(rbuf) < len(console.as_bytes(wbytes)):
+            raise ValueError('rbuf is shorter than wbytes')
+
+        return await self.__spi_request(
+            cspin, wbytes,
+            console.parse_bytes_into(rbuf), proto.parse_frame_bytes_into(rbuf))
+
+    async def __spi_request(self, cspin, wbytes, parse, parse_frame):
+        wbytes = console.as_bytes(wbytes)
+
+        if len(wbytes) > self.__SPI_MAX_BYTES:
+            raise ValueError('wbytes too long. Max:', self.__SPI_MAX_BYTES)
+
+        if self.protocol == 'binary':
+            opcode = proto.OP_SPI
+            data = proto.encode_cmd(opcode, wbytes)
+        else:
+            cmd = 'spi' + console.encode_bytes(wbytes)
+            data = cmd.encode() + b'\n'
+
+        port, pin = console.get_pin(cspin)
+        cs_cmd = 'spics ' + port + ' ' + str(pin)
+
+        await self.__reserve(len(cs_cmd) + 1 + len(data))
+
+        # Any CS change and the transfer go out back-to-back, so concurrent
+        # transfers on other CS pins can't get in between
+        cs_future = None
+        if self.lastcspin != cspin:
+            self.lastcspin = cspin
+            cs_future = self._write_cmd(cs_cmd)
+
+        if self.protocol == 'binary':
+            future = self._write_frame(opcode, wbytes, parse_frame)
+        else:
+            future = self._write_cmd(cmd, parse, split=False)
+
+        if cs_future is not None:
+            line = await self._result(cs_future)
+            if line.strip().split(' ')[0] != 'OK':
+                self.lastcspin = None
+                raise ValueError('Unable to configure SPI CS pin')
+
+        return await self._result(future)
+
+    async def spicfg(self, speed, cpol, cpha):
+        ''' SPI Configuration (see stm32f407.bridge.spicfg)
+
+            Returns:
+                True for success
+                or
+                False for failure
+        '''
+        cmd = 'spicfg {} {} {}'.format(speed, int(cpol) & 1, int(cpha) & 1)
+
+        return await self.__request(cmd, console.parse_ok)
+
+    async def gpiocfg(self, name, mode='input', pull=None):
+        ''' GPIO Configuration
+
+            Args:
+                name: Pin name with format P<port><pin> (e.g. PA3, PD11, PB0)
+                mode: Pin mode (input, output, output-od or analog)
+                pull: Pull-resistor (None, up or down)
+        '''
+        port, pin = console.get_pin(name)
+
+        if mode not in self.__pinModes:
+            raise ValueError('Invalid pin mode. Valid modes: <' +
+                             '|'.join(self.__pinModes.keys()) + '>')
+
+        if pull is not None and pull not in self.__pullModes:
+            raise ValueError('Invalid pull mode. Valid modes: <' +
+                             '|'.join(self.__pullModes.keys()) + '>')
+
+        cmd = 'gpiocfg ' + port + ' ' + str(pin) + ' ' + self.__pinModes[mode]
+
+        if pull is not None:
+            cmd += ' ' + self.__pullModes[pull]
+
+        def parse(result):
+            if result[0] != 'OK':
+                print("Error configuring pin")
+
+        return await self.__request(cmd, parse)
+
+    async def gpio(self, name, value=None):
+        ''' Read/Write GPIO (Digital only for now)
+
+            Args:
+                name: Pin name (e.g. PA3, PD11, PB0)
+                value: (If setting) - 0 or 1
+
+            Returns:
+                None - if set was succesful
+                None - if get failed
+                Integer - pin value
+        '''
+        port, pin = console.get_pin(name)
+
+        if self.protocol == 'binary':
+            payload = bytes([ord(port.upper()) - ord('A'), pin])
+
+            if value is not None:
+                payload += bytes([int(value) & 1])
+
+            def parse_frame(response):
+                status, rpayload = response
+                if status == 0 and value is None:
+                    return rpayload[0]
+                else:
+                    return None
+
+            return await self.__request_frame(
+                proto.OP_GPIO, payload, parse_frame)
+
+        cmd = 'gpio ' + port + ' ' + str(pin)
+
+        if value is not None:
+            cmd += ' ' + str(value)
+
+        def parse(result):
+            if result[0] == 'OK':
+                if value is not None:
+                    return
+                else:
+                    return int(result[1])
+            else:
+                return None
+
+        return await self.__request(cmd, parse)
+
+    # Validate a GPIO port letter
+    @staticmethod
+    def __get_port(port):
+        port = str(port).upper()
+
+        if len(port) != 1 or port < 'A' or port > 'E':
+            raise ValueError('Invalid port. Ports are A-E')
+
+        return port
+
+    async def gpio_port_read(self, port):
+        ''' Read all 16 pins of a GPIO port at once
+
+            Args:
+                port: Port letter (A-E)
+
+            Returns:
+                None - if read failed
+                Integer - pin values, with bit n set if pin n is high
+        '''
+        port = self.__get_port(port)
+
+        if self.protocol == 'binary':
+            def parse_frame(response):
+                status, payload = response
+                if status == 0:
+                    return struct.unpack('<H', payload)[0]
+                else:
+                    return None
+
+            return await self.__request_frame(
+                proto.OP_GPIO_PORT, bytes([ord(port) - ord('A')]),
+                parse_frame)
+
+        def parse(result):
+            if result[0] == 'OK':
+                return int(result[1], 16)
+            else:
+                return None
+
+        return await self.__request('gpioport ' + port, parse)
+
+    async def gpio_port_write(self, port, mask, value):
+        ''' Set several pins of a GPIO port at once
+
+            Args:
+                port: Port letter (A-E)
+                mask: Pins to set, with bit n selecting pin n
+                value: Pin values, with bit n for pin n
+
+            Returns:
+                None - Failed setting pins
+                True - Pins set successfully
+        '''
+        port = self.__get_port(port)
+        mask = int(mask) & 0xFFFF
+        value = int(value) & 0xFFFF
+
+        if self.protocol == 'binary':
+            payload = struct.pack('<BHH', ord(port) - ord('A'), mask, value)
+            return await self.__request_frame(
+                proto.OP_GPIO_PORT, payload, proto.parse_frame_ok_none)
+
+        cmd = 'gpioport {} {:X} {:X}'.format(port, mask, value)
+
+        return await self.__request(cmd, console.parse_ok_none)
+
+    async def gpio_many(self, pins):
+        ''' Read or write several GPIO pins with one command per port
+
+            See stm32f407.bridge.gpio_many.
+
+            Args:
+                pins: {pin name: value} to write pins, or a list of pin names
+                    to read them
+        '''
+        write = isinstance(pins, dict)
+
+        ports = collections.OrderedDict()
+        names = []
+        for name in pins:
+            port, pin = console.get_pin(name)
+            port = port.upper()
+            names.append((name, port, pin))
+
+            bits = ports.setdefault(port, [0, 0])
+
+            if write:
+                bits[0] |= 1 << pin
+                bits[1] |= (int(pins[name]) & 1) << pin
+
+        if write:
+            results = await asyncio.gather(
+                *[self.gpio_port_write(port, *bits)
+                  for port, bits in ports.items()])
+
+            if all(results):
+                return True
+            else:
+                return None
+
+        results = dict(zip(ports, await asyncio.gather(
+            *[self.gpio_port_read(port) for port in ports])))
+
+        values = {}
+        for name, port, pin in names:
+            if results[port] is None:
+                values[name] = None
+            else:
+                values[name] = (results[port] >> pin) & 1
+
+        return values
+
+    # Get (and cache) the ADC number for a pin
+    async def __adc_num(self, name):
+        name = name.upper()
+
+        if name not in self.__adcs:
+            port, pin = console.get_pin(name)
+
+            line = await self.__send_cmd('adcnum ' + port + ' ' + str(pin))
+            result = line.strip().split(' ')
+
+            if result[0] == 'OK':
+                self.__adcs[name] = int(result[1])
+            else:
+                self.__adcs[name] = None
+
+        if self.__adcs[name] is None:
+            raise ValueError('Not an ADC pin')
+
+        return self.__adcs[name]
+
+    async def adc(self, name):
+        ''' Read ADC pin
+
+            Args:
+                name: Pin name
+
+            Returns:
+                None - if read failed
+                float - Pin value in volts
+        '''
+        adc_num = await self.__adc_num(name)
+
+        if self.protocol == 'binary':
+            def parse_frame(response):
+                status, payload = response
+                if status == 0:
+                    return struct.unpack('<H', payload)[0] * \
+                        self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL
+                else:
+                    return None
+
+            return await self.__request_frame(
+                proto.OP_ADC, bytes([adc_num]), parse_frame)
+
+        def parse(result):
+            if result[0] == 'OK':
+                return int(result[1]) * \
+                    self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL
+            else:
+                return None
+
+        return await self.__request('adc ' + str(adc_num), parse)
+
+    async def adc_scan(self, pins, samples=1, raw=False):
+        ''' Read several ADC pins at once, samples times in a row
+
+            See stm32f407.bridge.adc_scan. Requires NumPy.
+
+            Returns:
+                (samples, pins) NumPy array. Floats in volts, or uint16 ADC
+                codes if raw is set.
+        '''
+        if numpy is None:
+            raise RuntimeError('NumPy is needed for adc_scan')
+
+        adc_nums = [await self.__adc_num(pin) for pin in pins]
+
+        if len(adc_nums) == 0:
+            raise ValueError('No pins to scan')
+
+        max_rows = self.__ADC_SCAN_MAX_VALUES // len(adc_nums)
+
+        if max_rows == 0:
+            raise ValueError('Too many pins to scan')
+
+        def parse_frame(response):
+            status, payload = response
+            if status != 0:
+                raise IOError('ADC scan failed ({})'.format(status))
+            return numpy.frombuffer(payload, dtype='<u2')
+
+        def parse(result):
+            if result[0] != 'OK':
+                raise IOError('ADC scan failed ({})'.format(' '.join(result)))
+            return numpy.array(result[1:], dtype=numpy.uint16)
+
+        chunks = []
+        for offset in range(0, samples, max_rows):
+            rows = min(max_rows, samples - offset)
+
+            if self.protocol == 'binary':
+                payload = struct.pack('<H', rows) + bytes(adc_nums)
+                chunks.append(self.__request_frame(
+                    proto.OP_ADC_SCAN, payload, parse_frame))
+            else:
+                cmd = 'adcscan ' + str(rows) + ' ' + \
+                    ' '.join(str(num) for num in adc_nums)
+                chunks.append(self.__request(cmd, parse))
+
+        values = await asyncio.gather(*chunks)
+
+        if values:
+            values = numpy.concatenate(values)
+        else:
+            values = numpy.empty(0, dtype=numpy.uint16)
+
+        values = values.astype(numpy.uint16).reshape(-1, len(adc_nums))
+
+        if raw:
+            return values
+        else:
+            return values * (self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL)
+
+    async def dac_enable(self):
+        ''' Enable DACs
+            Returns:
+                None - Failed setting DAC value
+                True - Value set successfully
+        '''
+        return await self.__request('dacenable', console.parse_ok_none)
+
+    async def dac(self, name, voltage):
+        ''' Set DAC Output
+
+            Args:
+                name: DAC pin
+                voltage: Voltage setting for pin
+
+            Returns:
+                None - Failed setting DAC value
+                True - Value set successfully
+        '''
+        name = name.upper()
+
+        if name not in self.__dacs:
+            raise ValueError('Not a DAC pin')
+
+        if voltage > self.__DAC_MAX_VOLTAGE:
+            voltage = self.__DAC_MAX_VOLTAGE
+
+        dac_val = int(voltage/self.__DAC_MAX_VOLTAGE * self.__DAC_MAX_VAL)
+
+        if self.protocol == 'binary':
+            payload = struct.pack('<BH', self.__dacs[name], dac_val)
+            return await self.__request_frame(
+                proto.OP_DAC, payload, proto.parse_frame_ok_none)
+
+        cmd = 'dac {} {}'.format(self.__dacs[name], dac_val)
+
+        return await self.__request(cmd, console.parse_ok_none)
+
+    async def pwm(self, name, duty_cycle):
+        ''' Set PWM Output
+
+            Args:
+                name: PWM pin
+                duty_cycle: Value from 0-1
+
+            Returns:
+                None - Failed setting PWM value
+                True - Value set successfully
+        '''
+        name = name.upper()
+
+        if name not in self.__pwms:
+            raise ValueError('Not a PWM pin')
+
+        if duty_cycle < 0 or duty_cycle > 1:
+            raise ValueError('Duty cycle must be between 0 and 1')
+
+        period = 10000
+        val = int(period * duty_cycle)
+
+        if self.protocol == 'binary':
+            payload = struct.pack('<BH', self.__pwms[name], val)
+            return await self.__request_frame(
+                proto.OP_PWM, payload, proto.parse_frame_ok_none)
+
+        cmd = 'pwm {} {}'.format(self.__pwms[name], val)
+
+        return await self.__request(cmd, console.parse_ok_none)
@@ -0,0 +1,469 @@
+''' Silta command benchmarks
+
+Runs a standard set of bridge commands against a board (or a simulated one)
+and reports, per command and payload size, ops/sec, p50/p99 latency and
+bytes/sec, both one command at a time and pipelined.
+
+Usage:
+    python -m silta.bench /dev/ttyACM0 (or silta-bench /dev/ttyACM0)
+    python -m silta.bench sim --latency 0.0005 --json results.json
+    python -m silta.bench --codec
+    python -m silta.bench /dev/ttyACM0 --throughput --json old.json
+    python -m silta.bench /dev/ttyACM0 --throughput --baseline old.json
+
+--codec measures only the host CPU time spent encoding ASCII console
+commands and decoding their responses, without a device.
+
+--throughput measures bulk transfer rates instead: back to back (pipelined)
+SPI transfers, up to the largest the bridge takes. That's limited by how fast
+the device gets its responses out over USB, so it's the one to compare
+across firmware versions. --baseline shows the gain over a saved run.
+
+Results can be saved as JSON to track them across library and firmware
+versions.
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from silta import console, sim, stm32f407
+from silta import protocol as proto
+
+# Payload sizes for the I2C/SPI commands, up to the bridge's limits
+SIZES = (1, 16, 64, 256, 1024)
+
+# Transfer sizes for the throughput pass (None for the largest one the
+# bridge takes)
+THROUGHPUT_SIZES = (64, 256, 1024, None)
+
+DEFAULT_ITERATIONS = 200
+DEFAULT_DEPTH = 8
+DEFAULT_DURATION = 2.0
+
+# Fast enough that the SPI bus isn't what limits throughput (USB is)
+DEFAULT_SPI_SPEED = 21000000
+
+
+def _percentile(values, percent):
+    ''' Nearest-rank percentile of a sorted list '''
+    index = int(round(percent / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def _max_sizes(bridge):
+    ''' Largest (I2C, SPI) transfers the bridge takes in one command '''
+    limits = console.limits(bridge.caps, bridge.protocol)
+
+    # Same defaults as the bridge, for firmware without the caps command
+    if limits is None:
+        return 1024, 1024
+
+    return limits['i2c'], limits['spi']
+
+
+def _cases(sizes, gpio_pin, adc_pin, i2c_addr, cs_pin, max_sizes):
+    ''' List of (command, payload size, function(bridge or pipeline))
+
+        I2C/SPI sizes over the bridge's limits (max_sizes, see _max_sizes)
+        are clipped to them.
+    '''
+    cases = [
+        ('gpio_read', 0, lambda bridge: bridge.gpio(gpio_pin)),
+        ('gpio_write', 0, lambda bridge: bridge.gpio(gpio_pin, 1)),
+        ('adc', 0, lambda bridge: bridge.adc(adc_pin)),
+    ]
+
+    max_i2c, max_spi = max_sizes
+    i2c_sizes = []
+    spi_sizes = []
+
+    for size in sizes:
+        i2c_size = min(size, max_i2c)
+        spi_size = min(size, max_spi)
+
+        if i2c_size not in i2c_sizes:
+            i2c_sizes.append(i2c_size)
+            wbytes = bytes(byte & 0xFF for byte in range(i2c_size))
+
+            cases.append(('i2c_read', i2c_size,
+                          lambda bridge, size=i2c_size: bridge.i2c1(
+                              i2c_addr, size, [0])))
+            cases.append(('i2c_write', i2c_size,
+                          lambda bridge, wbytes=wbytes: bridge.i2c1(
+                              i2c_addr, 0, wbytes)))
+
+        if spi_size not in spi_sizes:
+            spi_sizes.append(spi_size)
+            wbytes = bytes(byte & 0xFF for byte in range(spi_size))
+
+            cases.append(('spi', spi_size,
+                          lambda bridge, wbytes=wbytes: bridge.spi(cs_pin,
+                                                                   wbytes)))
+
+    return cases
+
+
+def run(bridge, iterations=DEFAULT_ITERATIONS, sizes=SIZES,
+        depth=DEFAULT_DEPTH, gpio_pin='PD12', adc_pin='PA1', i2c_addr=0x80,
+        cs_pin='PE3', commands=None):
+    ''' Run the benchmark suite
+
+        Args:
+            bridge: Open stm32f407.bridge
+            iterations: Calls per command and payload size
+            sizes: I2C/SPI payload sizes in bytes (clipped to the bridge's
+                limits)
+            depth: Pipeline depth for the pipelined pass (0 to skip it)
+            gpio_pin: Pin for the GPIO commands (configured as an output)
+            adc_pin: Pin for the ADC command (configured as analog)
+            i2c_addr: 8 bit I2C address to talk to
+            cs_pin: SPI chip select pin
+            commands: Names of the commands to run (default: all)
+
+        Returns:
+            List of result dicts, one per command and payload size
+    '''
+    bridge.gpiocfg(gpio_pin, 'output')
+    bridge.gpiocfg(adc_pin, 'analog')
+
+    results = []
+
+    for command, size, fn in _cases(sizes, gpio_pin, adc_pin, i2c_addr,
+                                    cs_pin, _max_sizes(bridge)):
+        if commands is not None and command not in commands:
+            continue
+
+        # Warm up (pin lookups, CS selection, ...)
+        fn(bridge)
+
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            value = fn(bridge)
+            latencies.append(time.perf_counter() - call_start)
+
+            # Integer results from i2c/spi are error codes
+            if isinstance(value, int) and command in ('i2c_read', 'i2c_write',
+                                                      'spi'):
+                errors += 1
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+
+        result = {
+            'command': command,
+            'size': size,
+            'iterations': iterations,
+            'errors': errors,
+            'ops_per_sec': iterations / elapsed,
+            'bytes_per_sec': iterations * size / elapsed,
+            'latency_mean': sum(latencies) / len(latencies),
+            'latency_p50': _percentile(latencies, 50),
+            'latency_p99': _percentile(latencies, 99),
+            'latency_max': latencies[-1],
+        }
+
+        if depth > 0:
+            start = time.perf_counter()
+            with bridge.pipeline(depth) as pipe:
+                for _ in range(iterations):
+                    fn(pipe)
+            elapsed = time.perf_counter() - start
+
+            result['pipelined_ops_per_sec'] = iterations / elapsed
+            result['pipelined_bytes_per_sec'] = iterations * size / elapsed
+
+        results.append(result)
+
+    return results
+
+
+def _response_size(bridge, size):
+    ''' Bytes the device sends back for an SPI transfer of size bytes '''
+    if bridge.protocol == 'binary':
+        return len(proto.encode_resp(proto.OP_SPI, 0, bytes(size)))
+
+    # 'OK ' + 'XX ' per byte + newline
+    return 4 + 3 * size
+
+
+def throughput(bridge, sizes=THROUGHPUT_SIZES, duration=DEFAULT_DURATION,
+               depth=DEFAULT_DEPTH, cs_pin='PE3',
+               spi_speed=DEFAULT_SPI_SPEED):
+    ''' Measure bulk transfer throughput with back to back SPI transfers
+
+        Args:
+            bridge: Open stm32f407.bridge
+            sizes: Transfer sizes in bytes (None for the largest one the
+                bridge takes). Sizes over the limit are clipped to it.
+            duration: Seconds to keep transferring, per size
+            depth: Pipeline depth
+            cs_pin: SPI chip select pin
+            spi_speed: SPI clock in Hz (mode 3, the firmware's default)
+
+        Returns:
+            List of result dicts, one per transfer size. bytes_per_sec is
+            payload bytes (each way), wire_bytes_per_sec the response bytes
+            the device sent, framing included.
+    '''
+    max_size = _max_sizes(bridge)[1]
+    results = []
+
+    bridge.spicfg(spi_speed, 1, 1)
+
+    for size in sizes:
+        size = max_size if size is None else min(size, max_size)
+
+        if any(result['size'] == size for result in results):
+            continue
+
+        wbytes = bytes(byte & 0xFF for byte in range(size))
+
+        # Warm up (CS selection, ...)
+        bridge.spi(cs_pin, wbytes)
+
+        pending = []
+        start = time.perf_counter()
+        with bridge.pipeline(max(depth, 1)) as pipe:
+            while time.perf_counter() - start < duration:
+                pending.append(pipe.spi(cs_pin, wbytes))
+        elapsed = time.perf_counter() - start
+
+        transfers = len(pending)
+
+        results.append({
+            'command': 'spi',
+            'size': size,
+            'transfers': transfers,
+            'errors': sum(isinstance(result.result(), int)
+                          for result in pending),
+            'transfers_per_sec': transfers / elapsed,
+            'bytes_per_sec': transfers * size / elapsed,
+            'wire_bytes_per_sec':
+                transfers * _response_size(bridge, size) / elapsed,
+        })
+
+    return results
+
+
+def _encode_per_byte(wbytes):
+    ''' Per-byte formatting, for comparison with console.encode_bytes '''
+    cmd = 'spi'
+    for byte in wbytes:
+        cmd += format(byte, ' 02X')
+    return cmd
+
+
+def _decode_per_byte(line):
+    ''' Per-byte parsing, for comparison with console.decode_bytes '''
+    result = line.strip().split(' ')
+    return [int(byte, 16) for byte in result[1:]]
+
+
+def codec(size=1024, iterations=2000):
+    ''' Host CPU time to encode an ASCII SPI command and decode its response
+
+        Args:
+            size: Transfer size in bytes
+            iterations: Transactions to time for each codec
+
+        Returns:
+            {codec name: CPU seconds per transaction}
+    '''
+    wbytes = os.urandom(size)
+    line = 'OK ' + ' '.join(format(byte, '02X') for byte in wbytes) + ' \n'
+
+    codecs = (
+        ('per-byte', _encode_per_byte, _decode_per_byte),
+        ('console', lambda data: 'spi' + console.encode_bytes(data),
+         console.parse_bytes),
+    )
+
+    results = {}
+    for name, encode, decode in codecs:
+        if decode(line) != list(wbytes):
+            raise RuntimeError(name + ' codec decoded the wrong bytes')
+
+        start = time.process_time()
+        for _ in range(iterations):
+            encode(wbytes).encode()
+            decode(line)
+        results[name] = (time.process_time() - start) / iterations
+
+    return results
+
+
+def report(results, stream=sys.stdout):
+    ''' Print results as a table '''
+    header = '{:<10} {:>5} {:>10} {:>10} {:>10} {:>12} {:>12} {:>6}'.format(
+        'command', 'size', 'ops/s', 'p50 (ms)', 'p99 (ms)', 'bytes/s',
+        'piped ops/s', 'errors')
+
+    stream.write(header + '\n')
+    stream.write('-' * len(header) + '\n')
+
+    for result in results:
+        stream.write(
+            '{:<10} {:>5} {:>10.1f} {:>10.3f} {:>10.3f} {:>12.0f} {:>12} '
+            '{:>6}\n'.format(
+                result['command'], result['size'], result['ops_per_sec'],
+                result['latency_p50'] * 1000, result['latency_p99'] * 1000,
+                result['bytes_per_sec'],
+                '{:.1f}'.format(result['pipelined_ops_per_sec'])
+                if 'pipelined_ops_per_sec' in result else '-',
+                result['errors']))
+
+
+def report_throughput(results, baseline=None, stream=sys.stdout):
+    ''' Print throughput results as a table
+
+        Args:
+            results: Results from throughput()
+            baseline: Earlier throughput() results to show the gain over
+                (matched by transfer size)
+            stream: Where to print the table
+    '''
+    baseline = {result['size']: result for result in baseline or []}
+
+    header = '{:>5} {:>12} {:>12} {:>14} {:>6}'.format(
+        'size', 'xfers/s', 'bytes/s', 'wire bytes/s', 'errors')
+    if baseline:
+        header += ' {:>12} {:>7}'.format('base bytes/s', 'gain')
+
+    stream.write(header + '\n')
+    stream.write('-' * len(header) + '\n')
+
+    for result in results:
+        line = '{:>5} {:>12.1f} {:>12.0f} {:>14.0f} {:>6}'.format(
+            result['size'], result['transfers_per_sec'],
+            result['bytes_per_sec'], result['wire_bytes_per_sec'],
+            result['errors'])
+
+        base = baseline.get(result['size'])
+        if base is not None and base['bytes_per_sec'] > 0:
+            line += ' {:>12.0f} {:>6.2f}x'.format(
+                base['bytes_per_sec'],
+                result['bytes_per_sec'] / base['bytes_per_sec'])
+        elif baseline:
+            line += ' {:>12} {:>7}'.format('-', '-')
+
+        stream.write(line + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark silta bridge commands')
+    parser.add_argument(
+        'device', nargs='?', help="serial device, pyserial URL, or 'sim' to "
+        "benchmark a simulated bridge")
+    parser.add_argument('--codec', action='store_true',
+                        help='only benchmark ASCII command encoding/decoding '
+                        '(no device needed)')
+    parser.add_argument('--throughput', action='store_true',
+                        help='measure bulk SPI transfer throughput instead '
+                        'of the command suite')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='seconds per transfer size (--throughput)')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='JSON from an earlier --throughput run to '
+                        'compare against')
+    parser.add_argument('--protocol', default='auto',
+                        choices=('auto', 'binary', 'ascii'))
+    parser.add_argument('--iterations', type=int,
+                        default=DEFAULT_ITERATIONS)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='I2C/SPI payload sizes')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help='pipeline depth (0 to skip the pipelined pass)')
+    parser.add_argument('--commands', nargs='+',
+                        help='only run these commands')
+    parser.add_argument('--gpio-pin', default='PD12')
+    parser.add_argument('--adc-pin', default='PA1')
+    parser.add_argument('--i2c-addr', type=lambda addr: int(addr, 0),
+                        default=0x80, help='8 bit I2C address')
+    parser.add_argument('--cs-pin', default='PE3')
+    parser.add_argument('--spi-speed', type=int, default=DEFAULT_SPI_SPEED,
+                        help='SPI clock in Hz (--throughput)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated USB latency in seconds (sim only)')
+    parser.add_argument('--json', metavar='FILE',
+                        help="save results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.codec:
+        for size in args.sizes or SIZES:
+            times = codec(size)
+            print('{:>5} bytes: {}'.format(size, ', '.join(
+                '{} {:.1f} us'.format(name, seconds * 1e6)
+                for name, seconds in times.items())))
+        return
+
+    if args.device is None:
+        parser.error('a device is needed (or --codec)')
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            saved = json.load(json_file)
+
+        if saved.get('mode') != 'throughput':
+            parser.error(args.baseline + " isn't from a --throughput run")
+
+        baseline = saved['results']
+
+    device = args.device
+    if device == 'sim':
+        simulator = sim.Simulator(latency=args.latency)
+        simulator.i2c_devices[args.i2c_addr] = sim.RegisterI2CDevice()
+        simulator.spi_devices[args.cs_pin.upper()] = sim.LoopbackSPIDevice()
+        device = simulator.url
+
+    # Without the state cache, repeated writes would never reach the device
+    bridge = stm32f407.bridge(device, protocol=args.protocol, cache=False)
+
+    try:
+        if args.throughput:
+            results = throughput(bridge, args.sizes or THROUGHPUT_SIZES,
+                                 args.duration, args.depth, args.cs_pin,
+                                 args.spi_speed)
+        else:
+            results = run(bridge, args.iterations, args.sizes or SIZES,
+                          args.depth, args.gpio_pin, args.adc_pin,
+                          args.i2c_addr, args.cs_pin, args.commands)
+    finally:
+        bridge.close()
+
+    if args.json != '-':
+        if args.throughput:
+            report_throughput(results, baseline)
+        else:
+            report(results)
+
+    if args.json:
+        output = {
+            'device': args.device,
+            'serial_number': bridge.serial_number,
+            'firmware_version': bridge.firmware_version,
+            'protocol': bridge.protocol,
+            'mode': 'throughput' if args.throughput else 'commands',
+            'python_version': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'results': results,
+        }
+
+        if args.json == '-':
+            json.dump(output, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            with open(args.json, 'w') as json_file:
+                json.dump(output, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+''' Silta console (ASCII protocol) encoding
+
+Byte payloads are most of the console traffic: I2C/SPI write bytes go out as
+'XX' hex arguments and read bytes come back as an 'OK XX XX ..' line. They're
+converted in bulk here, with bytes.hex/bytes.fromhex (or a precomputed table
+on Pythons whose bytes.hex can't add separators), instead of formatting and
+parsing one byte at a time.
+
+The pin name, argument and response helpers both bridges (stm32f407.bridge
+and aio.Bridge) use are here too, along with the command size limits for a
+device's caps.
+'''
+
+import re
+import sys
+
+from silta import protocol as proto
+
+# ' XX' for every byte value
+HEX = tuple(' {:02X}'.format(byte) for byte in range(256))
+
+# bytes.hex() only takes a separator from Python 3.8
+_HEX_SEP = sys.version_info >= (3, 8)
+
+
+def encode_bytes(data):
+    ''' Console arguments for data, with a leading space (' 04 D1 ..')
+
+    Args:
+        data: bytes, bytearray or unsigned byte memoryview (see as_bytes)
+    Returns:
+        str
+    '''
+    if not len(data):
+        return ''
+
+    if _HEX_SEP:
+        return ' ' + data.hex(' ').upper()
+
+    return ''.join([HEX[byte] for byte in data])
+
+
+def decode_bytes(line):
+    ''' Read bytes from an 'OK XX XX ..' response line
+
+    Args:
+        line: Whole response line
+    Returns:
+        bytes on OK, integer error code otherwise
+    '''
+    if line.startswith('OK'):
+        return bytes.fromhex(line[2:].strip())
+    else:
+        return int(line.split()[1])
+
+
+PIN_RE = re.compile(r'P([A-E])([0-9]+)', re.IGNORECASE)
+
+# Parsed pin definitions, by raw string (see get_pin)
+_pins = {}
+
+
+def get_pin(raw_str):
+    ''' Parse and validate pin definition
+    Args:
+        raw_str: string of the form PXY
+    Returns:
+        str, int
+    '''
+    try:
+        return _pins[raw_str]
+    except KeyError:
+        pass
+
+    match = PIN_RE.search(raw_str)
+    if not match:
+        raise ValueError(
+            'Invalid pin definition. Pins are defined as '
+            'PXY where X is A-E and Y is 0-15 (e.g. PB5)')
+    port, pin = match.groups()
+    pin = int(pin)
+    if pin > 15:
+        raise ValueError('Invalid pin. Should be a number from 0-15')
+    _pins[raw_str] = (port, pin)
+    return port, pin
+
+
+def as_bytes(data):
+    ''' Unsigned byte view of data
+
+    Args:
+        data: bytes-like object (bytes, bytearray, memoryview, array, ...)
+            or a list of integers
+    Returns:
+        memoryview or bytes
+    '''
+    try:
+        return memoryview(data).cast('B')
+    except TypeError:
+        return bytes(data)
+
+
+def parse_bytes_into(rbuf):
+    ''' Parser copying the read bytes into rbuf
+
+    Takes the whole response line. Returns the number of bytes read on OK,
+    integer error code otherwise
+    '''
+    def parse(line):
+        data = decode_bytes(line)
+        if isinstance(data, int):
+            return data
+        rbuf[:len(data)] = data
+        return len(data)
+
+    return parse
+
+
+# Response parsers. Each one takes the split response line (except for
+# parse_bytes and parse_bytes_into, which convert the whole line in one go)
+# and returns the value handed back to the caller of the matching bridge
+# method.
+def parse_ok(result):
+    ''' True on OK, False otherwise '''
+    return result[0] == 'OK'
+
+
+def parse_ok_none(result):
+    ''' True on OK, None otherwise '''
+    if result[0] == 'OK':
+        return True
+    else:
+        return None
+
+
+def parse_bytes(line):
+    ''' List of read bytes on OK, integer error code otherwise
+
+    Takes the whole response line, like parse_bytes_into
+    '''
+    data = decode_bytes(line)
+    if isinstance(data, int):
+        return data
+    return list(data)
+
+
+def parse_caps(result):
+    ''' Device capabilities from a split caps response line
+
+    Returns {name: int or list of strings}, empty if the firmware doesn't
+    have the caps command
+    '''
+    caps = {}
+    if result[0] == 'OK':
+        for item in result[1:]:
+            key, _, value = item.partition('=')
+            if value.isdigit():
+                caps[key] = int(value)
+            else:
+                caps[key] = value.split(',') if value else []
+
+    return caps
+
+
+def parse_ident(result):
+    ''' Device identity from a split ident response line
+
+    Returns {'serial_number', 'firmware_version', 'binary' (binary protocol
+    version, 0 if unsupported), 'caps'}, or None if the firmware doesn't
+    have the ident command
+    '''
+    if result[0] != 'OK' or not result[1:] or \
+            not result[1].startswith('sn='):
+        return None
+
+    fields = dict(item.partition('=')[::2] for item in result[1:])
+
+    caps = parse_caps(result)
+    for key in ('sn', 'version', 'binary'):
+        caps.pop(key, None)
+
+    return {
+        'serial_number': fields.get('sn'),
+        'firmware_version': fields.get('version'),
+        'binary': int(fields.get('binary', 0)),
+        'caps': caps,
+    }
+
+
+def limits(caps, protocol):
+    ''' Command size limits for a device
+
+    Args:
+        caps: Device capabilities (see parse_caps)
+        protocol: 'binary' or 'ascii'
+    Returns:
+        {'cmd': max command length, 'rx_fifo': device receive fifo size,
+        'spi': max SPI bytes, 'i2c': max I2C bytes (each way),
+        'adc_scan': max values per adcscan}, or None if caps doesn't have
+        the buffer sizes
+    '''
+    if 'txrxbuf' not in caps:
+        return None
+
+    # Command line, including the newline
+    cmd = caps['cmdbuf'] - 1
+    buff = caps['txrxbuf']
+
+    limits = {'cmd': cmd, 'rx_fifo': caps['rxfifo']}
+
+    if protocol == 'binary':
+        # The frame payload has to fit the tag (bridges tag commands if the
+        # device supports it), the I2C address and read length, or the
+        # spistream hold flag
+        payload = caps['binmax']
+        if 'tagged' in caps.get('features', []):
+            payload -= proto.TAG_LEN
+
+        limits['spi'] = min(buff, payload - 1)
+        limits['i2c'] = min(buff, payload - 3)
+        limits['adc_scan'] = buff // 2
+    else:
+        # Each byte takes an argument and 3 characters ('XX ') on the way in
+        # and out. Responses longer than the transmit fifo get mangled.
+        resp = caps['txfifo'] - 1
+        args = caps['maxargs']
+
+        limits['spi'] = min(buff, args - 2, (cmd - len('spistream 0')) // 3,
+                            (resp - len('OK')) // 3)
+        limits['i2c'] = min(buff, args - 3, (cmd - len('i2c 00 0000')) // 3,
+                            (resp - len('OK')) // 3)
+
+        # Up to 5 characters per value (' 4095')
+        limits['adc_scan'] = min(buff // 2, (resp - len('OK')) // 5)
+
+    return limits
@@ -0,0 +1,296 @@
+''' Silta I2C mux routing (TCA9548A)
+
+Lots of identical sensors (same I2C address) can share a bus by putting each
+one behind its own channel of an I2C mux. Talking to one means selecting its
+channel first, which is an I2C write of its own. The router keeps track of
+the channel each mux has selected, so the select is only sent when the
+channel actually changes.
+
+Muxes can be cascaded (a mux behind another mux's channel). Muxes on the
+same bus segment are switched off while another one is in use, so devices
+with the same address behind different muxes never clash.
+
+Example:
+    router = i2cmux.MuxRouter(bridge)
+    for channel in range(8):
+        router.add_device('sht31_{}'.format(channel), i2cmux.TCA9548A_ADDR,
+                          channel, SHT31_ADDR)
+
+    # One select per channel, however many transactions each one has
+    readings = [router.queue(name, 6) for name in names]
+    router.flush()
+'''
+
+import collections
+import weakref
+
+from silta.pipeline import Pending
+
+# Default TCA9548A address (8 bit, like the bridge's i2c addresses)
+TCA9548A_ADDR = 0x70 << 1
+
+CHANNELS = 8
+
+# Routers shared by the drivers on a bridge (see shared_router)
+_routers = weakref.WeakKeyDictionary()
+
+
+def shared_router(bridge, speed=None):
+    ''' The bridge's shared router
+
+        Independent drivers behind the same mux have to use the same router,
+        or they'll each have their own (wrong) idea of the selected channel.
+
+        Args:
+            bridge: Bridge the muxes are connected to
+            speed: I2C speed in Hz to set when the router is first created
+    '''
+    router = _routers.get(bridge)
+
+    if router is None:
+        router = MuxRouter(bridge, speed)
+        _routers[bridge] = router
+
+    return router
+
+
+def _forward(pending):
+    ''' Done callback passing a result on to another Pending '''
+    def done(result):
+        try:
+            value = result.result()
+        except Exception as e:
+            pending._set_exception(e)
+        else:
+            pending._set_response(value)
+
+    return done
+
+
+class Mux(object):
+    ''' A TCA9548A and the channel it's known to have selected '''
+
+    def __init__(self, address, parent=None):
+        self.address = address
+
+        # (mux address, channel) this mux is connected through, or None if
+        # it's on the main bus
+        self.parent = parent
+
+        # Channel mask last written, or None if unknown
+        self.mask = None
+
+
+class MuxRouter(object):
+    ''' Sends I2C transactions to devices behind (trees of) TCA9548A muxes '''
+
+    def __init__(self, bridge, speed=None, depth=8):
+        ''' Args:
+                bridge: Bridge the muxes are connected to
+                speed: I2C speed in Hz to set (optional)
+                depth: Pipeline depth for flush()
+        '''
+        self.bridge = bridge
+        self.depth = depth
+
+        self.__muxes = collections.OrderedDict()
+        self.__devices = {}
+        self.__queue = []
+
+        # Selects sent so far (the ones that were skipped aren't counted)
+        self.selects = 0
+
+        if speed is not None:
+            self.bridge.i2c_speed(speed)
+
+    def add_mux(self, address=TCA9548A_ADDR, parent=None):
+        ''' Register a mux
+
+            Args:
+                address: Mux I2C address
+                parent: (mux address, channel) the mux is connected through,
+                    for cascaded muxes. None for the main bus.
+        '''
+        if parent is not None:
+            self.__check_route(*parent)
+
+        mux = self.__muxes.get(address)
+        if mux is None:
+            mux = Mux(address, parent)
+            self.__muxes[address] = mux
+        elif mux.parent != parent:
+            raise ValueError('Mux 0x{:02X} is already connected elsewhere'
+                             .format(address))
+
+        return mux
+
+    def add_device(self, name, mux, channel, address):
+        ''' Register a device behind a mux
+
+            Args:
+                name: Name to refer to the device by
+                mux: Address of the mux it's connected to (registered as a
+                    main bus mux if it hasn't been added yet)
+                channel: Mux channel (0-7)
+                address: Device I2C address
+        '''
+        if mux not in self.__muxes:
+            self.add_mux(mux)
+
+        self.__check_route(mux, channel)
+        self.__devices[name] = (mux, channel, address)
+
+    def set_selected(self, mux, channel):
+        ''' Record a select made without the router (e.g. by a device
+            script, see silta.script)
+
+            Args:
+                mux: Mux address
+                channel: Channel it has selected now
+        '''
+        self.__check_route(mux, channel)
+        self.__muxes[mux].mask = 1 << channel
+
+    def invalidate(self):
+        ''' Forget the selected channels (e.g. after the muxes were reset) '''
+        for mux in self.__muxes.values():
+            mux.mask = None
+
+    def __check_route(self, mux, channel):
+        if mux not in self.__muxes:
+            raise ValueError('Unknown mux 0x{:02X}'.format(mux))
+
+        if channel >= CHANNELS or channel < 0:
+            raise ValueError('Channel out of range. Must be between 0-7')
+
+    def __path(self, mux, channel):
+        ''' [(Mux, channel), ...] from the main bus down to mux/channel '''
+        path = []
+        route = (mux, channel)
+
+        while route is not None:
+            mux = self.__muxes[route[0]]
+            path.insert(0, (mux, route[1]))
+            route = mux.parent
+
+        return path
+
+    def __set_mask(self, mux, mask, target, selects):
+        if mux.mask == mask:
+            return
+
+        selects.append((mux, target.i2c(mux.address, 0, [mask])))
+
+        # Assume it worked. If it didn't, the mask is reset to unknown when
+        # the result comes back (see __check_selects).
+        mux.mask = mask
+        self.selects += 1
+
+    def __route(self, mux, channel, target, selects):
+        ''' Queue the writes needed to connect mux/channel to the main bus '''
+        for mux, channel in self.__path(mux, channel):
+
+            # Other muxes on the same segment have to let go of the bus
+            for other in self.__muxes.values():
+                if other is not mux and other.parent == mux.parent:
+                    self.__set_mask(other, 0, target, selects)
+
+            self.__set_mask(mux, 1 << channel, target, selects)
+
+    def __check_selects(self, selects):
+        failed = None
+
+        for mux, rval in selects:
+            if isinstance(rval, Pending):
+                rval = rval.result()
+
+            if not isinstance(rval, list):
+                mux.mask = None
+                failed = failed or (mux, rval)
+
+        if failed is not None:
+            raise IOError('TCA9548A 0x{:02X} not found. ({})'.format(
+                failed[0].address, failed[1]))
+
+    def select(self, mux, channel):
+        ''' Connect a mux channel to the main bus (if it isn't already)
+
+            Args:
+                mux: Mux address
+                channel: Mux channel (0-7)
+        '''
+        self.__check_route(mux, channel)
+
+        selects = []
+        self.__route(mux, channel, self.bridge, selects)
+        self.__check_selects(selects)
+
+    def i2c(self, name, rlen, wbytes=[]):
+        ''' I2C transaction with a registered device (see bridge.i2c) '''
+        mux, channel, address = self.__devices[name]
+
+        self.select(mux, channel)
+
+        return self.bridge.i2c(address, rlen, wbytes)
+
+    def queue(self, name, rlen, wbytes=[]):
+        ''' Queue an I2C transaction with a registered device
+
+            Queued transactions are sent by flush(), grouped by mux channel
+            (in the order they were queued within a channel).
+
+            Returns:
+                Pending result (see bridge.pipeline). Calling its result()
+                before flush() flushes the queue.
+        '''
+        route = self.__devices[name]
+        pending = Pending(self)
+
+        self.__queue.append((route, rlen, wbytes, pending))
+
+        return pending
+
+    def _read_resp(self):
+        ''' Called by a Pending that's waited on before flush() '''
+        self.flush()
+
+    def flush(self):
+        ''' Send all queued transactions, selecting each channel once '''
+        queue = self.__queue
+        self.__queue = []
+
+        if not queue:
+            return
+
+        # Group by channel, keeping the order channels first show up in.
+        # Start with whichever one is selected already.
+        groups = collections.OrderedDict()
+        for entry in queue:
+            groups.setdefault(entry[0][:2], []).append(entry)
+
+        def unselected(route):
+            mux, channel = route
+            return self.__muxes[mux].mask != 1 << channel
+
+        routes = sorted(groups, key=unselected)
+
+        selects = []
+        try:
+            with self.bridge.pipeline(self.depth) as pipe:
+                for route in routes:
+                    self.__route(route[0], route[1], pipe, selects)
+
+                    for (_, _, address), rlen, wbytes, pending in \
+                            groups[route]:
+                        pipe.i2c(address, rlen, wbytes).add_done_callback(
+                            _forward(pending))
+        except Exception as e:
+            # Don't leave anyone waiting on a transaction that wasn't sent.
+            # Nothing is known about the muxes anymore either.
+            for _, _, _, pending in queue:
+                if not pending.done():
+                    pending._set_exception(e)
+            self.invalidate()
+            raise
+
+        self.__check_selects(selects)
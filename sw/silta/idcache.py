@@ -0,0 +1,69 @@
+''' Silta device identity cache
+
+Remembers which board (serial number, firmware version and capabilities) was
+last seen on each port, so bridges can skip the connect handshake. Entries
+are only hints: bridges check them against the board in the background and
+drop the ones that turn out to be stale (see stm32f407.bridge).
+'''
+
+import json
+import os
+import tempfile
+
+
+def default_path():
+    ''' Cache file in the user's cache directory '''
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'silta', 'devices.json')
+
+
+def load(path):
+    ''' {port: identity} from the cache file (empty if it can't be read) '''
+    try:
+        with open(path) as cache_file:
+            entries = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if not isinstance(entries, dict):
+        return {}
+
+    return entries
+
+
+def get(path, port):
+    ''' Cached identity for port, or None '''
+    return load(path).get(port)
+
+
+def put(path, port, identity):
+    ''' Save the identity of the board on port '''
+    entries = load(path)
+    entries[port] = identity
+    _save(path, entries)
+
+
+def remove(path, port):
+    ''' Forget the board on port '''
+    entries = load(path)
+    if entries.pop(port, None) is not None:
+        _save(path, entries)
+
+
+def _save(path, entries):
+    ''' Replace the cache file in one go, so readers never see half of it '''
+    directory = os.path.dirname(path) or '.'
+
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(entries, cache_file, indent=2, sort_keys=True)
+
+        os.replace(tmp_path, path)
+    except (IOError, OSError) as e:
+        print('Warning: Could not save device cache ' + path + ': ' + str(e))
@@ -0,0 +1,160 @@
+''' Silta command pipelining
+
+The firmware handles one command at a time and answers each one with a single
+line, in the order the commands were received. That means the host doesn't
+have to wait for a response before sending the next command: it can keep
+several commands in flight and match response lines back to them in order.
+
+The device handles queued commands back to back: its main loop only goes to
+sleep once there's no complete command left in the receive fifo (see
+fw/main.c). Firmware from before that change waits for the next interrupt
+between commands, so pipelining gains less there.
+
+With firmware that has the 'tagged' feature, binary I2C and SPI commands
+carry a tag and run in the background, so an I2C transaction and an SPI
+transfer can overlap. Their responses may then come back out of order; the
+bridge matches them by tag instead. Commands still start in the order they
+were sent, and everything else waits for the bus commands before it.
+'''
+
+
+class Pending(object):
+    ''' Result of a command that has been sent, but maybe not answered yet '''
+
+    def __init__(self, bridge, parse=None):
+        self._bridge = bridge
+        self._parse = parse
+        self._done = False
+        self._value = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        ''' True if the response has already been read '''
+        return self._done
+
+    def result(self):
+        ''' Wait for the response (if needed) and return the command's result
+
+            Any exception raised while parsing the response is raised here.
+        '''
+        while not self._done:
+            self._bridge._read_resp()
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._value
+
+    def add_done_callback(self, fn):
+        ''' Call fn(pending) once the response has been read
+
+            If the response is already here, fn is called right away.
+        '''
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def _set_response(self, response):
+        ''' Parse the response and wake up anyone waiting on it '''
+        if self._parse is None:
+            self._value = response
+        else:
+            try:
+                self._value = self._parse(response)
+            except Exception as e:
+                self._exception = e
+
+        self.__finish()
+
+    def _set_exception(self, exception):
+        ''' Fail the command (e.g. the response couldn't be read) '''
+        self._exception = exception
+        self.__finish()
+
+    def __finish(self):
+        self._done = True
+
+        for fn in self._callbacks:
+            fn(self)
+
+
+class Pipeline(object):
+    ''' Pipelined view of a bridge
+
+        Exposes the bridge's command methods, but each call returns a Pending
+        result as soon as the command is written. At most `depth` commands
+        are kept in flight; responses are read as needed to stay under it.
+        Leaving a `with` block waits for every outstanding response.
+    '''
+
+    # Bridge methods that can be pipelined
+    COMMANDS = (
+        'i2c', 'i2c1', 'i2c_read_into', 'i2c_speed', 'i2c1_speed', 'i2c1_pins',
+        'spi', 'spi_into', 'spicfg',
+        'gpiocfg', 'gpio', 'gpio_port_read', 'gpio_port_write',
+        'adc', 'dac_enable', 'dac', 'pwm',
+        'script_load', 'script_run',
+    )
+
+    def __init__(self, bridge, depth=8):
+        if depth < 1:
+            raise ValueError('Pipeline depth must be at least 1')
+
+        self.bridge = bridge
+        self.depth = depth
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def __getattr__(self, name):
+        if name not in self.COMMANDS:
+            raise AttributeError(
+                "'Pipeline' object has no attribute '{}'".format(name))
+
+        def call(*args, **kwargs):
+            pending = self.bridge._call_deferred(name, *args, **kwargs)
+
+            while self.bridge._in_flight() > self.depth:
+                self.bridge._read_resp()
+
+            return pending
+
+        return call
+
+    def flush(self):
+        ''' Wait for the responses to all in-flight commands '''
+        self.bridge.drain()
+
+
+class Batch(Pipeline):
+    ''' Batched view of a bridge
+
+        Like Pipeline, but commands are held on the host and written to the
+        device together, in a single write, when the batch is flushed. The
+        responses are then read back in bulk. Batches larger than the
+        device's receive fifo are split into several writes automatically.
+    '''
+
+    def __init__(self, bridge):
+        super(Batch, self).__init__(bridge)
+        self.bridge._set_coalesce(True)
+
+    def __getattr__(self, name):
+        if name not in self.COMMANDS:
+            raise AttributeError(
+                "'Batch' object has no attribute '{}'".format(name))
+
+        def call(*args, **kwargs):
+            return self.bridge._call_deferred(name, *args, **kwargs)
+
+        return call
+
+    def flush(self):
+        ''' Send all collected commands and wait for their responses '''
+        self.bridge._set_coalesce(False)
+        self.bridge.drain()
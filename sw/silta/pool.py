@@ -0,0 +1,150 @@
+''' Silta multi-board pool
+
+Opens several bridges at once and runs the same operation on all of them in
+parallel, one worker thread per board. Results come back keyed by each
+board's serial number.
+'''
+
+import concurrent.futures
+
+from serial.tools import list_ports
+
+from silta import stm32f407
+from silta.pipeline import Pipeline
+
+# USB IDs of the firmware's virtual COM port
+USB_VID = 0x0483
+USB_PID = 0x5740
+
+
+def find_devices():
+    ''' List the serial devices of all connected Silta boards
+
+        Returns:
+            Sorted list of device paths (e.g. ['/dev/ttyACM0', ...])
+    '''
+    return sorted(port.device for port in list_ports.comports()
+                  if port.vid == USB_VID and port.pid == USB_PID)
+
+
+class BridgePool(object):
+    ''' Group of bridges, keyed by serial number
+
+        Args:
+            devices: Serial device paths. Defaults to every connected board
+                (see find_devices)
+            max_workers: Number of threads talking to the boards. Defaults
+                to one per board
+            **kwargs: Passed on to each stm32f407.bridge (e.g. protocol)
+
+        Boards are opened in parallel. Boards that fail to open are left out
+        (with a warning) and their errors are kept in `failed`, by device.
+
+        Bridge command methods (adc, i2c, gpio, ...) can be called on the pool
+        directly. They run on every board and return {serial_number: result}.
+
+        Example:
+            with BridgePool() as pool:
+                pool.gpiocfg('PA1', 'analog')
+                for serial_number, volts in pool.adc('PA1').items():
+                    ...
+    '''
+
+    # Bridge methods that can be called on the whole pool
+    COMMANDS = Pipeline.COMMANDS + ('gpio_many', 'adc_scan')
+
+    def __init__(self, devices=None, max_workers=None, **kwargs):
+        if devices is None:
+            devices = find_devices()
+
+        self.bridges = {}
+        self.failed = {}
+
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or max(len(devices), 1))
+
+        futures = {}
+        for device in devices:
+            futures[device] = self.__executor.submit(
+                stm32f407.bridge, device, **kwargs)
+
+        for device, future in futures.items():
+            try:
+                bridge = future.result()
+            except Exception as e:
+                print('Warning: Could not open ' + device + ': ' + str(e))
+                self.failed[device] = e
+                continue
+
+            # Fall back to the device path for boards without a serial number
+            key = bridge.serial_number or device
+
+            if key in self.bridges:
+                print('Warning: Duplicate serial number ' + key +
+                      ' (' + device + '), using device path instead')
+                key = device
+
+            self.bridges[key] = bridge
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.bridges)
+
+    def __iter__(self):
+        return iter(self.bridges)
+
+    def __getitem__(self, serial_number):
+        return self.bridges[serial_number]
+
+    def __getattr__(self, name):
+        if name not in self.COMMANDS:
+            raise AttributeError(
+                "'BridgePool' object has no attribute '{}'".format(name))
+
+        def call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+
+        return call
+
+    def map(self, fn, *args, **kwargs):
+        ''' Run fn(bridge, *args, **kwargs) on every board in parallel
+
+            Args:
+                fn: Function to run. Each call gets its own board, so it
+                    doesn't need to be thread-safe with respect to it
+
+            Returns:
+                {serial_number: return value}. If any call raises, the
+                exception is raised here (after all calls have finished).
+        '''
+        futures = {}
+        for key, bridge in self.bridges.items():
+            futures[key] = self.__executor.submit(fn, bridge, *args, **kwargs)
+
+        concurrent.futures.wait(futures.values())
+
+        return {key: future.result() for key, future in futures.items()}
+
+    def call(self, name, *args, **kwargs):
+        ''' Call a bridge method on every board in parallel
+
+            Args:
+                name: Bridge method name (e.g. 'adc')
+
+            Returns:
+                {serial_number: return value}
+        '''
+        return self.map(
+            lambda bridge: getattr(bridge, name)(*args, **kwargs))
+
+    def close(self):
+        ''' Close every board and stop the worker threads '''
+        try:
+            self.map(lambda bridge: bridge.close())
+        finally:
+            self.__executor.shutdown()
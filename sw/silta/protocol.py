@@ -0,0 +1,235 @@
+''' Silta binary wire protocol
+
+Alternative to the ASCII console protocol for the data-heavy commands. Frames
+start with a sync byte that can't start an ASCII command, so the firmware can
+tell both kinds of traffic apart and they can be mixed freely.
+
+Command frame (host to device):
+    SYNC | opcode | length (u16) | payload | crc (u16)
+
+Response frame (device to host):
+    SYNC | opcode | status (s8) | length (u16) | payload | crc (u16)
+
+All multi-byte fields are little endian. The CRC is CRC-16/CCITT-FALSE
+(poly 0x1021, init 0xFFFF) over everything between SYNC and the CRC.
+A status of 0 means success. Negative values are either the peripheral's own
+error code (e.g. I2C NACK) or one of the ERR_* protocol errors below.
+
+Payloads:
+    OP_I2C  - addr (u8) | rlen (u16) | write bytes -> read bytes
+    OP_SPI  - write bytes -> read bytes
+    OP_GPIO - port (u8, 0=A) | pin (u8) [| value (u8)] -> [value (u8)]
+    OP_ADC  - adc number (u8) -> value (u16)
+    OP_DAC  - dac number (u8) | value (u16) -> nothing
+    OP_PWM  - channel (u8) | value (u16) -> nothing
+    OP_ADC_STREAM - rate in Hz (u32) | adc numbers (u8 each)
+                    -> timer clock (u32) | timer period (u32) | rows (u32)
+                  - (empty, stops the stream) -> nothing
+    OP_ADC_SCAN - samples (u16) | adc numbers (u8 each)
+                  -> values (u16 each, interleaved by channel)
+    OP_GPIO_PORT - port (u8, 0=A) -> input levels (u16)
+                 - port (u8, 0=A) | mask (u16) | value (u16) -> nothing
+    OP_SPI_STREAM - hold cs (u8) | write bytes -> read bytes
+        Like OP_SPI, but CS stays asserted afterwards if hold cs is set.
+        An empty transfer without it just releases CS.
+    OP_SCRIPT_LOAD - script id (u8) | steps -> nothing
+        Stores a script on the device (no steps deletes it). ERR_ARGS if a
+        step is invalid, ERR_LEN if the script is too long (caps scriptmax)
+        or reads more than the device's buffer.
+    OP_SCRIPT_RUN - script id (u8) -> bytes read by all the steps
+        If a step fails, the script stops there. The status is the step's
+        error code and the payload its index (u8).
+    OP_JOB - job id (u8) | script id (u8) | period in ms (u32) -> nothing
+        Runs a loaded script every period ms (on the device's clock) and
+        sends the results as OP_JOB_DATA frames, until stopped.
+           - job id (u8) -> nothing (stops the job)
+           - (empty) -> nothing (stops all jobs)
+
+Script steps (step type (u8) | arguments):
+    STEP_I2C    - addr (u8) | rlen (u16) | wlen (u16) | write bytes
+                  -> rlen bytes
+    STEP_SPI    - hold cs (u8) | length (u16) | write bytes -> length bytes
+    STEP_GPIO   - port (u8, 0=A) | pin (u8) | value (u8, GPIO_READ reads)
+                  -> [value (u8)]
+    STEP_SPI_CS - port (u8, 0=A) | pin (u8) -> nothing
+    STEP_DELAY  - microseconds (u32, up to MAX_DELAY_US) -> nothing
+    STEP_ADC    - adc number (u8) -> value (u16)
+
+Commands can be tagged (firmware with the 'tagged' feature) by setting the
+TAGGED bit in the opcode and putting a tag (u8) at the start of the payload.
+The response has the TAGGED bit set too and starts with the same tag:
+    SYNC | opcode | TAGGED | length (u16) | tag | payload | crc (u16)
+    SYNC | opcode | TAGGED | status (s8) | length (u16) | tag | payload | crc
+(length includes the tag). Tagged I2C and SPI commands are left running on
+their bus while the device goes on with the next commands, so their
+responses can come back out of order. Commands are still started in the
+order they're received. A command waits until:
+    - tagged I2C: the previous tagged I2C command is done
+    - tagged SPI and SPI_STREAM: the previous tagged SPI command is done
+    - tagged SCRIPT_RUN, untagged commands and console commands: all the
+      tagged commands are done (so untagged responses stay in order)
+Other tagged commands don't wait. Responses to frames with a bad CRC aren't
+tagged.
+
+Opcodes with the ASYNC bit set are sent by the device on its own, not as a
+response to a command, and can show up between any two responses:
+    OP_ADC_STREAM_DATA - first sample index (u32) | drops (u32) | samples
+        Samples are 12-bit values, interleaved by channel and packed in
+        pairs (a, b) as three bytes: a[7:0], b[3:0] a[11:8], b[11:4]
+    OP_TIMING_DATA - sequence (u32) | parse (u32) | execute (u32) |
+                     format (u32) | clock in Hz (u32)
+        Sent right after each response while timing telemetry is enabled
+        (console 'timing 1' command). Times are in clock cycles.
+    OP_JOB_DATA - job id (u8) | sequence (u32) | time in us (u32) |
+                  drops (u32) | bytes read by the script
+        One per job run. The sequence counts periods since the job started
+        and the time (which wraps around) is when the run started. Drops
+        counts runs that were skipped, because the device was busy, or not
+        sent, because its transmit buffer was full. The status and payload
+        of failed runs are the same as OP_SCRIPT_RUN's.
+'''
+
+import binascii
+import struct
+
+VERSION = 1
+
+SYNC = 0xA5
+
+OP_I2C = 0x01
+OP_SPI = 0x02
+OP_GPIO = 0x03
+OP_ADC = 0x04
+OP_DAC = 0x05
+OP_PWM = 0x06
+OP_ADC_STREAM = 0x07
+OP_ADC_SCAN = 0x08
+OP_GPIO_PORT = 0x09
+OP_SPI_STREAM = 0x0A
+OP_SCRIPT_LOAD = 0x0C
+OP_SCRIPT_RUN = 0x0D
+OP_JOB = 0x0E
+
+ASYNC = 0x80
+TAGGED = 0x40
+OP_ADC_STREAM_DATA = ASYNC | OP_ADC_STREAM
+OP_TIMING_DATA = ASYNC | 0x0B
+OP_JOB_DATA = ASYNC | OP_JOB
+
+STEP_I2C = 0x01
+STEP_SPI = 0x02
+STEP_GPIO = 0x03
+STEP_SPI_CS = 0x04
+STEP_DELAY = 0x05
+STEP_ADC = 0x06
+
+GPIO_READ = 0xFF
+MAX_DELAY_US = 1000000
+
+ERR_CRC = -100
+ERR_OPCODE = -101
+ERR_ARGS = -102
+ERR_LEN = -103
+
+# SYNC + opcode + length
+CMD_HEADER_LEN = 4
+# SYNC + opcode + status + length
+RESP_HEADER_LEN = 5
+CRC_LEN = 2
+TAG_LEN = 1
+
+_CMD_HEADER = struct.Struct('<BBH')
+_RESP_HEADER = struct.Struct('<BBbH')
+_CRC = struct.Struct('<H')
+
+
+def crc16(data, crc=0xFFFF):
+    ''' CRC-16/CCITT-FALSE of data '''
+    return binascii.crc_hqx(data, crc)
+
+
+def encode_cmd(opcode, payload=b'', tag=None):
+    ''' Build a command frame (tagged, if tag isn't None) '''
+    if tag is not None:
+        opcode |= TAGGED
+        payload = bytes([tag]) + payload
+
+    header = _CMD_HEADER.pack(SYNC, opcode, len(payload))
+    crc = crc16(payload, crc16(header[1:]))
+    return header + payload + _CRC.pack(crc)
+
+
+def encode_resp(opcode, status, payload=b'', tag=None):
+    ''' Build a response frame (tagged, if tag isn't None) '''
+    if tag is not None:
+        opcode |= TAGGED
+        payload = bytes([tag]) + payload
+
+    header = _RESP_HEADER.pack(SYNC, opcode, status, len(payload))
+    crc = crc16(payload, crc16(header[1:]))
+    return header + payload + _CRC.pack(crc)
+
+
+def decode_cmd_header(header):
+    ''' Returns (opcode, payload length) of a command frame header '''
+    sync, opcode, length = _CMD_HEADER.unpack(header)
+    if sync != SYNC:
+        raise ValueError('Missing sync byte')
+    return opcode, length
+
+
+def decode_resp_header(header):
+    ''' Returns (opcode, status, payload length) of a response frame header '''
+    sync, opcode, status, length = _RESP_HEADER.unpack(header)
+    if sync != SYNC:
+        raise ValueError('Missing sync byte')
+    return opcode, status, length
+
+
+def check_crc(header, payload, crc_bytes):
+    ''' True if crc_bytes matches the frame's header and payload '''
+    crc = crc16(payload, crc16(header[1:]))
+    return _CRC.unpack(crc_bytes)[0] == crc
+
+
+def unpack12(data):
+    ''' Unpack 12-bit sample pairs into a list of integers '''
+    samples = []
+    for index in range(0, len(data) - 2, 3):
+        low, mid, high = data[index:index + 3]
+        samples.append(low | ((mid & 0x0F) << 8))
+        samples.append((mid >> 4) | (high << 4))
+    return samples
+
+
+# Response parsers, shared by the bridges. These take a (status, payload)
+# tuple and return the value handed back to the caller of the matching
+# bridge method.
+def parse_frame_ok_none(response):
+    ''' True on success, None otherwise '''
+    if response[0] == 0:
+        return True
+    else:
+        return None
+
+
+def parse_frame_bytes(response):
+    ''' List of read bytes on success, integer error code otherwise '''
+    status, payload = response
+    if status == 0:
+        return list(payload)
+    else:
+        return status
+
+
+def parse_frame_bytes_into(rbuf):
+    ''' Binary protocol version of console.parse_bytes_into '''
+    def parse(response):
+        status, payload = response
+        if status == 0:
+            rbuf[:len(payload)] = payload
+            return len(payload)
+        else:
+            return status
+
+    return parse
@@ -0,0 +1,90 @@
+''' pyserial URL handler for simulated bridges (sim:// URLs, see silta.sim)
+
+pyserial finds it through serial.protocol_handler_packages, which silta
+registers itself in when imported.
+'''
+
+from serial.serialutil import PortNotOpenError, SerialBase, SerialException
+
+from silta import sim
+
+
+class Serial(SerialBase):
+    ''' Serial port connected to a silta.sim.Simulator '''
+
+    def open(self):
+        if self.is_open:
+            raise SerialException('Port is already open.')
+
+        if self._port is None:
+            raise SerialException(
+                'Port must be configured before it can be used.')
+
+        try:
+            self.simulator = sim.from_url(self.port)
+        except ValueError as e:
+            raise SerialException(str(e))
+
+        self.is_open = True
+
+    def _reconfigure_port(self):
+        # Nothing to configure on a simulated port
+        pass
+
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.simulator.in_waiting()
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.simulator.read(size, self._timeout)
+
+    def write(self, data):
+        if not self.is_open:
+            raise PortNotOpenError()
+        self.simulator.write(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        while self.simulator.read(4096, 0):
+            pass
+
+    def reset_output_buffer(self):
+        pass
+
+    @property
+    def out_waiting(self):
+        return 0
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
@@ -0,0 +1,394 @@
+''' Silta sample recorder
+
+Logs timestamped samples (ADC reads, sensor values, ...) into a fixed-size
+ring file, so long captures use a constant amount of memory and disk. Once
+the file is full, the oldest records are overwritten.
+
+The file is memory-mapped on both sides. Readers get NumPy views straight
+into it (no copies), and can tail it while the capture is still running,
+e.g. from a separate plotting or analysis process.
+
+File layout (little endian):
+    Header (HEADER_SIZE bytes)
+        magic (8s) | version (u32) | header size (u32) | capacity (u64) |
+        channels (u32) | dtype (8s, NumPy dtype string) | record size (u32) |
+        padding (8 bytes) | written (u64, at offset 48) | names length (u32) |
+        names (JSON list)
+    Records (capacity of them)
+        time (f8, seconds since the epoch) | values (channels x dtype)
+
+`written` is the total number of records written so far. Record i lives in
+slot i % capacity. The writer fills in a record before counting it, so
+readers never see records that are only partly written.
+
+Example:
+    with recorder.Recorder('soak.rec', ['PA1', 'PA2'], 10**7) as rec:
+        rec.capture(lambda: [bridge.adc('PA1'), bridge.adc('PA2')], 0.01)
+
+    # Somewhere else, while that's running
+    reader = recorder.Reader('soak.rec')
+    for records in reader.tail():
+        plot(records['time'], records['values'][:, 0])
+'''
+
+import json
+import mmap
+import os
+import struct
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'SILTAREC'
+VERSION = 1
+
+HEADER_SIZE = 4096
+
+# (padded so written is 8-byte aligned, for the NumPy view of it)
+_HEADER = struct.Struct('<8sIIQI8sI8x')
+_WRITTEN = struct.Struct('<Q')
+_WRITTEN_OFFSET = _HEADER.size
+_NAMES_LEN = struct.Struct('<I')
+_NAMES_OFFSET = _WRITTEN_OFFSET + _WRITTEN.size
+
+
+def record_dtype(channels, dtype='<f4'):
+    ''' NumPy dtype of a single record '''
+    return numpy.dtype([('time', '<f8'),
+                        ('values', numpy.dtype(dtype), (channels,))])
+
+
+def _check_numpy():
+    if numpy is None:
+        raise RuntimeError('NumPy is needed for silta.recorder')
+
+
+class _RingFile(object):
+    ''' Memory-mapped ring of records (shared by Recorder and Reader) '''
+
+    def _map(self, fd, size, access):
+        self._mmap = mmap.mmap(fd, size, access=access)
+
+        self._written = numpy.frombuffer(
+            self._mmap, '<u8', 1, _WRITTEN_OFFSET)
+
+        # Whole ring, in slot order
+        self.ring = numpy.frombuffer(
+            self._mmap, self.dtype, self.capacity, HEADER_SIZE)
+        self._times = self.ring['time']
+        self._values = self.ring['values']
+
+    @property
+    def written(self):
+        ''' Total number of records written (including overwritten ones) '''
+        return int(self._written[0])
+
+    def oldest(self):
+        ''' Index of the oldest record still in the file '''
+        return max(self.written - self.capacity, 0)
+
+    def chunks(self, start=None, stop=None):
+        ''' Views of records start to stop-1 (by record index)
+
+            Args:
+                start: First record (default: the oldest one still there)
+                stop: One past the last record (default: all written so far)
+
+            Returns:
+                List of zero, one or two (when they wrap around the end of
+                the ring) structured array views, oldest first. Views point
+                into the file, so they change once the writer overwrites
+                those records (see valid()).
+        '''
+        written = self.written
+
+        if stop is None or stop > written:
+            stop = written
+        if start is None or start < written - self.capacity:
+            start = max(written - self.capacity, 0)
+        if start >= stop:
+            return []
+
+        first = start % self.capacity
+        count = stop - start
+
+        if first + count <= self.capacity:
+            return [self.ring[first:first + count]]
+
+        return [self.ring[first:], self.ring[:first + count - self.capacity]]
+
+    def valid(self, start):
+        ''' True if record start (and everything after it) hasn't been
+            overwritten yet
+        '''
+        return start >= self.written - self.capacity
+
+    def latest(self, count=None):
+        ''' The last count records (default: all of them)
+
+            Returns:
+                Structured array with 'time' and 'values' fields. A view into
+                the file if the records are contiguous, a copy otherwise.
+        '''
+        stop = self.written
+        start = None if count is None else stop - count
+
+        chunks = self.chunks(start, stop)
+
+        if not chunks:
+            return self.ring[:0]
+        if len(chunks) == 1:
+            return chunks[0]
+
+        return numpy.concatenate(chunks)
+
+    def close(self):
+        self.ring = None
+        self._times = None
+        self._values = None
+        self._written = None
+
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Someone still holds a view. The mapping goes away with it.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Recorder(_RingFile):
+    ''' Writes timestamped samples to a ring file '''
+
+    def __init__(self, path, channels, capacity, dtype='<f4'):
+        ''' Create (or replace) a ring file
+
+            Args:
+                path: File name
+                channels: Number of values per record, or a list of channel
+                    names
+                capacity: Number of records the file holds
+                dtype: NumPy dtype of the values (e.g. '<u2' for raw ADC
+                    codes)
+        '''
+        _check_numpy()
+
+        if isinstance(channels, int):
+            names = [str(channel) for channel in range(channels)]
+        else:
+            names = [str(name) for name in channels]
+
+        if not names:
+            raise ValueError('A record needs at least one channel')
+
+        if capacity < 1:
+            raise ValueError('Capacity must be at least one record')
+
+        value_dtype = numpy.dtype(dtype).newbyteorder('<').str
+
+        self.path = path
+        self.names = names
+        self.channels = len(names)
+        self.capacity = capacity
+        self.dtype = record_dtype(self.channels, value_dtype)
+
+        names_json = json.dumps(names).encode()
+
+        if _NAMES_OFFSET + _NAMES_LEN.size + len(names_json) > HEADER_SIZE:
+            raise ValueError('Channel names are too long')
+
+        header = bytearray(HEADER_SIZE)
+        _HEADER.pack_into(header, 0, MAGIC, VERSION, HEADER_SIZE, capacity,
+                          self.channels, value_dtype.encode(),
+                          self.dtype.itemsize)
+        _NAMES_LEN.pack_into(header, _NAMES_OFFSET, len(names_json))
+        offset = _NAMES_OFFSET + _NAMES_LEN.size
+        header[offset:offset + len(names_json)] = names_json
+
+        size = HEADER_SIZE + capacity * self.dtype.itemsize
+
+        # Write the header first, so a reader opening the file early never
+        # sees a half written one
+        with open(path, 'wb') as rec_file:
+            rec_file.write(header)
+            rec_file.truncate(size)
+
+        self.__file = open(path, 'r+b')
+        self._map(self.__file.fileno(), size, mmap.ACCESS_WRITE)
+
+    def record(self, values, timestamp=None):
+        ''' Add one record
+
+            Args:
+                values: One value per channel
+                timestamp: Sample time in seconds since the epoch (default:
+                    now)
+        '''
+        written = self.written
+        slot = written % self.capacity
+
+        self._times[slot] = time.time() if timestamp is None else timestamp
+        self._values[slot] = values
+
+        self._written[0] = written + 1
+
+    def record_many(self, values, timestamps):
+        ''' Add several records at once (e.g. an adc_scan() result)
+
+            Args:
+                values: (records, channels) array
+                timestamps: One time per record (seconds since the epoch)
+        '''
+        values = numpy.asarray(values).reshape(-1, self.channels)
+        timestamps = numpy.broadcast_to(
+            numpy.asarray(timestamps, dtype='<f8'), (len(values),))
+
+        written = self.written
+        count = len(values)
+
+        # Only the last capacity records would survive anyway
+        skip = max(count - self.capacity, 0)
+
+        start = written + skip
+        done = skip
+        while done < count:
+            slot = start % self.capacity
+            length = min(count - done, self.capacity - slot)
+
+            self._times[slot:slot + length] = timestamps[done:done + length]
+            self._values[slot:slot + length] = values[done:done + length]
+
+            start += length
+            done += length
+
+        self._written[0] = written + count
+
+    def capture(self, read, interval=0.0, count=None, duration=None):
+        ''' Record the values returned by read() until stopped
+
+            Args:
+                read: Function returning one value per channel (e.g.
+                    lambda: [my_bridge.adc('PA1')])
+                interval: Seconds between reads
+                count: Stop after this many records
+                duration: Stop after this many seconds
+
+            Stops early on KeyboardInterrupt.
+        '''
+        end = None if duration is None else time.time() + duration
+        next_read = time.time()
+        recorded = 0
+
+        try:
+            while count is None or recorded < count:
+                now = time.time()
+                if end is not None and now >= end:
+                    break
+
+                if next_read > now:
+                    time.sleep(next_read - now)
+
+                timestamp = time.time()
+                self.record(read(), timestamp)
+                recorded += 1
+
+                next_read = max(next_read + interval, timestamp)
+        except KeyboardInterrupt:
+            pass
+
+    def flush(self):
+        ''' Write everything recorded so far out to disk '''
+        self._mmap.flush()
+
+    def close(self):
+        ''' Flush and close the file '''
+        self.flush()
+        super(Recorder, self).close()
+        self.__file.close()
+
+
+class Reader(_RingFile):
+    ''' Read-only access to a ring file, while it's being written or after '''
+
+    def __init__(self, path):
+        _check_numpy()
+
+        self.path = path
+
+        with open(path, 'rb') as rec_file:
+            header = rec_file.read(HEADER_SIZE)
+
+            if len(header) < _HEADER.size or \
+                    not header.startswith(MAGIC):
+                raise ValueError(path + ' is not a recorder file')
+
+            magic, version, header_size, capacity, channels, value_dtype, \
+                record_size = _HEADER.unpack_from(header)
+
+            if version != VERSION or header_size != HEADER_SIZE:
+                raise ValueError('Unsupported recorder file version')
+
+            names_len, = _NAMES_LEN.unpack_from(header, _NAMES_OFFSET)
+            offset = _NAMES_OFFSET + _NAMES_LEN.size
+            self.names = json.loads(header[offset:offset + names_len].decode())
+
+            self.channels = channels
+            self.capacity = capacity
+            self.dtype = record_dtype(
+                channels, value_dtype.rstrip(b'\0').decode())
+
+            if self.dtype.itemsize != record_size:
+                raise ValueError('Corrupt recorder file header')
+
+            size = HEADER_SIZE + capacity * record_size
+            if os.fstat(rec_file.fileno()).st_size < size:
+                raise ValueError('Recorder file is truncated')
+
+            self._map(rec_file.fileno(), size, mmap.ACCESS_READ)
+
+        # Records lost while tailing, because the writer got too far ahead
+        self.dropped = 0
+
+    def tail(self, start=None, interval=0.1, timeout=None):
+        ''' Yield new records as they're written
+
+            Args:
+                start: First record index (default: only records written
+                    from now on)
+                interval: Seconds to wait between checks for new records
+                timeout: Stop after this many seconds without new records
+                    (default: never)
+
+            Yields:
+                Structured array views (see chunks()) of the records written
+                since the last one. Use them (or copy them) before the
+                writer wraps around to them again.
+        '''
+        index = self.written if start is None else start
+        idle_since = time.time()
+
+        while True:
+            written = self.written
+
+            if written > index:
+                oldest = max(written - self.capacity, 0)
+                if index < oldest:
+                    self.dropped += oldest - index
+                    index = oldest
+
+                for chunk in self.chunks(index, written):
+                    yield chunk
+
+                index = written
+                idle_since = time.time()
+            elif timeout is not None and time.time() - idle_since >= timeout:
+                return
+            else:
+                time.sleep(interval)
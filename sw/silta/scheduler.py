@@ -0,0 +1,176 @@
+''' Silta sensor polling scheduler
+
+Most sensors take a while to convert a measurement: the driver starts it
+(trigger), waits, and then reads the result (fetch). Reading sensors one
+after the other adds up all those waits. The scheduler interleaves them, so
+a full sweep takes about as long as the slowest conversion instead.
+
+Drivers describe a read as a generator ("steps") that yields the number of
+seconds to wait before its next phase (a bare yield waits 0) and returns the
+reading:
+
+    def read_steps(self):
+        self.mux.set_channel(self.mux_channel)
+        self.bridge.i2c(SHT31_ADDR, 0, CMD['RD_TH_HIGH_NOHOLD'])
+        yield 0.015
+
+        # Other sensors may have used the bus (and the mux) in the meantime
+        self.mux.set_channel(self.mux_channel)
+        rval = self.bridge.i2c(SHT31_ADDR, 6)
+        return convert(rval)
+
+    def read(self):
+        return scheduler.run_steps(self.read_steps())
+
+Example:
+    poller = scheduler.Scheduler()
+    for sensor in sensors:
+        poller.add(sensor.name, sensor.read_steps)
+
+    readings = poller.sweep()
+'''
+
+import heapq
+import itertools
+import time
+
+
+def run_steps(steps):
+    ''' Run a read generator on its own (sleeping through its waits)
+
+        Returns:
+            The reading returned by the generator
+    '''
+    try:
+        delay = next(steps)
+        while True:
+            if delay is not None and delay > 0:
+                time.sleep(delay)
+            delay = steps.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+class Scheduler(object):
+    ''' Runs several sensor reads at once, fetching each result as soon as
+        its conversion time is up
+    '''
+
+    def __init__(self):
+        # name -> function returning a new read generator
+        self.jobs = {}
+
+        # Time each job spent waiting on conversions in the last sweep. The
+        # longest ones are triggered first next time, so they overlap with
+        # as many of the others as possible.
+        self.wait_times = {}
+
+        # Exceptions raised by jobs in the last sweep, by name
+        self.errors = {}
+
+    def add(self, name, steps):
+        ''' Add a read to every sweep
+
+            Args:
+                name: Key for the reading in sweep() results
+                steps: Function returning a read generator (e.g. a driver's
+                    read_steps method)
+        '''
+        if name in self.jobs:
+            raise ValueError('Duplicate job name: ' + str(name))
+
+        self.jobs[name] = steps
+        self.wait_times[name] = 0.0
+
+    def remove(self, name):
+        ''' Stop reading name '''
+        del self.jobs[name]
+        del self.wait_times[name]
+        self.errors.pop(name, None)
+
+    def __step(self, name, steps, first, queue, order, results):
+        ''' Run a job's next phase and queue the one after it '''
+        if first:
+            self.wait_times[name] = 0.0
+
+        try:
+            delay = next(steps) if first else steps.send(None)
+        except StopIteration as e:
+            results[name] = e.value
+            return
+        except Exception as e:
+            results[name] = None
+            self.errors[name] = e
+            return
+
+        # (a bare yield doesn't wait)
+        if delay is None:
+            delay = 0.0
+
+        self.wait_times[name] += delay
+
+        heapq.heappush(queue,
+                       (time.perf_counter() + delay, next(order), name, steps))
+
+    def sweep(self):
+        ''' Read everything once
+
+            Returns:
+                {name: reading}. Jobs that raised an exception read as None
+                (the exception is in errors).
+        '''
+        results = {}
+        self.errors = {}
+
+        queue = []
+        order = itertools.count()
+
+        names = sorted(self.jobs, key=lambda name: -self.wait_times[name])
+
+        # Trigger everything, longest conversions first
+        for name in names:
+            self.__step(name, self.jobs[name](), True, queue, order, results)
+
+        # Then run each job's next phase as soon as it's due, earliest
+        # deadline first
+        while queue:
+            deadline, _, name, steps = heapq.heappop(queue)
+
+            wait = deadline - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+            self.__step(name, steps, False, queue, order, results)
+
+        return results
+
+    def run(self, period, callback=None, count=None):
+        ''' Sweep at a fixed rate
+
+            Args:
+                period: Seconds between the starts of two sweeps
+                callback: Called with (sweep start time, results) after each
+                    sweep
+                count: Stop after this many sweeps (default: never)
+
+            Stops on KeyboardInterrupt.
+        '''
+        next_sweep = time.time()
+        sweeps = 0
+
+        try:
+            while count is None or sweeps < count:
+                now = time.time()
+                if next_sweep > now:
+                    time.sleep(next_sweep - now)
+
+                start = time.time()
+                results = self.sweep()
+                sweeps += 1
+
+                if callback is not None:
+                    callback(start, results)
+
+                next_sweep = max(next_sweep + period, start)
+        except KeyboardInterrupt:
+            pass
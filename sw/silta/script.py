@@ -0,0 +1,211 @@
+''' Silta device scripts
+
+A driver read is usually a fixed recipe: select a mux channel, start a
+conversion, wait, read the result. Sent as separate commands, every step
+costs a round trip and the waits are timed by the host. A script is the same
+recipe uploaded to the device once. Running it is a single command, and the
+device does all the steps (and waits) on its own.
+
+Scripts need the binary protocol and firmware with the 'script' feature.
+
+Example:
+    read_sht31 = script.Script()
+    read_sht31.i2c(TCA9548A_ADDR, 0, [1 << channel])
+    read_sht31.i2c(SHT31_ADDR, 0, [0x24, 0x00])
+    read_sht31.delay(0.015)
+    read_sht31.i2c(SHT31_ADDR, 6)
+
+    bridge.script_load(1, read_sht31)
+
+    # One result per step that reads something
+    data, = bridge.script_run(1)
+'''
+
+import struct
+
+from silta import console
+from silta import protocol as proto
+
+
+def _pin(name):
+    ''' (port number, pin) of a pin name '''
+    port, pin = console.get_pin(name)
+
+    return ord(port.upper()) - ord('A'), pin
+
+
+def _pin_name(port, pin):
+    return 'P' + chr(ord('A') + port) + str(pin)
+
+
+class Script(object):
+    ''' Sequence of steps to run on the device (see bridge.script_load) '''
+
+    def __init__(self):
+        self.__steps = []
+
+        # (step index, read length, kind) of the steps that read
+        self.__reads = []
+
+        # Pins the script writes to, and SPI CS pins it selects. The bridge
+        # forgets what it knew about them when the script runs.
+        self.gpio_pins = set()
+        self.cs_pins = set()
+
+        self.__cspin = None
+
+        # Total time the delay steps wait, in microseconds
+        self.__delay_us = 0
+
+    def __len__(self):
+        return len(self.__steps)
+
+    def __add(self, step, rlen=0, kind='bytes'):
+        if rlen > 0:
+            self.__reads.append((len(self.__steps), rlen, kind))
+
+        self.__steps.append(step)
+
+        return self
+
+    def i2c(self, addr, rlen, wbytes=[]):
+        ''' I2C transaction (write-then-read, like bridge.i2c)
+
+            Args:
+                addr: 8 bit I2C address
+                rlen: Number of bytes to read
+                wbytes: List of bytes (or bytes-like object) to write
+        '''
+        wbytes = bytes(wbytes)
+
+        return self.__add(struct.pack('<BBHH', proto.STEP_I2C, addr, rlen,
+                                      len(wbytes)) + wbytes, rlen)
+
+    def spi(self, cspin, wbytes, hold=False):
+        ''' SPI transaction (like bridge.spi)
+
+            Args:
+                cspin: Chip select pin
+                wbytes: List of bytes (or bytes-like object) to write out
+                hold: Keep CS asserted afterwards (until the next transfer
+                    without hold)
+        '''
+        if cspin != self.__cspin:
+            port, pin = _pin(cspin)
+            self.__add(struct.pack('<BBB', proto.STEP_SPI_CS, port, pin))
+            self.cs_pins.add(_pin_name(port, pin))
+            self.__cspin = cspin
+
+        wbytes = bytes(wbytes)
+
+        return self.__add(struct.pack('<BBH', proto.STEP_SPI, int(bool(hold)),
+                                      len(wbytes)) + wbytes, len(wbytes))
+
+    def gpio(self, name, value=None):
+        ''' Read (value=None) or set a GPIO pin
+
+            Args:
+                name: Pin name (e.g. PA3, PD11, PB0)
+                value: 0 or 1 to set the pin
+        '''
+        port, pin = _pin(name)
+
+        if value is None:
+            return self.__add(
+                struct.pack('<BBBB', proto.STEP_GPIO, port, pin,
+                            proto.GPIO_READ), 1, 'gpio')
+
+        self.gpio_pins.add(_pin_name(port, pin))
+
+        return self.__add(struct.pack('<BBBB', proto.STEP_GPIO, port, pin,
+                                      int(value) & 1))
+
+    def delay(self, seconds):
+        ''' Wait (on the device) before the next step
+
+            Args:
+                seconds: Time to wait, with microsecond resolution
+        '''
+        remaining = int(round(seconds * 1e6))
+
+        if remaining < 0:
+            raise ValueError('Negative delay')
+
+        # Longer delays take several steps
+        while remaining > 0:
+            delay_us = min(remaining, proto.MAX_DELAY_US)
+            self.__add(struct.pack('<BI', proto.STEP_DELAY, delay_us))
+            self.__delay_us += delay_us
+            remaining -= delay_us
+
+        return self
+
+    def adc(self, name):
+        ''' Read an ADC pin (configured as an analog input)
+
+            Args:
+                name: ADC pin name (e.g. PA1)
+        '''
+        # The pin's ADC number comes from the bridge (see encode)
+        return self.__add(name.upper(), 2, 'adc')
+
+    def encode(self, adc_num=None):
+        ''' Script steps, as sent to the device
+
+            Args:
+                adc_num: Function returning the ADC number of a pin name
+                    (the bridge passes its own)
+        '''
+        steps = []
+
+        for step in self.__steps:
+            if isinstance(step, str):
+                if adc_num is None:
+                    raise ValueError('ADC steps need the ADC numbers of a '
+                                     'bridge (see bridge.script_load)')
+                step = struct.pack('<BB', proto.STEP_ADC, adc_num(step))
+
+            steps.append(step)
+
+        return b''.join(steps)
+
+    def duration(self):
+        ''' Total time (in seconds) the script spends in delay steps '''
+        return self.__delay_us / 1e6
+
+    def read_length(self):
+        ''' Total number of bytes the script reads '''
+        return sum(rlen for _, rlen, _ in self.__reads)
+
+    def results(self, data):
+        ''' Split the data read by the script into one result per reading
+            step: a list of bytes for I2C and SPI steps, the pin value for
+            GPIO reads and the ADC code (0-4095) for ADC reads
+        '''
+        results = []
+        offset = 0
+
+        for _, rlen, kind in self.__reads:
+            chunk = data[offset:offset + rlen]
+            offset += rlen
+
+            if kind == 'gpio':
+                results.append(chunk[0])
+            elif kind == 'adc':
+                results.append(struct.unpack('<H', chunk)[0])
+            else:
+                results.append(list(chunk))
+
+        return results
+
+    def describe_step(self, index):
+        ''' Describe step index (for error messages) '''
+        step = self.__steps[index]
+        names = {proto.STEP_I2C: 'i2c', proto.STEP_SPI: 'spi',
+                 proto.STEP_GPIO: 'gpio', proto.STEP_SPI_CS: 'spi cs',
+                 proto.STEP_DELAY: 'delay'}
+
+        if isinstance(step, str):
+            return '{} (adc {})'.format(index, step)
+
+        return '{} ({})'.format(index, names.get(step[0], 'unknown'))
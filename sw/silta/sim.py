@@ -0,0 +1,1463 @@
+''' Silta simulated bridge
+
+Software stand-in for a Discovery board running the silta firmware. It speaks
+the same console commands and binary protocol frames as fw/console.c, with
+virtual I2C/SPI devices plugged in where the real hardware would be, so
+bridge code (and drivers built on it) can run without a board.
+
+A simulator can be reached through a pyserial URL or a pseudo-terminal:
+
+    sim = Simulator(latency=0.0005)
+    sim.i2c_devices[0x80] = RegisterI2CDevice({0xE3: [0x66, 0x4C]})
+
+    bridge = stm32f407.bridge(sim.url)   # 'sim://<name>'
+    bridge = stm32f407.bridge(sim.pty()) # e.g. '/dev/pts/5' (POSIX only)
+
+A simulator serves one connection at a time.
+
+Opening 'sim://' (or 'sim://<new name>') creates a fresh simulator with the
+default settings. Options can be passed in the URL query, e.g.
+'sim://?latency=0.001&bytes_per_second=1000000'.
+'''
+
+import collections
+import itertools
+import os
+import select
+import struct
+import threading
+import time
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+from silta import protocol as proto
+
+# Simulators reachable through sim:// URLs, by name
+_simulators = {}
+_sim_ids = itertools.count()
+
+
+def _strtoul(value, base=10):
+    ''' Integer value of a console argument, parsed like C's strtoul '''
+    digits = '0123456789ABCDEF'[:base]
+    length = 0
+    while length < len(value) and value[length].upper() in digits:
+        length += 1
+
+    return int(value[:length], base) if length else 0
+
+
+def from_url(url):
+    ''' Get (or create) the simulator for a sim:// URL
+
+        Args:
+            url: sim://[name][?latency=<seconds>&bytes_per_second=<rate>]
+
+        Returns:
+            Simulator
+    '''
+    parts = urlparse.urlsplit(url)
+
+    if parts.scheme != 'sim':
+        raise ValueError('Expected a sim:// URL, got ' + url)
+
+    name = parts.netloc + parts.path.strip('/')
+
+    if name in _simulators:
+        return _simulators[name]
+
+    kwargs = {}
+    for option, values in urlparse.parse_qs(parts.query).items():
+        if option in ('latency', 'bytes_per_second'):
+            kwargs[option] = float(values[0])
+        else:
+            raise ValueError('Unknown sim option: ' + option)
+
+    simulator = Simulator(**kwargs)
+
+    if name:
+        _simulators[name] = simulator
+
+    return simulator
+
+
+class I2CDevice(object):
+    ''' Virtual I2C device. Subclass it and override transfer() '''
+
+    # Seconds the device holds SCL low (clock stretching) per transaction,
+    # on top of the time the bytes take on the bus
+    stretch = 0.0
+
+    def transfer(self, wbytes, rlen):
+        ''' Handle a write-then-read transaction
+
+            Args:
+                wbytes: bytes written to the device
+                rlen: Number of bytes to read back
+
+            Returns:
+                bytes read (rlen of them)
+                or
+                Integer error code (e.g. I2C_DNACK)
+        '''
+        return bytes(rlen)
+
+
+class RegisterI2CDevice(I2CDevice):
+    ''' I2C device with 8-bit register addresses
+
+        The first byte written selects the register, the rest are written
+        to consecutive registers. Reads start at the selected register.
+
+        Args:
+            registers: Initial register values, {register: value or list of
+                values for consecutive registers}
+            size: Number of registers
+    '''
+
+    def __init__(self, registers=None, size=256):
+        self.registers = bytearray(size)
+        self.pointer = 0
+
+        for register, values in (registers or {}).items():
+            if isinstance(values, int):
+                values = [values]
+            for offset, value in enumerate(values):
+                self.registers[(register + offset) % size] = value
+
+    def transfer(self, wbytes, rlen):
+        size = len(self.registers)
+
+        if wbytes:
+            self.pointer = wbytes[0] % size
+            for byte in wbytes[1:]:
+                self.registers[self.pointer] = byte
+                self.pointer = (self.pointer + 1) % size
+
+        rbytes = bytearray()
+        for _ in range(rlen):
+            rbytes.append(self.registers[self.pointer])
+            self.pointer = (self.pointer + 1) % size
+
+        return bytes(rbytes)
+
+
+class SPIDevice(object):
+    ''' Virtual SPI device. Subclass it and override transfer() '''
+
+    def transfer(self, wbytes):
+        ''' Handle a full-duplex transfer
+
+            Args:
+                wbytes: bytes clocked out to the device
+
+            Returns:
+                bytes clocked in (as many as were written)
+                or
+                Integer error code
+        '''
+        return b'\xff' * len(wbytes)
+
+    def deselect(self):
+        ''' Called when CS is released, at the end of each transaction.
+            Transactions can be made of several transfers (see spistream)
+        '''
+        pass
+
+
+class LoopbackSPIDevice(SPIDevice):
+    ''' SPI device with MISO tied to MOSI '''
+
+    def transfer(self, wbytes):
+        return bytes(wbytes)
+
+
+class Simulator(object):
+    ''' Simulated Silta STM32F407 Discovery Bridge
+
+        Args:
+            serial_number: 12 byte serial number (default: unique per
+                simulator)
+            version: Firmware version string
+            latency: Seconds between a command arriving and its response
+                being available (e.g. the USB round trip)
+            bytes_per_second: Maximum response data rate. None for no limit
+            binary: Whether the binary protocol is supported
+            caps: Whether the caps and ident commands are supported (older
+                firmware doesn't have them)
+
+        Peripherals (all can be changed at any time):
+            i2c_devices: {8 bit address: I2CDevice}
+            spi_devices: {CS pin name (e.g. 'PE3'): SPIDevice}
+            gpio: {pin name: value}
+            adc: {pin name: volts, or function(t) -> volts, with t in seconds
+                since the simulator was created}
+            dac: DAC codes, by DAC number
+            pwm: PWM compare values, by channel
+    '''
+
+    I2C_ANACK = -1
+    I2C_DNACK = -2
+
+    ADC_MAX_VOLTAGE = 3.0
+    ADC_MAX_VAL = 4095
+
+    # Same channel order as the firmware's adcs table
+    ADC_PINS = ['PA0', 'PA1', 'PA2', 'PA3', 'PA4', 'PA5', 'PA6', 'PA7',
+                'PB0', 'PB1',
+                'PC0', 'PC1', 'PC2', 'PC3', 'PC4', 'PC5']
+
+    # 144 cycle sample time + 12 cycle conversion at 21MHz
+    ADC_SCAN_CONVERSION_TIME = 156 / 21e6
+
+    ADC_STREAM_TIMER_CLOCK = 84000000
+    ADC_STREAM_MAX_CHANNELS = 16
+    ADC_STREAM_MAX_RATE = 250000
+    ADC_STREAM_BUFF_SIZE = 1024
+    ADC_STREAM_CHUNK_MS = 20
+
+    TX_RX_BUFF_SIZE = 2048
+    CMD_BUFF_SIZE = 4096
+    ARGV_MAX = 1024
+    RX_FIFO_SIZE = 8192
+    TX_FIFO_SIZE = 16384
+    # Tag + i2c address + read length + write bytes
+    BIN_MAX_PAYLOAD = 1 + 3 + TX_RX_BUFF_SIZE
+    FEATURES = ('adcscan', 'adcstream', 'gpioport', 'spistream', 'timing',
+                'script', 'jobs', 'tagged')
+
+    SCRIPT_SLOTS = 16
+    SCRIPT_MAX_SIZE = 256
+    JOB_SLOTS = 8
+
+    # Clock for timing telemetry cycle counts (the simulator's own times are
+    # converted to cycles of the real board's core clock)
+    CORE_CLOCK = 168000000
+
+    I2C1_PINS = 0x3C0
+
+    # Bus tagged commands run on (without holding up the ones after them)
+    __BUSES = {proto.OP_I2C: 'i2c', proto.OP_SPI: 'spi',
+               proto.OP_SPI_STREAM: 'spi'}
+
+    def __init__(self, serial_number=None, version='sim', latency=0.0,
+                 bytes_per_second=None, binary=True, caps=True):
+        sim_id = next(_sim_ids)
+
+        if serial_number is None:
+            serial_number = b'SILTASIM' + struct.pack('>I', sim_id)
+
+        self.name = 'sim{}'.format(sim_id)
+        self.serial_number = bytes(serial_number)
+        self.version = version
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.binary = binary
+
+        self.i2c_devices = {}
+        self.spi_devices = {}
+        self.gpio = {}
+        self.gpio_modes = {}
+        self.adc = {}
+        self.dac = [0, 0]
+        self.pwm = [0, 0]
+        self.config = {'i2cspeed': 100000, 'i2cpins': 0x240, 'test': 0}
+        self.spi_config = (1000000, 1, 1)
+        self.spi_cs = 'PE3'
+
+        # Number of commands handled so far
+        self.commands = 0
+
+        # Timing telemetry (see __timing_report)
+        self.__timing = False
+        self.__timing_seq = 0
+        self.__format_time = 0.0
+
+        self.__start = time.time()
+        self.__lock = threading.Condition()
+        self.__rx = bytearray()
+
+        # Bytes of an oversized frame still to be dropped as they arrive
+        self.__rx_discard = 0
+
+        # Response data, as (time it becomes readable, bytes), in the order
+        # it becomes readable
+        self.__tx = collections.deque()
+        self.__tx_free = 0
+        self.__tx_split = False
+
+        # Time the device gets to the next command (later than now while
+        # it's busy), and when each bus is done with the tagged command
+        # running on it
+        self.__cursor = 0.0
+        self.__bus_free = {'i2c': 0.0, 'spi': 0.0}
+
+        # Tag of the command being handled, its bus (if it runs on one
+        # without holding up the next commands), and the time it's spent
+        # on buses so far
+        self.__tag = None
+        self.__bus = None
+        self.__bus_time = 0.0
+
+        self.__stream = None
+
+        # Loaded scripts (as lists of parsed steps), by id
+        self.scripts = {}
+
+        # Periodic jobs, by id (see __update_jobs)
+        self.__jobs = {}
+
+        self.__pty = None
+
+        self.__commands = {
+            'i2c': self.__i2c_cmd,
+            'adcnum': self.__adcnum_cmd,
+            'adc': self.__adc_cmd,
+            'adcscan': self.__adcscan_cmd,
+            'dac': self.__dac_cmd,
+            'dacenable': self.__dacenable_cmd,
+            'spi': self.__spi_cmd,
+            'spistream': self.__spistream_cmd,
+            'spicfg': self.__spicfg_cmd,
+            'spics': self.__spics_cmd,
+            'config': self.__config_cmd,
+            'gpio': self.__gpio_cmd,
+            'gpioport': self.__gpioport_cmd,
+            'gpiocfg': self.__gpiocfg_cmd,
+            'pwm': self.__pwm_cmd,
+            'sn': self.__sn_cmd,
+            'version': self.__version_cmd,
+            'help': self.__help_cmd,
+        }
+
+        if binary:
+            self.__commands['binary'] = self.__binary_cmd
+            self.__commands['timing'] = self.__timing_cmd
+
+        if caps:
+            self.__commands['caps'] = self.__caps_cmd
+            self.__commands['ident'] = self.__ident_cmd
+
+        self.__frames = {
+            proto.OP_I2C: self.__i2c_frame,
+            proto.OP_SPI: self.__spi_frame,
+            proto.OP_GPIO: self.__gpio_frame,
+            proto.OP_ADC: self.__adc_frame,
+            proto.OP_DAC: self.__dac_frame,
+            proto.OP_PWM: self.__pwm_frame,
+            proto.OP_ADC_STREAM: self.__adc_stream_frame,
+            proto.OP_ADC_SCAN: self.__adc_scan_frame,
+            proto.OP_GPIO_PORT: self.__gpio_port_frame,
+            proto.OP_SPI_STREAM: self.__spi_stream_frame,
+            proto.OP_SCRIPT_LOAD: self.__script_load_frame,
+            proto.OP_SCRIPT_RUN: self.__script_run_frame,
+            proto.OP_JOB: self.__job_frame,
+        }
+
+    @property
+    def url(self):
+        ''' pyserial URL for this simulator '''
+        _simulators[self.name] = self
+        return 'sim://' + self.name
+
+    def pty(self):
+        ''' Serve the simulator on a pseudo-terminal (POSIX only)
+
+            Returns:
+                Device path to open (e.g. with stm32f407.bridge)
+        '''
+        import tty
+
+        if self.__pty is None:
+            master, slave = os.openpty()
+            tty.setraw(slave)
+
+            self.__pty = (master, slave)
+
+            thread = threading.Thread(target=self.__serve_pty, args=(master,))
+            thread.daemon = True
+            thread.start()
+
+        return os.ttyname(self.__pty[1])
+
+    def close(self):
+        ''' Stop serving the pseudo-terminal and forget the URL '''
+        _simulators.pop(self.name, None)
+
+        if self.__pty is not None:
+            master, slave = self.__pty
+            self.__pty = None
+            os.close(slave)
+            os.close(master)
+
+    def write(self, data):
+        ''' Feed data from the host to the simulated device '''
+        with self.__lock:
+            self.__rx += data
+            self.__process()
+            self.__lock.notify_all()
+
+    def read(self, size=1, timeout=None):
+        ''' Read up to size bytes sent by the simulated device
+
+            Args:
+                size: Number of bytes to wait for
+                timeout: Seconds to wait. None waits forever, 0 returns
+                    whatever is available right away
+
+            Returns:
+                bytes (fewer than size if the timeout expires)
+        '''
+        data = bytearray()
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self.__lock:
+            while True:
+                data += self.__take(size - len(data))
+
+                if len(data) >= size:
+                    break
+
+                now = time.time()
+                if timeout is not None and now >= deadline:
+                    break
+
+                wait = self.__next_ready(now)
+                if timeout is not None:
+                    wait = deadline - now if wait is None \
+                        else min(wait, deadline - now)
+
+                self.__lock.wait(wait)
+
+        return bytes(data)
+
+    def in_waiting(self):
+        ''' Number of bytes that can be read right away '''
+        with self.__lock:
+            self.__update_stream(time.time())
+            self.__update_jobs(time.time())
+            now = time.time()
+            return sum(len(data) for ready, data in self.__tx if ready <= now)
+
+    def __take(self, size):
+        ''' Pop up to size bytes of data that's ready (lock held) '''
+        now = time.time()
+        self.__update_stream(now)
+        self.__update_jobs(now)
+
+        data = bytearray()
+        while self.__tx and len(data) < size and self.__tx[0][0] <= now:
+            ready, chunk = self.__tx.popleft()
+            count = size - len(data)
+            data += chunk[:count]
+            self.__tx_split = len(chunk) > count
+            if self.__tx_split:
+                self.__tx.appendleft((ready, chunk[count:]))
+
+        return data
+
+    def __next_ready(self, now):
+        ''' Seconds until more data is ready (None if nothing is pending) '''
+        times = []
+
+        if self.__tx:
+            times.append(self.__tx[0][0])
+
+        if self.__stream is not None:
+            times.append(self.__stream['next'])
+
+        for job in self.__jobs.values():
+            times.append(job['next'])
+
+        if not times:
+            return None
+
+        return max(min(times) - now, 0)
+
+    def __send(self, data, ready=None):
+        ''' Queue response data (lock held) '''
+        if ready is None:
+            ready = max(time.time(), self.__cursor) + self.latency
+
+        if self.bytes_per_second:
+            ready = max(ready, self.__tx_free)
+            self.__tx_free = ready + len(data) / self.bytes_per_second
+
+        # Tagged responses can overtake the ones still waiting on a bus (but
+        # not a frame that's been partly read already)
+        index = len(self.__tx)
+        while index > int(self.__tx_split) and self.__tx[index - 1][0] > ready:
+            index -= 1
+
+        self.__tx.insert(index, (ready, bytes(data)))
+
+    def __start_command(self, buses):
+        ''' Wait (in device time) for the buses a command needs '''
+        self.__cursor = max([time.time(), self.__cursor] +
+                            [self.__bus_free[bus] for bus in buses])
+        self.__bus_time = 0.0
+
+    def __finish_command(self, delay=0.0):
+        ''' Account for the time the command kept the device busy (or
+            its bus, for tagged bus commands)
+
+            Returns:
+                Seconds after the cursor its response is ready
+        '''
+        busy = self.__bus_time + delay
+        self.__bus_time = 0.0
+
+        if self.__bus is not None:
+            self.__bus_free[self.__bus] = self.__cursor + busy
+            return busy
+
+        self.__cursor += busy
+        return 0.0
+
+    def __reply(self, line):
+        start = time.perf_counter()
+        self.__finish_command()
+        self.__send((line + '\n').encode())
+        self.__format_time += time.perf_counter() - start
+
+    def __reply_frame(self, opcode, status, payload=b'', delay=0.0):
+        ''' Send a response frame, after delay seconds of device time
+            (lock held)
+        '''
+        start = time.perf_counter()
+        ready = self.__finish_command(delay)
+        self.__send(proto.encode_resp(opcode, status, payload, self.__tag),
+                    max(time.time(), self.__cursor) + self.latency + ready)
+        self.__format_time += time.perf_counter() - start
+
+    def __timing_report(self, was_enabled, received, executed):
+        ''' Send the timing of the command that was just handled, like the
+            firmware does (lock held)
+        '''
+        end = time.perf_counter()
+
+        if not (was_enabled and self.__timing):
+            return
+
+        cycles = [int(seconds * self.CORE_CLOCK) for seconds in (
+            executed - received, end - executed - self.__format_time,
+            self.__format_time)]
+
+        self.__send(proto.encode_resp(
+            proto.OP_TIMING_DATA, 0,
+            struct.pack('<5I', self.__timing_seq & 0xFFFFFFFF, *cycles,
+                        self.CORE_CLOCK)))
+        self.__timing_seq += 1
+
+    def __serve_pty(self, master):
+        while self.__pty is not None:
+            with self.__lock:
+                wait = self.__next_ready(time.time())
+
+            if wait is None or wait > 0.01:
+                wait = 0.01
+
+            try:
+                readable, _, _ = select.select([master], [], [], wait)
+                if readable:
+                    self.write(os.read(master, 4096))
+
+                data = self.read(4096, 0)
+                if data:
+                    os.write(master, data)
+            except (OSError, ValueError):
+                return
+
+    def __process(self):
+        ''' Handle every complete command received (lock held) '''
+        if self.__rx_discard:
+            dropped = min(self.__rx_discard, len(self.__rx))
+            del self.__rx[:dropped]
+            self.__rx_discard -= dropped
+
+        while self.__rx:
+            if self.__rx[0] == proto.SYNC:
+                if not self.__process_frame():
+                    return
+                continue
+
+            ends = [index for index in (self.__rx.find(b'\n'),
+                                        self.__rx.find(b'\r')) if index >= 0]
+            if not ends:
+                return
+
+            newline = min(ends)
+
+            timing = self.__timing
+            received = time.perf_counter()
+
+            line = bytes(self.__rx[:min(newline, self.CMD_BUFF_SIZE - 1)])
+            del self.__rx[:newline + 1]
+
+            # If it's an \r\n combination, discard the second one
+            if self.__rx[:1] in (b'\r', b'\n'):
+                del self.__rx[:1]
+
+            argv = line.decode('ascii', 'replace').split()
+            if not argv:
+                continue
+
+            self.commands += 1
+
+            # Console commands wait for all the tagged ones
+            self.__start_command(self.__bus_free)
+
+            command = self.__commands.get(argv[0])
+
+            self.__format_time = 0.0
+            executed = time.perf_counter()
+
+            if command is None:
+                self.__reply("ERR Unknown command '{}'".format(argv[0]))
+            else:
+                command(argv)
+
+            self.__timing_report(timing, received, executed)
+
+    def __process_frame(self):
+        ''' Handle the binary frame at the start of the input (lock held)
+
+            Returns False if it hasn't been fully received yet
+        '''
+        if not self.binary:
+            # Old firmware would treat it as (garbage) text
+            del self.__rx[:1]
+            return True
+
+        if len(self.__rx) < proto.CMD_HEADER_LEN:
+            return False
+
+        timing = self.__timing
+
+        opcode, length = proto.decode_cmd_header(
+            bytes(self.__rx[:proto.CMD_HEADER_LEN]))
+
+        if length > self.BIN_MAX_PAYLOAD:
+            # Too long to handle. Drop the whole frame (the rest of it as it
+            # comes in), so its payload isn't taken for commands.
+            received = time.perf_counter()
+            self.__rx_discard = proto.CMD_HEADER_LEN + length + proto.CRC_LEN
+            dropped = min(self.__rx_discard, len(self.__rx))
+            del self.__rx[:dropped]
+            self.__rx_discard -= dropped
+            self.__start_command(self.__bus_free)
+            self.__format_time = 0.0
+            executed = time.perf_counter()
+            self.__reply_frame(opcode & ~proto.TAGGED, proto.ERR_LEN)
+            self.__timing_report(timing, received, executed)
+            return True
+
+        end = proto.CMD_HEADER_LEN + length + proto.CRC_LEN
+        if len(self.__rx) < end:
+            return False
+
+        received = time.perf_counter()
+
+        frame = bytes(self.__rx[:end])
+        del self.__rx[:end]
+
+        header = frame[:proto.CMD_HEADER_LEN]
+        payload = frame[proto.CMD_HEADER_LEN:-proto.CRC_LEN]
+
+        self.commands += 1
+
+        crc_ok = proto.check_crc(header, payload, frame[-proto.CRC_LEN:])
+
+        tagged = crc_ok and opcode & proto.TAGGED
+        opcode &= ~proto.TAGGED
+
+        # Same rules as the firmware's binCanStart
+        if not tagged or opcode == proto.OP_SCRIPT_RUN:
+            buses = self.__bus_free
+        elif opcode in self.__BUSES:
+            buses = [self.__BUSES[opcode]]
+        else:
+            buses = []
+        self.__start_command(buses)
+
+        self.__format_time = 0.0
+        executed = time.perf_counter()
+
+        if not crc_ok:
+            self.__reply_frame(opcode, proto.ERR_CRC)
+        elif tagged and not payload:
+            self.__reply_frame(opcode, proto.ERR_ARGS)
+        elif opcode not in self.__frames:
+            self.__tag = payload[0] if tagged else None
+            self.__reply_frame(opcode, proto.ERR_OPCODE)
+        else:
+            if tagged:
+                self.__tag = payload[0]
+                self.__bus = self.__BUSES.get(opcode)
+                payload = payload[1:]
+
+            self.__frames[opcode](payload)
+
+        self.__tag = None
+        self.__bus = None
+
+        self.__timing_report(timing, received, executed)
+
+        return True
+
+    # Peripherals
+
+    @staticmethod
+    def __pin_name(port, pin):
+        ''' Pin name from console port/pin arguments (None if invalid) '''
+        port = port[:1].upper()
+
+        pin = _strtoul(pin)
+
+        if port < 'A' or port > 'E' or pin > 15:
+            return None
+
+        return 'P{}{}'.format(port, pin)
+
+    def __gpio_port_read(self, port):
+        value = 0
+        for pin in range(16):
+            if self.gpio.get('P{}{}'.format(port, pin), 0):
+                value |= 1 << pin
+        return value
+
+    def __gpio_port_write(self, port, mask, value):
+        for pin in range(16):
+            if mask & (1 << pin):
+                self.gpio['P{}{}'.format(port, pin)] = (value >> pin) & 1
+
+    def __i2c(self, addr, wbytes, rlen):
+        device = self.i2c_devices.get(addr)
+
+        # 9 clocks per byte (address bytes included)
+        bits = 9
+
+        if device is None:
+            self.__bus_time += bits / max(self.config['i2cspeed'], 1)
+            return self.I2C_ANACK
+
+        if wbytes and rlen:
+            bits += 9
+        bits += 9 * (len(wbytes) + rlen)
+
+        # Devices don't have to be I2CDevice subclasses
+        self.__bus_time += bits / max(self.config['i2cspeed'], 1) + \
+            getattr(device, 'stretch', 0.0)
+
+        return device.transfer(bytes(wbytes), rlen)
+
+    def __spi(self, wbytes, hold=False):
+        device = self.spi_devices.get(self.spi_cs)
+
+        self.__bus_time += 8 * len(wbytes) / max(self.spi_config[0], 1)
+
+        if device is None:
+            return b'\xff' * len(wbytes)
+
+        rval = b''
+        if wbytes:
+            rval = device.transfer(bytes(wbytes))
+
+        # Like the firmware, CS is always released after an error
+        if not hold or isinstance(rval, int):
+            device.deselect()
+
+        return rval
+
+    def __adc_code(self, adc_num, t=None):
+        ''' ADC code for a channel at time t (default: now) '''
+        if t is None:
+            t = time.time() - self.__start
+
+        value = self.adc.get(self.ADC_PINS[adc_num], 0.0)
+        if callable(value):
+            value = value(t)
+
+        code = int(round(value / self.ADC_MAX_VOLTAGE * self.ADC_MAX_VAL))
+
+        return min(max(code, 0), self.ADC_MAX_VAL)
+
+    def __adc_read(self, adc_num):
+        ''' Same as the firmware's adcRead, -1 if unavailable '''
+        if self.__stream is not None or adc_num >= len(self.ADC_PINS):
+            return -1
+
+        return self.__adc_code(adc_num)
+
+    def __adc_scan(self, adc_nums, samples):
+        ''' Same as the firmware's adcScan, None on failure '''
+        if self.__stream is not None or not adc_nums or \
+                len(adc_nums) > self.ADC_STREAM_MAX_CHANNELS or samples == 0:
+            return None
+
+        if any(num >= len(self.ADC_PINS) for num in adc_nums):
+            return None
+
+        t = time.time() - self.__start
+        values = []
+        for _ in range(samples):
+            for num in adc_nums:
+                values.append(self.__adc_code(num, t))
+                t += self.ADC_SCAN_CONVERSION_TIME
+
+        return values
+
+    def __adc_stream_start(self, adc_nums, rate):
+        ''' Same as the firmware's adcStreamStart, None on failure '''
+        count = len(adc_nums)
+
+        if self.__stream is not None or count == 0 or \
+                count > self.ADC_STREAM_MAX_CHANNELS or rate == 0 or \
+                rate * count > self.ADC_STREAM_MAX_RATE:
+            return None
+
+        if any(num >= len(self.ADC_PINS) for num in adc_nums):
+            return None
+
+        rows = (rate * self.ADC_STREAM_CHUNK_MS) // 1000
+        rows = min(rows, self.ADC_STREAM_BUFF_SIZE // 2 // count)
+        rows = max(rows & ~1, 2)
+
+        period = self.ADC_STREAM_TIMER_CLOCK // rate
+        sample_rate = self.ADC_STREAM_TIMER_CLOCK / period
+
+        start = time.time()
+        self.__stream = {
+            'adc_nums': adc_nums,
+            'rows': rows,
+            'rate': sample_rate,
+            'start': start,
+            'seq': 0,
+            'next': start + rows / sample_rate,
+        }
+
+        return struct.pack('<III', self.ADC_STREAM_TIMER_CLOCK, period, rows)
+
+    def __update_stream(self, now):
+        ''' Send any stream chunks that are due (lock held) '''
+        stream = self.__stream
+
+        while stream is not None and stream['next'] <= now:
+            rows = stream['rows']
+            seq = stream['seq']
+
+            samples = []
+            for row in range(seq, seq + rows):
+                t = stream['start'] + row / stream['rate'] - self.__start
+                for num in stream['adc_nums']:
+                    samples.append(self.__adc_code(num, t))
+
+            packed = bytearray(struct.pack('<II', seq, 0))
+            for index in range(0, len(samples), 2):
+                a, b = samples[index], samples[index + 1]
+                packed += bytes([a & 0xFF, ((a >> 8) & 0x0F) | ((b & 0x0F) << 4),
+                                 b >> 4])
+
+            self.__send(proto.encode_resp(proto.OP_ADC_STREAM_DATA, 0, packed),
+                        stream['next'])
+
+            stream['seq'] = seq + rows
+            stream['next'] = stream['start'] + \
+                (stream['seq'] + rows) / stream['rate']
+
+    # Console commands
+
+    def __i2c_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR: I2C Not enough arguments')
+            return
+
+        addr = _strtoul(argv[1], 16) & 0xFF
+        rlen = _strtoul(argv[2])
+        wbytes = [_strtoul(byte, 16) & 0xFF for byte in argv[3:]]
+
+        if len(wbytes) > self.TX_RX_BUFF_SIZE:
+            self.__reply('ERR: I2C Not enough space in txBuff')
+            return
+
+        if rlen > self.TX_RX_BUFF_SIZE:
+            self.__reply('ERR: I2C Not enough space in rxBuff')
+            return
+
+        rval = self.__i2c(addr, wbytes, rlen)
+
+        if isinstance(rval, int):
+            self.__reply('ERR {}'.format(rval))
+        else:
+            self.__reply('OK ' + ''.join('{:02X} '.format(b) for b in rval))
+
+    def __adcnum_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR Invalid args')
+            return
+
+        name = self.__pin_name(argv[1], argv[2])
+
+        if name is None:
+            self.__reply('ERR Invalid pin')
+        elif name in self.ADC_PINS:
+            self.__reply('OK {}'.format(self.ADC_PINS.index(name)))
+        else:
+            self.__reply('ERR Not an adc pin')
+
+    def __adc_cmd(self, argv):
+        if len(argv) < 2:
+            self.__reply('ERR Invalid args')
+            return
+
+        value = self.__adc_read(_strtoul(argv[1]))
+
+        if value >= 0:
+            self.__reply('OK {}'.format(value))
+        else:
+            self.__reply('ERR Invalid adcnum')
+
+    def __adcscan_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR Invalid args')
+            return
+
+        samples = _strtoul(argv[1])
+        adc_nums = [_strtoul(num) for num in argv[2:]]
+
+        if len(adc_nums) > self.ADC_STREAM_MAX_CHANNELS or \
+                samples * len(adc_nums) > self.TX_RX_BUFF_SIZE // 2:
+            self.__reply('ERR Too many samples')
+            return
+
+        values = self.__adc_scan(adc_nums, samples)
+
+        if values is None:
+            self.__reply('ERR Scan failed')
+        else:
+            self.__reply('OK' + ''.join(' {}'.format(v) for v in values))
+
+    def __dac_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR Invalid args')
+            return
+
+        dac = _strtoul(argv[1])
+
+        if dac > 1:
+            self.__reply('ERR Invalid dac')
+            return
+
+        self.dac[dac] = _strtoul(argv[2]) & 0xFFFF
+        self.__reply('OK')
+
+    def __dacenable_cmd(self, argv):
+        self.__reply('OK')
+
+    def __spi_cmd(self, argv):
+        if len(argv) < 2:
+            self.__reply('ERR: SPI Not enough arguments')
+            return
+
+        rval = self.__spi([_strtoul(byte, 16) & 0xFF for byte in argv[1:]])
+
+        if isinstance(rval, int):
+            self.__reply('ERR {}'.format(rval))
+        else:
+            self.__reply('OK ' + ''.join('{:02X} '.format(b) for b in rval))
+
+    def __spistream_cmd(self, argv):
+        if len(argv) < 2:
+            self.__reply('ERR: SPI Not enough arguments')
+            return
+
+        rval = self.__spi([_strtoul(byte, 16) & 0xFF for byte in argv[2:]],
+                          hold=argv[1][:1] != '0')
+
+        if isinstance(rval, int):
+            self.__reply('ERR {}'.format(rval))
+        else:
+            self.__reply('OK ' + ''.join('{:02X} '.format(b) for b in rval))
+
+    def __spicfg_cmd(self, argv):
+        if len(argv) < 4:
+            self.__reply('ERR: SPI Not enough arguments')
+            return
+
+        self.spi_config = tuple(_strtoul(arg) for arg in argv[1:4])
+        self.__reply('OK')
+
+    def __spics_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR Invalid args')
+            return
+
+        name = self.__pin_name(argv[1], argv[2])
+
+        if name is None:
+            self.__reply('ERR Invalid pin')
+        else:
+            self.spi_cs = name
+            self.__reply('OK')
+
+    def __config_cmd(self, argv):
+        if len(argv) < 2 or argv[1] not in self.config:
+            self.__reply("ERR Unknown key '{}'".format(argv[0]))
+            return
+
+        key = argv[1]
+
+        if len(argv) == 2:
+            if key == 'test':
+                self.__reply('OK {}'.format(self.config[key]))
+            else:
+                self.__reply('ERR')
+            return
+
+        value = _strtoul(argv[2])
+
+        if (key == 'i2cspeed' and value > 400000) or \
+                (key == 'i2cpins' and value & ~self.I2C1_PINS):
+            self.__reply('ERR')
+        else:
+            self.config[key] = value
+            self.__reply('OK')
+
+    def __gpio_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR Invalid args')
+            return
+
+        name = self.__pin_name(argv[1], argv[2])
+
+        if name is None:
+            self.__reply('ERR Invalid pin')
+        elif len(argv) == 3:
+            self.__reply('OK {}'.format(self.gpio.get(name, 0)))
+        else:
+            self.gpio[name] = int(argv[3][:1] != '0')
+            self.__reply('OK')
+
+    def __gpioport_cmd(self, argv):
+        if len(argv) not in (2, 4):
+            self.__reply('ERR Invalid args')
+            return
+
+        port = argv[1][:1].upper()
+
+        if port < 'A' or port > 'E':
+            self.__reply('ERR Invalid port')
+        elif len(argv) == 2:
+            self.__reply('OK {:04X}'.format(self.__gpio_port_read(port)))
+        else:
+            self.__gpio_port_write(port, _strtoul(argv[2], 16) & 0xFFFF,
+                                   _strtoul(argv[3], 16) & 0xFFFF)
+            self.__reply('OK')
+
+    def __gpiocfg_cmd(self, argv):
+        if len(argv) < 4:
+            self.__reply('ERR Invalid args')
+            return
+
+        name = self.__pin_name(argv[1], argv[2])
+
+        if name is None:
+            self.__reply('ERR Invalid pin')
+        elif argv[3] == 'analog' and name not in self.ADC_PINS:
+            self.__reply('ERR Not an analog pin')
+        else:
+            self.gpio_modes[name] = tuple(argv[3:5])
+            self.__reply('OK')
+
+    def __pwm_cmd(self, argv):
+        if len(argv) < 3:
+            self.__reply('ERR Invalid args')
+            return
+
+        channel = _strtoul(argv[1])
+
+        if channel > 1:
+            self.__reply('ERR Invalid dac')
+            return
+
+        self.pwm[channel] = _strtoul(argv[2]) & 0xFFFF
+        self.__reply('OK')
+
+    def __sn_cmd(self, argv):
+        self.__reply(
+            'OK ' + ''.join('{:02X} '.format(b) for b in self.serial_number))
+
+    def __version_cmd(self, argv):
+        self.__reply('OK ' + self.version)
+
+    def __binary_cmd(self, argv):
+        self.__reply('OK {}'.format(proto.VERSION))
+
+    def __timing_cmd(self, argv):
+        if len(argv) > 1:
+            self.__timing = _strtoul(argv[1]) != 0
+            self.__timing_seq = 0
+
+        self.__reply('OK {}'.format(int(self.__timing)))
+
+    def __caps(self):
+        protocols = ('ascii', 'binary') if self.binary else ('ascii',)
+
+        return (
+            'cmdbuf={} txrxbuf={} maxargs={} rxfifo={} txfifo={} '
+            'binmax={} scripts={} scriptmax={} jobs={} protocols={} '
+            'features={}'.format(
+                self.CMD_BUFF_SIZE, self.TX_RX_BUFF_SIZE, self.ARGV_MAX - 1,
+                self.RX_FIFO_SIZE, self.TX_FIFO_SIZE,
+                self.BIN_MAX_PAYLOAD, self.SCRIPT_SLOTS, self.SCRIPT_MAX_SIZE,
+                self.JOB_SLOTS, ','.join(protocols), ','.join(self.FEATURES)))
+
+    def __caps_cmd(self, argv):
+        self.__reply('OK ' + self.__caps())
+
+    def __ident_cmd(self, argv):
+        self.__reply('OK sn={} version={} binary={} {}'.format(
+            ''.join('{:02X}'.format(b) for b in self.serial_number),
+            self.version, proto.VERSION if self.binary else 0,
+            self.__caps()))
+
+    def __help_cmd(self, argv):
+        for name in sorted(self.__commands):
+            self.__reply(name)
+
+    # Binary protocol commands
+
+    def __i2c_frame(self, payload):
+        if len(payload) < 3:
+            self.__reply_frame(proto.OP_I2C, proto.ERR_ARGS)
+            return
+
+        addr, rlen = struct.unpack('<BH', payload[:3])
+        wbytes = payload[3:]
+
+        if len(wbytes) > self.TX_RX_BUFF_SIZE or rlen > self.TX_RX_BUFF_SIZE:
+            self.__reply_frame(proto.OP_I2C, proto.ERR_LEN)
+            return
+
+        rval = self.__i2c(addr, wbytes, rlen)
+
+        if isinstance(rval, int):
+            self.__reply_frame(proto.OP_I2C, rval)
+        else:
+            self.__reply_frame(proto.OP_I2C, 0, rval)
+
+    def __spi_frame(self, payload):
+        if len(payload) > self.TX_RX_BUFF_SIZE:
+            self.__reply_frame(proto.OP_SPI, proto.ERR_LEN)
+            return
+
+        rval = self.__spi(payload)
+
+        if isinstance(rval, int):
+            self.__reply_frame(proto.OP_SPI, rval)
+        else:
+            self.__reply_frame(proto.OP_SPI, 0, rval)
+
+    def __spi_stream_frame(self, payload):
+        if len(payload) < 1:
+            self.__reply_frame(proto.OP_SPI_STREAM, proto.ERR_ARGS)
+            return
+
+        if len(payload) - 1 > self.TX_RX_BUFF_SIZE:
+            self.__reply_frame(proto.OP_SPI_STREAM, proto.ERR_LEN)
+            return
+
+        rval = self.__spi(payload[1:], hold=payload[0] != 0)
+
+        if isinstance(rval, int):
+            self.__reply_frame(proto.OP_SPI_STREAM, rval)
+        else:
+            self.__reply_frame(proto.OP_SPI_STREAM, 0, rval)
+
+    def __gpio_frame(self, payload):
+        if len(payload) < 2 or payload[0] > 4 or payload[1] > 15:
+            self.__reply_frame(proto.OP_GPIO, proto.ERR_ARGS)
+            return
+
+        name = 'P{}{}'.format(chr(ord('A') + payload[0]), payload[1])
+
+        if len(payload) == 2:
+            self.__reply_frame(
+                proto.OP_GPIO, 0, bytes([self.gpio.get(name, 0)]))
+        else:
+            self.gpio[name] = int(payload[2] != 0)
+            self.__reply_frame(proto.OP_GPIO, 0)
+
+    def __gpio_port_frame(self, payload):
+        if len(payload) not in (1, 5) or payload[0] > 4:
+            self.__reply_frame(proto.OP_GPIO_PORT, proto.ERR_ARGS)
+            return
+
+        port = chr(ord('A') + payload[0])
+
+        if len(payload) == 1:
+            self.__reply_frame(proto.OP_GPIO_PORT, 0, struct.pack(
+                '<H', self.__gpio_port_read(port)))
+        else:
+            mask, value = struct.unpack('<HH', payload[1:])
+            self.__gpio_port_write(port, mask, value)
+            self.__reply_frame(proto.OP_GPIO_PORT, 0)
+
+    def __adc_frame(self, payload):
+        value = self.__adc_read(payload[0]) if len(payload) == 1 else -1
+
+        if value < 0:
+            self.__reply_frame(proto.OP_ADC, proto.ERR_ARGS)
+        else:
+            self.__reply_frame(proto.OP_ADC, 0, struct.pack('<H', value))
+
+    def __dac_frame(self, payload):
+        if len(payload) < 3 or payload[0] > 1:
+            self.__reply_frame(proto.OP_DAC, proto.ERR_ARGS)
+            return
+
+        self.dac[payload[0]] = struct.unpack('<H', payload[1:3])[0]
+        self.__reply_frame(proto.OP_DAC, 0)
+
+    def __pwm_frame(self, payload):
+        if len(payload) < 3 or payload[0] > 1:
+            self.__reply_frame(proto.OP_PWM, proto.ERR_ARGS)
+            return
+
+        self.pwm[payload[0]] = struct.unpack('<H', payload[1:3])[0]
+        self.__reply_frame(proto.OP_PWM, 0)
+
+    def __adc_scan_frame(self, payload):
+        if len(payload) < 3 or \
+                len(payload) - 2 > self.ADC_STREAM_MAX_CHANNELS:
+            self.__reply_frame(proto.OP_ADC_SCAN, proto.ERR_ARGS)
+            return
+
+        samples = struct.unpack('<H', payload[:2])[0]
+        adc_nums = list(payload[2:])
+
+        if samples * len(adc_nums) > self.TX_RX_BUFF_SIZE // 2:
+            self.__reply_frame(proto.OP_ADC_SCAN, proto.ERR_LEN)
+            return
+
+        values = self.__adc_scan(adc_nums, samples)
+
+        if values is None:
+            self.__reply_frame(proto.OP_ADC_SCAN, proto.ERR_ARGS)
+        else:
+            self.__reply_frame(proto.OP_ADC_SCAN, 0,
+                               struct.pack('<{}H'.format(len(values)), *values))
+
+    @staticmethod
+    def __parse_script(steps):
+        ''' [(step type, args, read length), ...], or None if a step is
+            invalid (like the firmware's scriptLoad)
+        '''
+        parsed = []
+        offset = 0
+
+        while offset < len(steps):
+            step = steps[offset]
+            left = steps[offset + 1:]
+
+            if step == proto.STEP_I2C and len(left) >= 5:
+                addr, rlen, wlen = struct.unpack('<BHH', left[:5])
+                args = (addr, rlen, left[5:5 + wlen])
+                size = 6 + wlen
+            elif step == proto.STEP_SPI and len(left) >= 3:
+                hold, length = struct.unpack('<BH', left[:3])
+                args = (hold != 0, left[3:3 + length])
+                size, rlen = 4 + length, length
+            elif step == proto.STEP_GPIO and len(left) >= 3 and \
+                    left[0] <= 4 and left[1] <= 15:
+                args = tuple(left[:3])
+                size, rlen = 4, int(left[2] == proto.GPIO_READ)
+            elif step == proto.STEP_SPI_CS and len(left) >= 2 and \
+                    left[0] <= 4 and left[1] <= 15:
+                args = tuple(left[:2])
+                size, rlen = 3, 0
+            elif step == proto.STEP_DELAY and len(left) >= 4 and \
+                    struct.unpack('<I', left[:4])[0] <= proto.MAX_DELAY_US:
+                args = struct.unpack('<I', left[:4])
+                size, rlen = 5, 0
+            elif step == proto.STEP_ADC and len(left) >= 1:
+                args = (left[0],)
+                size, rlen = 2, 2
+            else:
+                return None
+
+            if offset + size > len(steps):
+                return None
+
+            parsed.append((step, args, rlen))
+            offset += size
+
+        return parsed
+
+    def __script_load_frame(self, payload):
+        if len(payload) < 1 or payload[0] >= self.SCRIPT_SLOTS:
+            self.__reply_frame(proto.OP_SCRIPT_LOAD, proto.ERR_ARGS)
+            return
+
+        if len(payload) - 1 > self.SCRIPT_MAX_SIZE:
+            self.__reply_frame(proto.OP_SCRIPT_LOAD, proto.ERR_LEN)
+            return
+
+        steps = self.__parse_script(payload[1:])
+
+        if steps is None:
+            self.__reply_frame(proto.OP_SCRIPT_LOAD, proto.ERR_ARGS)
+            return
+
+        if sum(rlen for _, _, rlen in steps) > self.TX_RX_BUFF_SIZE:
+            self.__reply_frame(proto.OP_SCRIPT_LOAD, proto.ERR_LEN)
+            return
+
+        if steps:
+            self.scripts[payload[0]] = steps
+        else:
+            self.scripts.pop(payload[0], None)
+
+        self.__reply_frame(proto.OP_SCRIPT_LOAD, 0)
+
+    def __script_run_frame(self, payload):
+        if len(payload) != 1 or payload[0] not in self.scripts:
+            self.__reply_frame(proto.OP_SCRIPT_RUN, proto.ERR_ARGS)
+            return
+
+        status, rbytes, delay = self.__run_script(payload[0])
+
+        # Delays hold back the response instead of the simulator
+        self.__reply_frame(proto.OP_SCRIPT_RUN, status, rbytes, delay)
+
+    def __run_script(self, script_id):
+        ''' Run a script like the firmware's scriptRun
+
+            Returns:
+                (status, bytes read or the failed step's index, seconds of
+                delay steps)
+        '''
+        if script_id not in self.scripts:
+            return proto.ERR_ARGS, b'', 0.0
+
+        rbytes = bytearray()
+        delay = 0.0
+
+        for index, (step, args, rlen) in enumerate(self.scripts[script_id]):
+            rval = b''
+
+            if step == proto.STEP_I2C:
+                addr, rlen, wbytes = args
+                rval = self.__i2c(addr, wbytes, rlen)
+            elif step == proto.STEP_SPI:
+                hold, wbytes = args
+                rval = self.__spi(wbytes, hold)
+            elif step == proto.STEP_GPIO:
+                port, pin, value = args
+                name = 'P{}{}'.format(chr(ord('A') + port), pin)
+                if value == proto.GPIO_READ:
+                    rval = bytes([self.gpio.get(name, 0)])
+                else:
+                    self.gpio[name] = int(value != 0)
+            elif step == proto.STEP_SPI_CS:
+                self.spi_cs = 'P{}{}'.format(chr(ord('A') + args[0]), args[1])
+            elif step == proto.STEP_DELAY:
+                delay += args[0] / 1e6
+            elif step == proto.STEP_ADC:
+                rval = self.__adc_read(args[0])
+                if rval >= 0:
+                    rval = struct.pack('<H', rval)
+
+            if isinstance(rval, int):
+                return rval, bytes([index]), delay
+
+            rbytes += rval
+
+        return 0, bytes(rbytes), delay
+
+    def __job_frame(self, payload):
+        status = 0
+
+        if len(payload) == 0:
+            self.__jobs.clear()
+        elif len(payload) == 1 and payload[0] < self.JOB_SLOTS:
+            self.__jobs.pop(payload[0], None)
+        elif len(payload) == 6 and payload[0] < self.JOB_SLOTS and \
+                payload[1] in self.scripts:
+            period = struct.unpack('<I', payload[2:])[0] / 1000.0
+            if period > 0:
+                start = time.time()
+                self.__jobs[payload[0]] = {
+                    'script': payload[1],
+                    'period': period,
+                    'start': start,
+                    'next': start,
+                    'seq': 0,
+                    'drops': 0,
+                }
+            else:
+                status = proto.ERR_ARGS
+        else:
+            status = proto.ERR_ARGS
+
+        self.__reply_frame(proto.OP_JOB, status)
+
+    def __update_jobs(self, now):
+        ''' Send the results of any job runs that are due (lock held)
+
+            Like the firmware, results that don't fit in the transmit fifo
+            are dropped.
+        '''
+        for job_id, job in sorted(self.__jobs.items()):
+            while job['next'] <= now:
+                queued = sum(len(data) for _, data in self.__tx)
+
+                if queued >= self.TX_FIFO_SIZE:
+                    # Nobody's reading. Skip ahead to now.
+                    runs = int((now - job['next']) / job['period']) + 1
+                    job['seq'] += runs
+                    job['drops'] += runs
+                    job['next'] = job['start'] + job['seq'] * job['period']
+                    break
+
+                self.__bus_time = 0.0
+                status, rbytes, delay = self.__run_script(job['script'])
+                delay += self.__bus_time
+                self.__bus_time = 0.0
+
+                time_us = int((job['next'] - self.__start) * 1e6)
+                frame = proto.encode_resp(
+                    proto.OP_JOB_DATA, status,
+                    struct.pack('<BIII', job_id, job['seq'],
+                                time_us & 0xFFFFFFFF, job['drops']) + rbytes)
+
+                if queued + len(frame) < self.TX_FIFO_SIZE:
+                    self.__send(frame, job['next'] + delay)
+                else:
+                    job['drops'] += 1
+
+                job['seq'] += 1
+                job['next'] = job['start'] + job['seq'] * job['period']
+
+    def __adc_stream_frame(self, payload):
+        if len(payload) == 0:
+            self.__stream = None
+            self.__reply_frame(proto.OP_ADC_STREAM, 0)
+            return
+
+        if len(payload) < 5:
+            self.__reply_frame(proto.OP_ADC_STREAM, proto.ERR_ARGS)
+            return
+
+        rate = struct.unpack('<I', payload[:4])[0]
+        info = self.__adc_stream_start(list(payload[4:]), rate)
+
+        if info is None:
+            self.__reply_frame(proto.OP_ADC_STREAM, proto.ERR_ARGS)
+        else:
+            self.__reply_frame(proto.OP_ADC_STREAM, 0, info)
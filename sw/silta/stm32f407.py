@@ -47,30 +47,25 @@ Notable/useful ones:
 * PD14 - Red LED
 '''
 
-import re
-import string
+import collections
+import itertools
+import struct
+import time
 
 import serial
-PIN_RE = re.compile(r'P([A-E])([0-9]+)', re.IGNORECASE)
-
-
-def _get_pin(raw_str):
-    ''' Parse and validate pin definition
-    Args:
-        raw_str: string of the form PXY
-    Returns:
-        str, int
-    '''
-    match = PIN_RE.search(raw_str)
-    if not match:
-        raise ValueError(
-            'Invalid pin definition. Pins are defined as '
-            'PXY where X is A-E and Y is 0-15 (e.g. PB5)')
-    port, pin = match.groups()
-    pin = int(pin)
-    if pin > 15:
-        raise ValueError('Invalid pin. Should be a number from 0-15')
-    return port, pin
+
+from silta import console, idcache, trace
+from silta import protocol as proto
+from silta.pipeline import Batch, Pending, Pipeline
+from silta.stream import AdcStream, JobStream
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Pin names (PXY, see console.get_pin)
+PIN_RE = console.PIN_RE
 
 
 class bridge(object):
@@ -109,27 +104,119 @@ class bridge(object):
 
     DEBUG = False
 
-    # Hardcoding until we can read values back from device
+    # Seconds to wait for a response before giving up on it. Long I2C/SPI
+    # transfers (2 KB at 100 kHz I2C takes about 0.2 s) can keep the device
+    # quiet for longer than the stream's own read timeout. Script runs get
+    # the script's delays on top (see script_run()).
+    RESPONSE_TIMEOUT = 1.0
+
+    # Limits for firmware without the caps command. They're sized from the
+    # device's caps otherwise (see console.limits).
     __CMD_MAX_STR_LEN = 4095
     __SPI_MAX_BYTES = 1024
     __I2C_MAX_BYTES = 1024
+    # Values per adcscan command (they're returned in the device's rx buffer)
+    __ADC_SCAN_MAX_VALUES = 1024
+    # ASCII responses take up to 5 characters per value (' 4095') and get
+    # mangled if they're longer than the 4 KB transmit fifo
+    __ADC_SCAN_MAX_ASCII_VALUES = (4096 - 1 - len('OK')) // 5
+
+    # Order in which resync() restores shadow state
+    __SHADOW_ORDER = ('i2cspeed', 'i2cpins', 'spicfg', 'gpiocfg', 'gpio',
+                      'dacenable', 'dac', 'pwm')
+
+    # Size of the device's USB receive fifo. Pipelined commands that haven't
+    # been answered yet must fit in it, or the device will drop bytes.
+    __RX_FIFO_SIZE = 4096
 
     PIN = [1 << i for i in range(15)]
 
-    def __init__(self, serial_device, baud_rate=None):
+    def __init__(self, serial_device, baud_rate=None, protocol='auto',
+                 cache=True, lazy=False, id_cache=None):
         ''' Initialize Silta STM32F407 Bridge
 
             Args:
-                USB serial device path (e.g. /dev/ttyACMX)
+                USB serial device path (e.g. /dev/ttyACMX), or a pyserial
+                    URL (e.g. a simulated bridge's sim:// URL)
+                protocol: Wire protocol for data transfers
+                    auto (default) - binary if the firmware supports it
+                    binary - binary (fail if the firmware doesn't support it)
+                    ascii - ASCII console commands only
+                cache: Skip commands that wouldn't change the device's
+                    state (see invalidate())
+                lazy: Put off the connect handshake until the board is
+                    first used
+                id_cache: Device identity cache file (see silta.idcache),
+                    True for the default location. Boards found in it are
+                    used without a handshake. If a different board is
+                    plugged in, commands sent before its serial number is
+                    checked may fail
         '''
 
+        if protocol not in ('auto', 'binary', 'ascii'):
+            raise ValueError('Invalid protocol. Valid protocols: '
+                             '<auto|binary|ascii>')
+
         self.stream = None
 
         self.lastcspin = None
 
+        # Last known state of pins and peripherals (write-through), by
+        # (kind, name) key. Used to skip commands that wouldn't change it.
+        self.cache = cache
+        self.__shadow = {}
+
+        # Commands written to the device that are still waiting for a
+        # response, oldest first, as {key: (Pending, data, binary, start,
+        # tag)}. The firmware answers untagged commands in order, so an
+        # untagged response belongs to the oldest untagged command. Tagged
+        # ones (see _write_frame) are matched by their tag instead.
+        self.__pending = collections.OrderedDict()
+        self.__pending_bytes = 0
+        self.__pending_keys = itertools.count()
+        self.__deferred = False
+
+        # Keys of the tagged commands in flight, by tag
+        self.__tags = {}
+        self.__last_tag = 0
+        self.__tagged = False
+
+        # Commands waiting to be written out in one go (see batch())
+        self.__coalesce = False
+        self.__txbuf = []
+
+        # Data read from the device that isn't a full line yet
+        self.__rxbuf = bytearray()
+
+        # Handlers for unsolicited binary frames, by opcode
+        self.__async_handlers = {}
+
+        # Functions called with a trace.Transaction for every command
+        self.__hooks = []
+
+        # Scripts loaded on the device, by id (see script_load())
+        self.__scripts = {}
+
+        # Running periodic jobs' run handlers, by job id (see job())
+        self.__jobs = {}
+        self.__async_handlers[proto.OP_JOB_DATA] = self.__handle_job_run
+
+        # Extra seconds the responses to in-flight commands may take, by
+        # pending key (only for commands that need it, see script_run())
+        self.__waits = {}
+
+        # Seconds to wait for data while reading a response, 0 otherwise
+        # (see __read_chunk)
+        self.__response_wait = 0
+
+        # Board timing telemetry (see device_timing())
+        self.__device_timing = False
+        self.__timing = None
+        self.__async_handlers[proto.OP_TIMING_DATA] = self.__handle_timing
+
         try:
-            self.stream = serial.Serial()
-            self.stream.port = serial_device
+            self.stream = serial.serial_for_url(serial_device,
+                                                do_not_open=True)
             self.stream.timeout = 0.1
             if baud_rate:
                 self.stream.baudrate = baud_rate
@@ -140,50 +227,836 @@ class bridge(object):
         if self.stream:
             self.stream.flush()
 
-        # Flush any remaining data in the silta's buffer
-        self.__send_cmd('\n')
+        self.__device = serial_device
+        self.__requested_protocol = protocol
+
+        # Board identity (see __set_identity), None until the handshake
+        self.__identity = None
+        self.__identifying = False
+
+        if id_cache is True:
+            id_cache = idcache.default_path()
+        self.__id_cache = id_cache
+
+        identity = None
+        if id_cache:
+            identity = idcache.get(id_cache, serial_device)
+
+        if identity is not None:
+            # Use the cached identity right away. The serial number is
+            # checked when the first response is read (see __check_board).
+            self.__set_identity(identity)
+
+            # End any partial command left in the device's buffer
+            self.stream.write(b'\n')
+            self._write_cmd('sn', self.__check_board)
+        elif not lazy:
+            self.__identify()
+
+    @property
+    def serial_number(self):
+        ''' Board serial number (None if the firmware doesn't report it) '''
+        self.__ready()
+        return self.__serial_number
+
+    @property
+    def firmware_version(self):
+        ''' Firmware version string (None if the firmware doesn't report it) '''
+        self.__ready()
+        return self.__firmware_version
+
+    @property
+    def protocol(self):
+        ''' Wire protocol in use ('binary' or 'ascii') '''
+        self.__ready()
+        return self.__protocol
+
+    @property
+    def caps(self):
+        ''' Device capabilities (buffer sizes, features, ...). Empty for
+            firmware without the caps command
+        '''
+        self.__ready()
+        return self.__caps
+
+    # Run the connect handshake, if it hasn't happened yet
+    def __ready(self):
+        if self.__identity is None and not self.__identifying:
+            self.__identify()
 
-        # Get device serial number and save it
-        line = self.__send_cmd('sn\n')
-        result = line.strip().split(' ')
+    def __identify(self):
+        ''' Connect handshake: read the board's identity and pick the protocol '''
+        self.__identifying = True
+        try:
+            # Responses to commands sent before a reconnect
+            self.drain()
+
+            # The newline ends any partial command left in the device's
+            # buffer. Skip whatever that command answers.
+            self.stream.write(b'\nident\n')
+
+            line = self.__readline().decode()
+            while line and not line.startswith('OK sn=') and \
+                    "'ident'" not in line:
+                line = self.__readline().decode()
+
+            identity = console.parse_ident(line.strip().split(' '))
+
+            if identity is None:
+                identity = self.__identify_separately()
+
+            self.__set_identity(identity)
+        finally:
+            self.__identifying = False
+
+        if self.__id_cache and identity['serial_number'] is not None:
+            idcache.put(self.__id_cache, self.__device, identity)
+
+    # Handshake for firmware without the ident command. Sends the separate
+    # commands all at once.
+    def __identify_separately(self):
+        sn = self._write_cmd('sn')
+        version = self._write_cmd('version')
+        binary = self._write_cmd('binary')
+        caps = self._write_cmd('caps')
+
+        identity = {}
+
+        result = sn.result().strip().split(' ')
 
         if result[0] == 'OK':
-            self.serial_number = ''.join(result[1:])
+            identity['serial_number'] = ''.join(result[1:])
         else:
-            self.serial_number = None
+            identity['serial_number'] = None
             print('Warning: Could not read device serial number.')
             print('You might want to update firmware on your board')
 
-        # Get device serial number and save it
-        line = self.__send_cmd('version\n')
-        result = line.strip().split(' ')
+        result = version.result().strip().split(' ')
 
         if result[0] == 'OK':
-            self.firmware_version = result[1]
+            identity['firmware_version'] = result[1]
         else:
-            self.firmware_version = None
+            identity['firmware_version'] = None
             print('Warning: Could not read device firmware version.')
             print('You might want to update firmware on your board')
 
+        result = binary.result().strip().split(' ')
+
+        if result[0] == 'OK':
+            identity['binary'] = int(result[1])
+        else:
+            identity['binary'] = 0
+
+        identity['caps'] = console.parse_caps(caps.result().strip().split(' '))
+
+        return identity
+
+    def __set_identity(self, identity):
+        ''' Pick the protocol and size commands for the board '''
+        protocol = self.__requested_protocol
+
+        # Switch to the binary protocol if the firmware speaks it
+        if protocol != 'ascii' and identity['binary'] == proto.VERSION:
+            self.__protocol = 'binary'
+        elif protocol == 'binary':
+            raise IOError('Device does not support binary protocol')
+        else:
+            self.__protocol = 'ascii'
+
+        self.__identity = identity
+        self.__serial_number = identity['serial_number']
+        self.__firmware_version = identity['firmware_version']
+        self.__caps = identity['caps']
+
+        self.__tagged = self.__protocol == 'binary' and \
+            'tagged' in self.__caps.get('features', [])
+
+        # Size commands to the device's buffers
+        limits = console.limits(self.__caps, self.__protocol)
+        if limits is None:
+            cls = type(self)
+            limits = {
+                'cmd': cls.__CMD_MAX_STR_LEN,
+                'rx_fifo': cls.__RX_FIFO_SIZE,
+                'spi': cls.__SPI_MAX_BYTES,
+                'i2c': cls.__I2C_MAX_BYTES,
+                'adc_scan': cls.__ADC_SCAN_MAX_VALUES,
+            }
+
+            if self.__protocol == 'ascii':
+                limits['adc_scan'] = cls.__ADC_SCAN_MAX_ASCII_VALUES
+
+        self.__CMD_MAX_STR_LEN = limits['cmd']
+        self.__RX_FIFO_SIZE = limits['rx_fifo']
+        self.__SPI_MAX_BYTES = limits['spi']
+        self.__I2C_MAX_BYTES = limits['i2c']
+        self.__ADC_SCAN_MAX_VALUES = limits['adc_scan']
+
+    # Response parser for the serial number check of a cached identity
+    def __check_board(self, result):
+        if result[0] == 'OK' and ''.join(result[1:]) == self.__serial_number:
+            return
+
+        print('Warning: Board on ' + self.__device + ' does not match the '
+              'device cache, reconnecting')
+
+        idcache.remove(self.__id_cache, self.__device)
+
+        # Handshake again before the next command
+        self.__identity = None
+
     def close(self):
         ''' Disconnect from USB-serial device. '''
+        self.drain()
         self.stream.close()
 
-    # Send terminal command and wait for response
-    def __send_cmd(self, cmd):
+    def pipeline(self, depth=8):
+        ''' Pipelined access to the bridge
+
+            Args:
+                depth: Maximum number of commands in flight at once
+
+            Returns:
+                Pipeline object with the same command methods as the bridge.
+                Each call is sent right away and returns a Pending result
+                instead of waiting for the device to respond.
+
+            Example:
+                with my_bridge.pipeline() as pipe:
+                    reads = [pipe.i2c(0x3A, 1, [reg]) for reg in range(16)]
+                values = [read.result() for read in reads]
+        '''
+        return Pipeline(self, depth)
+
+    def batch(self):
+        ''' Batched access to the bridge
+
+            Returns:
+                Batch object with the same command methods as the bridge.
+                Calls are collected and sent to the device in a single write
+                when the batch is flushed (or the `with` block ends). All
+                responses are then read back in bulk and each call's Pending
+                result is filled in.
+
+            Example:
+                with my_bridge.batch() as batch:
+                    batch.i2c(MUX_ADDR, 0, [1 << channel])
+                    temp = batch.i2c(SENSOR_ADDR, 2, [READ_TEMP])
+                    rh = batch.i2c(SENSOR_ADDR, 2, [READ_RH])
+                print(temp.result(), rh.result())
+        '''
+        return Batch(self)
+
+    def drain(self):
+        ''' Wait for the responses to all in-flight commands '''
+        while self.__pending:
+            self._read_resp()
+
+    def invalidate(self):
+        ''' Forget the known pin and peripheral state
+
+            Call after anything that changes the device's state behind the
+            bridge's back (e.g. a board reset), so the next writes are sent
+            even if they match what was last written.
+        '''
+        self.__shadow = {}
+        self.lastcspin = None
+
+    def resync(self):
+        ''' Send the last known pin and peripheral state back to the device
+
+            For restoring a board's configuration after it's been reset.
+            Loaded scripts are uploaded again as well.
+        '''
+        shadow = self.__shadow
+        self.invalidate()
+
+        with self.batch() as batch:
+            for kind in self.__SHADOW_ORDER:
+                for (key_kind, name), value in shadow.items():
+                    if key_kind != kind:
+                        continue
+
+                    if kind == 'i2cspeed':
+                        batch.i2c1_speed(value)
+                    elif kind == 'i2cpins':
+                        batch.i2c1_pins(value)
+                    elif kind == 'spicfg':
+                        batch.spicfg(*value)
+                    elif kind == 'gpiocfg':
+                        batch.gpiocfg(name, *value)
+                    elif kind == 'dacenable':
+                        batch.dac_enable()
+                    else:
+                        getattr(batch, kind)(name, value)
+
+        # Scripts are lost on reset too
+        for script_id, script in list(self.__scripts.items()):
+            self.script_load(script_id, script)
+
+    def add_hook(self, hook):
+        ''' Call hook(transaction) after every command's response is read
+
+            Args:
+                hook: Function taking a silta.trace.Transaction (e.g. a
+                    trace.Profiler)
+        '''
+        self.__hooks.append(hook)
+
+    def remove_hook(self, hook):
+        ''' Stop calling a hook added with add_hook() '''
+        self.__hooks.remove(hook)
+
+    def device_timing(self, enable=True):
+        ''' Have the board report how long it spends on each command
+
+            The board's parse, execute and format times are added to the
+            transactions passed to hooks (see add_hook() and silta.trace),
+            so they can be compared with the host's timing.
+
+            Args:
+                enable: False to turn the reports off again
+        '''
+        enable = bool(enable)
+        if enable == self.__device_timing:
+            return
+
+        if 'timing' not in self.caps.get('features', []):
+            raise IOError('Device does not support timing telemetry')
+
+        line = self.__send_cmd('timing {}'.format(int(enable)))
+        if not line.startswith('OK'):
+            raise IOError('Could not set timing telemetry: ' + line.strip())
+
+        # Neither of the timing commands gets a report of its own
+        self.__device_timing = enable
+
+    def _set_coalesce(self, coalesce):
+        ''' Hold written commands until the next read (or until disabled) '''
+        self.__coalesce = coalesce
+        if not coalesce:
+            self.__flush_writes()
+
+    def _set_async_handler(self, opcode, handler):
+        ''' Call handler(status, payload) for each unsolicited frame with
+            the given opcode (None removes the handler)
+        '''
+        if handler is None:
+            self.__async_handlers.pop(opcode, None)
+        else:
+            self.__async_handlers[opcode] = handler
+
+    def _set_job_handler(self, job_id, handler):
+        ''' Call handler(status, payload) for each run of a periodic job
+            (None removes the handler). The job id is stripped from the
+            payload.
+        '''
+        if handler is None:
+            self.__jobs.pop(job_id, None)
+        else:
+            self.__jobs[job_id] = handler
+
+    def __handle_job_run(self, status, payload):
+        handler = self.__jobs.get(payload[0])
+
+        # Runs of jobs nobody's listening to anymore are ignored
+        if handler is not None:
+            handler(status, payload[1:])
+
+    def _poll_async(self):
+        ''' Wait (up to the stream timeout) for unsolicited frames and
+            dispatch them. Responses to in-flight commands are read too.
+        '''
+        self.__flush_writes()
+
+        if self.__pending:
+            self._read_resp()
+        else:
+            self.__dispatch_async(once=True)
+
+    def _in_flight(self):
+        ''' Number of commands still waiting for a response '''
+        return len(self.__pending)
+
+    def _call_deferred(self, name, *args, **kwargs):
+        ''' Call a bridge method, returning Pending instead of the result '''
+        self.__deferred = True
+        try:
+            return getattr(self, name)(*args, **kwargs)
+        finally:
+            self.__deferred = False
+
+    def _write_cmd(self, cmd, parse=None, split=True):
+        ''' Send terminal command without waiting for the response
+
+            Args:
+                cmd: Command string (without newline)
+                parse: Function converting the split response line into a
+                    return value. If None, the raw response line is returned
+                split: If False, parse gets the whole response line instead
+
+            Returns:
+                Pending result for the command
+        '''
+        self.__ready()
 
         if (len(cmd) + 1) > self.__CMD_MAX_STR_LEN:
             raise RuntimeError('Command string too long')
 
-        self.stream.write('{}\n'.format(cmd).encode())
         if self.DEBUG is True:
             print('CMD : {}'.format(cmd))
 
-        line = self.stream.readline()
+        if parse is not None and split:
+            split_parse = lambda line: parse(line.strip().split(' '))
+        else:
+            split_parse = parse
+
+        return self.__queue((cmd + '\n').encode(), split_parse, False)
+
+    def _write_frame(self, opcode, payload, parse=None, wait=0):
+        ''' Send binary protocol command without waiting for the response
+
+            Args:
+                opcode: Command opcode (see silta.protocol)
+                payload: Command payload bytes
+                parse: Function converting the (status, payload) response
+                    into a return value. If None, the tuple is returned
+                wait: Seconds the response may take on top of
+                    RESPONSE_TIMEOUT (e.g. a script's delays)
+
+            Returns:
+                Pending result for the command
+        '''
+        self.__ready()
+
+        # Tagged commands on different buses run at the same time on the
+        # device, and their responses can come back out of order. Timing
+        # reports follow the response they're for, so nothing is tagged
+        # while they're enabled.
+        tag = None
+        if self.__tagged and not self.__device_timing:
+            tag = self.__new_tag()
+
+        frame = proto.encode_cmd(opcode, payload, tag)
+
+        if len(frame) > self.__CMD_MAX_STR_LEN:
+            raise RuntimeError('Command frame too long')
+
+        if self.DEBUG is True:
+            print('CMD : {:02X} {}'.format(opcode, payload.hex()))
+
+        return self.__queue(frame, parse, True, tag, wait)
+
+    def __new_tag(self):
+        ''' A tag that no command in flight is using '''
+        while len(self.__tags) > 0xFF:
+            self._read_resp()
+
+        tag = (self.__last_tag + 1) & 0xFF
+        while tag in self.__tags:
+            tag = (tag + 1) & 0xFF
+
+        self.__last_tag = tag
+
+        return tag
+
+    def __queue(self, data, parse, binary, tag=None, wait=0):
+        ''' Send (or hold, when coalescing) command data and queue a Pending
+
+            Args:
+                data: Encoded command
+                parse: Response parser for the Pending result
+                binary: True if the response is a binary protocol frame
+                tag: Command tag (None if untagged)
+                wait: Seconds the response may take on top of
+                    RESPONSE_TIMEOUT
+        '''
+
+        # Don't overrun the device's receive fifo. When coalescing, empty it
+        # completely so the next write can be as large as possible.
+        while self.__pending and \
+                (self.__pending_bytes + len(data)) > self.__RX_FIFO_SIZE:
+            if self.__coalesce:
+                self.drain()
+            else:
+                self._read_resp()
+
+        pending = Pending(self, parse)
+
+        self.__txbuf.append(data)
+        if not self.__coalesce:
+            self.__flush_writes()
+
+        # Only timed when someone's listening
+        start = time.perf_counter() if self.__hooks else None
+
+        key = next(self.__pending_keys)
+        self.__pending[key] = (pending, data, binary, start, tag)
+        self.__pending_bytes += len(data)
+
+        if tag is not None:
+            self.__tags[tag] = key
+
+        if wait > 0:
+            self.__waits[key] = wait
+
+        return pending
+
+    def __pop_pending(self, key):
+        ''' Remove a command from the in-flight ones '''
+        entry = self.__pending.pop(key)
+        self.__pending_bytes -= len(entry[1])
+        self.__waits.pop(key, None)
+
+        if entry[4] is not None:
+            del self.__tags[entry[4]]
+
+        return entry
+
+    def __oldest_untagged(self):
+        ''' Key of the oldest untagged command in flight (or of the oldest
+            command, if they're all tagged)
+        '''
+        if self.__tags:
+            for key, entry in self.__pending.items():
+                if entry[4] is None:
+                    return key
+
+        return next(iter(self.__pending))
+
+    def _read_resp(self):
+        ''' Read one response and hand it to the command it answers '''
+        self.__response_wait = self.RESPONSE_TIMEOUT + \
+            max(self.__waits.values(), default=0)
+        try:
+            self.__read_resp()
+        finally:
+            self.__response_wait = 0
+
+    def __read_resp(self):
+        # Make sure the command we're waiting on has actually been sent
+        self.__flush_writes()
+
+        if self.__tags and self.__dispatch_async() and \
+                self.__rxbuf[0] == proto.SYNC and \
+                self.__rxbuf[1] & proto.TAGGED:
+            self.__read_tagged()
+            return
+
+        pending, data, binary, start, tag = self.__pop_pending(
+            self.__oldest_untagged())
+
+        if tag is not None:
+            # Only tagged commands are left, but what came in (if anything)
+            # isn't a tagged response
+            error = IOError('Timed out waiting for response')
+            if self.__rxbuf[:1] == bytes([proto.SYNC]):
+                try:
+                    _, status, _ = self.__read_frame_raw()
+                    error = IOError('Untagged response ({})'.format(status))
+                except IOError as e:
+                    error = e
+
+            if start is not None:
+                self.__call_hooks(data, binary, 0, start, False)
+            pending._set_exception(error)
+            return
+
+        if binary:
+            try:
+                response = self.__read_frame()
+            except IOError as e:
+                if start is not None:
+                    self.__call_hooks(data, binary, 0, start, False)
+                pending._set_exception(e)
+                return
+
+            device = self.__read_timing() if self.__device_timing else None
+
+            if start is not None:
+                self.__call_hooks(
+                    data, binary,
+                    proto.RESP_HEADER_LEN + len(response[1]) + proto.CRC_LEN,
+                    start, response[0] == 0, device)
+        else:
+            line = self.__readline()
+            response = line.decode()
+
+            device = self.__read_timing() if self.__device_timing else None
+
+            if start is not None:
+                self.__call_hooks(data, binary, len(line), start,
+                                  response.startswith('OK'), device)
+
         if self.DEBUG is True:
-            print('RESP: {}'.format(line))
+            print('RESP: {}'.format(response))
 
-        return line.decode()
+        pending._set_response(response)
+
+    def __read_tagged(self):
+        ''' Read a tagged response and hand it to the command with its tag '''
+        try:
+            _, status, payload = self.__read_frame_raw()
+        except IOError as e:
+            # No telling who it was for
+            pending, data, binary, start, _ = self.__pop_pending(
+                next(iter(self.__pending)))
+            if start is not None:
+                self.__call_hooks(data, binary, 0, start, False)
+            pending._set_exception(e)
+            return
+
+        key = self.__tags.get(payload[0]) if payload else None
+        if key is None:
+            # Not for anything in flight (e.g. sent before a reconnect)
+            return
+
+        pending, data, binary, start, _ = self.__pop_pending(key)
+        response = (status, payload[1:])
+
+        if start is not None:
+            self.__call_hooks(
+                data, binary,
+                proto.RESP_HEADER_LEN + len(payload) + proto.CRC_LEN,
+                start, status == 0)
+
+        if self.DEBUG is True:
+            print('RESP: {}'.format(response))
+
+        pending._set_response(response)
+
+    def __call_hooks(self, data, binary, bytes_in, start, ok, device=None):
+        transaction = trace.Transaction(
+            trace.command_name(data, binary), binary, len(data), bytes_in,
+            start, time.perf_counter(), ok, device)
+
+        for hook in list(self.__hooks):
+            hook(transaction)
+
+    def __read_timing(self):
+        ''' Read the board's timing report for the command just answered
+
+            The report is sent right after the response (possibly behind
+            some unsolicited stream frames).
+
+            Returns:
+                trace.DeviceTiming, or None if it didn't show up
+        '''
+        self.__timing = None
+
+        while self.__timing is None:
+            if not self.__dispatch_async(once=True):
+                break
+
+            # Something other than an unsolicited frame is next
+            if self.__timing is None and len(self.__rxbuf) >= 2 and \
+                    not (self.__rxbuf[0] == proto.SYNC and
+                         self.__rxbuf[1] & proto.ASYNC):
+                break
+
+        return self.__timing
+
+    def __handle_timing(self, status, payload):
+        _, parse, execute, fmt, clock = struct.unpack('<5I', payload)
+
+        self.__timing = trace.DeviceTiming(
+            parse / clock, execute / clock, fmt / clock)
+
+    def __flush_writes(self):
+        ''' Write out any commands held back while coalescing '''
+        if self.__txbuf:
+            self.stream.write(b''.join(self.__txbuf))
+            self.__txbuf = []
+
+    def __readline(self):
+        ''' Read one line, taking in everything the device has sent so far
+
+            Returns whatever was received (possibly a partial or empty line)
+            if the stream times out before the end of the line.
+        '''
+        if not self.__dispatch_async():
+            line = bytes(self.__rxbuf)
+            self.__rxbuf = bytearray()
+            return line
+
+        index = self.__rxbuf.find(b'\n')
+        while index < 0:
+            chunk = self.__read_chunk(self.stream.in_waiting or 1)
+            if not chunk:
+                index = len(self.__rxbuf) - 1
+                break
+
+            self.__rxbuf += chunk
+            index = self.__rxbuf.find(b'\n')
+
+        line = bytes(self.__rxbuf[:index + 1])
+        del self.__rxbuf[:index + 1]
+
+        return line
+
+    def __read_chunk(self, size):
+        ''' Read up to size bytes from the stream
+
+            While a response is due, empty reads are retried for up to
+            RESPONSE_TIMEOUT (plus the extra time in-flight commands may
+            take). Returns b'' if nothing comes in by then.
+        '''
+        deadline = time.time() + self.__response_wait
+
+        while True:
+            chunk = self.stream.read(size)
+            if chunk or time.time() >= deadline:
+                return chunk
+
+    def __fill(self, length):
+        ''' Make sure at least length bytes are buffered
+
+            Returns False if the stream times out first
+        '''
+        while len(self.__rxbuf) < length:
+            chunk = self.__read_chunk(
+                max(length - len(self.__rxbuf), self.stream.in_waiting))
+            if not chunk:
+                return False
+
+            self.__rxbuf += chunk
+
+        return True
+
+    def __read_exact(self, length):
+        ''' Read length bytes (or fewer, if the stream times out) '''
+        self.__fill(length)
+
+        data = bytes(self.__rxbuf[:length])
+        del self.__rxbuf[:length]
+
+        return data
+
+    def __dispatch_async(self, once=False):
+        ''' Handle any unsolicited frames at the start of the input
+
+            Args:
+                once: Return after the first frame, instead of waiting for
+                    something other than an unsolicited frame (which may
+                    never come while a stream is running)
+
+            Returns False if the stream times out before anything else
+            shows up
+        '''
+        while True:
+            if not self.__fill(2):
+                return False
+
+            if self.__rxbuf[0] != proto.SYNC or \
+                    not (self.__rxbuf[1] & proto.ASYNC):
+                return True
+
+            opcode, status, payload = self.__read_frame_raw()
+
+            handler = self.__async_handlers.get(opcode)
+            if handler is not None:
+                handler(status, payload)
+
+            if once:
+                return True
+
+    def __read_frame(self):
+        ''' Read a binary protocol response frame
+
+            Returns:
+                (status, payload) tuple
+        '''
+        if not self.__dispatch_async():
+            raise IOError('Timed out waiting for response')
+
+        _, status, payload = self.__read_frame_raw()
+
+        return status, payload
+
+    def __read_frame_raw(self):
+        ''' Read a binary protocol frame
+
+            Returns:
+                (opcode, status, payload) tuple
+        '''
+        header = self.__read_exact(proto.RESP_HEADER_LEN)
+
+        if len(header) < proto.RESP_HEADER_LEN:
+            raise IOError('Timed out waiting for response')
+
+        try:
+            opcode, status, length = proto.decode_resp_header(header)
+        except ValueError:
+            # Out of sync, so anything else in the buffer is suspect too
+            self.__rxbuf = bytearray()
+            raise IOError('Invalid response frame')
+
+        payload = self.__read_exact(length + proto.CRC_LEN)
+
+        if len(payload) < length + proto.CRC_LEN:
+            raise IOError('Timed out waiting for response')
+
+        if not proto.check_crc(header, payload[:length], payload[length:]):
+            raise IOError('Response CRC mismatch')
+
+        return opcode, status, payload[:length]
+
+    # Send terminal command and wait for response
+    def __send_cmd(self, cmd):
+        return self._write_cmd(cmd).result()
+
+    # Send terminal command and parse the response. Returns a Pending result
+    # instead when called through a pipeline.
+    def __request(self, cmd, parse, split=True):
+        return self.__complete(self._write_cmd(cmd, parse, split))
+
+    # Same as __request, for binary protocol commands
+    def __request_frame(self, opcode, payload, parse, wait=0):
+        return self.__complete(self._write_frame(opcode, payload, parse,
+                                                 wait))
+
+    def __complete(self, pending):
+        if self.__deferred:
+            return pending
+        else:
+            return pending.result()
+
+    # True if the device is known to have key set to value already.
+    # Otherwise, value is recorded as the new state (the command setting it
+    # is about to be sent).
+    def __unchanged(self, key, value):
+        if not self.cache:
+            return False
+
+        if key in self.__shadow and self.__shadow[key] == value:
+            return True
+
+        self.__shadow[key] = value
+        return False
+
+    # Result of a command that was skipped, as if it had been sent
+    def __skipped(self, result):
+        pending = Pending(self)
+        pending._set_response(result)
+        return self.__complete(pending)
+
+    # Wrap a response parser so key's state is forgotten if the command fails
+    def __track(self, key, parse):
+        def tracked(result):
+            if result[0] != 'OK':
+                self.__shadow.pop(key, None)
+            return parse(result)
+
+        return tracked
+
+    # Same as __track, for binary protocol response parsers
+    def __track_frame(self, key, parse):
+        def tracked(response):
+            if response[0] != 0:
+                self.__shadow.pop(key, None)
+            return parse(response)
+
+        return tracked
 
     def i2c_speed(self, speed):
         ''' Alias of i2c1_speed method '''
@@ -192,16 +1065,14 @@ class bridge(object):
     # Set I2C Speed
     def i2c1_speed(self, speed):
         ''' Set I2C speed in Hz. '''
-        cmd = 'config i2cspeed ' + str(speed)
+        key = ('i2cspeed', None)
 
-        line = self.__send_cmd(cmd)
+        if self.__unchanged(key, int(speed)):
+            return self.__skipped(True)
 
-        result = line.strip().split(' ')
+        cmd = 'config i2cspeed ' + str(speed)
 
-        if result[0] == 'OK':
-            return True
-        else:
-            return False
+        return self.__request(cmd, self.__track(key, console.parse_ok))
 
     # Set I2C pins
     def i2c1_pins(self, pins):
@@ -220,16 +1091,19 @@ class bridge(object):
                 OR
                 my_bridge.i2c1_pins(0x180)
         '''
-        cmd = 'config i2cpins ' + str(pins)
+        key = ('i2cpins', None)
 
-        line = self.__send_cmd(cmd)
+        if self.__unchanged(key, int(pins)):
+            return self.__skipped(True)
 
-        result = line.strip().split(' ')
+        # Pins that aren't used for I2C are turned into GPIOs
+        for pin in range(6, 10):
+            self.__shadow.pop(('gpiocfg', 'PB' + str(pin)), None)
+            self.__shadow.pop(('gpio', 'PB' + str(pin)), None)
 
-        if result[0] == 'OK':
-            return True
-        else:
-            return False
+        cmd = 'config i2cpins ' + str(pins)
+
+        return self.__request(cmd, self.__track(key, console.parse_ok))
 
     def i2c(self, addr, rlen, wbytes=[]):
         ''' Alias of i2c1 method '''
@@ -242,13 +1116,40 @@ class bridge(object):
             Args:
                 addr: 8 bit I2C address
                 rlen: Number of bytes to read
-                wbytes: List of bytes to write
+                wbytes: List of bytes (or bytes-like object) to write
 
             Return value:
                 Integer with error code
                 or
                 List with read bytes (or empty list if write-only command)
         '''
+        return self.__i2c_request(
+            addr, rlen, wbytes, console.parse_bytes, proto.parse_frame_bytes)
+
+    def i2c_read_into(self, addr, rbuf, wbytes=b''):
+        ''' I2C Transaction (write-then-read) into a caller-supplied buffer
+
+            Args:
+                addr: 8 bit I2C address
+                rbuf: Writable buffer (e.g. bytearray or memoryview). Its
+                    length is the number of bytes to read
+                wbytes: Bytes-like object (or list of bytes) to write
+
+            Return value:
+                Integer with error code
+                or
+                Number of bytes read into rbuf
+        '''
+        rbuf = memoryview(rbuf).cast('B')
+
+        return self.__i2c_request(
+            addr, len(rbuf), wbytes,
+            console.parse_bytes_into(rbuf), proto.parse_frame_bytes_into(rbuf))
+
+    def __i2c_request(self, addr, rlen, wbytes, parse, parse_frame):
+        self.__ready()
+
+        wbytes = console.as_bytes(wbytes)
 
         if len(wbytes) > self.__I2C_MAX_BYTES:
             raise ValueError('wbytes too long. Max:', self.__I2C_MAX_BYTES)
@@ -256,23 +1157,14 @@ class bridge(object):
         if rlen > self.__I2C_MAX_BYTES:
             raise ValueError('rlen too long. Max:', self.__I2C_MAX_BYTES)
 
-        rbytes = []
-        cmd = 'i2c ' + format(addr, '02X') + ' ' + str(rlen)
-
-        for byte in wbytes:
-            cmd += format(byte, ' 02X')
-
-        line = self.__send_cmd(cmd)
+        if self.protocol == 'binary':
+            payload = struct.pack('<BH', addr, rlen) + wbytes
+            return self.__request_frame(proto.OP_I2C, payload, parse_frame)
 
-        result = line.strip().split(' ')
+        cmd = 'i2c ' + format(addr, '02X') + ' ' + str(rlen) + \
+            console.encode_bytes(wbytes)
 
-        if result[0] == 'OK':
-            for byte in result[1:]:
-                rbytes.append(int(byte, 16))
-        else:
-            rbytes = int(result[1])
-
-        return rbytes
+        return self.__request(cmd, parse, split=False)
 
     # Set the spi CS line to use on the next transaction
     def __set_spi_cs(self, cspin):
@@ -282,7 +1174,12 @@ class bridge(object):
         if self.lastcspin != cspin:
             self.lastcspin = cspin
 
-            port, pin = _get_pin(cspin)
+            port, pin = console.get_pin(cspin)
+
+            # The CS pin is reconfigured by the firmware
+            name = 'P' + port.upper() + str(pin)
+            self.__shadow.pop(('gpiocfg', name), None)
+            self.__shadow.pop(('gpio', name), None)
 
             cmd = 'spics ' + port + ' ' + str(pin)
 
@@ -299,39 +1196,158 @@ class bridge(object):
 
             Args:
                 cspin: Chip/Slave select pin for transaction
-                wbytes: List of bytes to write out
+                wbytes: List of bytes (or bytes-like object) to write out
 
             Returns:
                 Integer error code
                 or
                 List of read bytes
         '''
+        return self.__spi_request(
+            cspin, wbytes, console.parse_bytes, proto.parse_frame_bytes)
+
+    def spi_into(self, cspin, wbytes, rbuf):
+        ''' SPI Transaction into a caller-supplied buffer
+
+            Args:
+                cspin: Chip/Slave select pin for transaction
+                wbytes: Bytes-like object (or list of bytes) to write out
+                rbuf: Writable buffer (e.g. bytearray or memoryview) for the
+                    read bytes. Must be at least as long as wbytes
+
+            Returns:
+                Integer error code
+                or
+                Number of bytes read into rbuf
+        '''
+        rbuf = memoryview(rbuf).cast('B')
+
+        if len(rbuf) < len(console.as_bytes(wbytes)):
+            raise ValueError('rbuf is shorter than wbytes')
+
+        return self.__spi_request(
+            cspin, wbytes,
+            console.parse_bytes_into(rbuf), proto.parse_frame_bytes_into(rbuf))
+
+    def __spi_request(self, cspin, wbytes, parse, parse_frame):
+        self.__ready()
+
+        wbytes = console.as_bytes(wbytes)
+
         if len(wbytes) > self.__SPI_MAX_BYTES:
             raise ValueError('wbytes too long. Max:', self.__SPI_MAX_BYTES)
 
-        rbytes = []
-
         # Make sure the CS pin is selected
         self.__set_spi_cs(cspin)
 
-        cmd = 'spi'
+        if self.protocol == 'binary':
+            return self.__request_frame(proto.OP_SPI, wbytes, parse_frame)
 
-        for byte in wbytes:
-            cmd += format(byte, ' 02X')
+        cmd = 'spi' + console.encode_bytes(wbytes)
 
-        line = self.__send_cmd(cmd)
+        return self.__request(cmd, parse, split=False)
 
-        result = line.strip().split(' ')
+    # SPI transaction longer than a single command
+    def spi_stream(self, cspin, data, chunk_size=None):
+        ''' SPI Transaction of any length, with CS held asserted throughout
 
-        if result[0] == 'OK':
-            for byte in result[1:]:
-                rbytes.append(int(byte, 16))
+            The data is sent in chunks, as pipelined commands, so the device
+            is kept busy while the next chunks are on their way.
+
+            Args:
+                cspin: Chip/Slave select pin for transaction
+                data: Bytes-like object (or list of bytes), or an iterable
+                    of such chunks, of any size (e.g. a generator reading a
+                    file)
+                chunk_size: Bytes per command (default: as many as the
+                    device buffers allow while keeping commands in flight)
+
+            Returns:
+                bytearray with all the read bytes
+
+            Raises:
+                IOError if a chunk fails. CS is released, but chunks already
+                sent may have been clocked out.
+
+            Example:
+                Read 16MB from an SPI flash (0x03 read command at address 0):
+                    cmd = [0x03, 0, 0, 0]
+                    dump = my_bridge.spi_stream('PE3', itertools.chain(
+                        [cmd], itertools.repeat(bytes(4096), 4096)))[4:]
+        '''
+        if chunk_size is None:
+            # Small enough to keep a few chunks in the device's fifo (hex
+            # takes 3 characters per byte)
+            if self.protocol == 'binary':
+                chunk_size = self.__RX_FIFO_SIZE // 4
+            else:
+                chunk_size = self.__RX_FIFO_SIZE // 8
+
+            chunk_size = min(chunk_size, self.__SPI_MAX_BYTES)
 
+        if chunk_size < 1 or chunk_size > self.__SPI_MAX_BYTES:
+            raise ValueError('chunk_size must be 1 to ' +
+                             str(self.__SPI_MAX_BYTES))
+
+        # A single buffer (or list of bytes), or an iterable of chunks
+        if isinstance(data, list) and (not data or isinstance(data[0], int)):
+            chunks = [bytes(data)]
         else:
-            rbytes = int(result[1])
+            try:
+                chunks = [memoryview(data).cast('B')]
+            except TypeError:
+                chunks = data
+
+        self.__set_spi_cs(cspin)
+
+        rbytes = bytearray()
+        in_flight = collections.deque()
+
+        def read_done(block=False):
+            while in_flight and (block or in_flight[0].done()):
+                rval = in_flight.popleft().result()
+                if isinstance(rval, int):
+                    self.__spi_transfer(b'', False).result()
+                    raise IOError('SPI transfer failed ({})'.format(rval))
+                rbytes.extend(rval)
+
+        # Always keep the last chunk_size bytes (or less) back, so the last
+        # chunk can release CS
+        wbuf = bytearray()
+        for chunk in chunks:
+            wbuf += console.as_bytes(chunk)
+
+            while len(wbuf) > chunk_size:
+                in_flight.append(
+                    self.__spi_transfer(wbuf[:chunk_size], True))
+                del wbuf[:chunk_size]
+                read_done()
+
+        if wbuf:
+            in_flight.append(self.__spi_transfer(wbuf, False))
+
+        read_done(block=True)
 
         return rbytes
 
+    # Send one spi_stream chunk. Returns a Pending with the read bytes (or
+    # the integer error code)
+    def __spi_transfer(self, wbytes, hold):
+        if self.protocol == 'binary':
+            def parse_frame(response):
+                status, payload = response
+                if status == 0:
+                    return payload
+                else:
+                    return status
+
+            return self._write_frame(proto.OP_SPI_STREAM,
+                                     bytes([int(hold)]) + wbytes, parse_frame)
+
+        cmd = 'spistream ' + str(int(hold)) + console.encode_bytes(wbytes)
+
+        return self._write_cmd(cmd, console.decode_bytes, split=False)
+
     def spicfg(self, speed, cpol, cpha):
         ''' SPI Configuration
 
@@ -348,15 +1364,15 @@ class bridge(object):
                 False for failure
         '''
 
-        cmd = 'spicfg {} {} {}'.format(speed, int(cpol) & 1, int(cpha) & 1)
-        line = self.__send_cmd(cmd)
+        key = ('spicfg', None)
+        config = (int(speed), int(cpol) & 1, int(cpha) & 1)
 
-        result = line.strip().split(' ')
+        if self.__unchanged(key, config):
+            return self.__skipped(True)
 
-        if result[0] == 'OK':
-            return True
-        else:
-            return False
+        cmd = 'spicfg {} {} {}'.format(*config)
+
+        return self.__request(cmd, self.__track(key, console.parse_ok))
 
     # Configure GPIO as input/output/etc
     def gpiocfg(self, name, mode='input', pull=None):
@@ -375,27 +1391,35 @@ class bridge(object):
                     up - Pull-up
                     down - Pull-down
         '''
-        port, pin = _get_pin(name)
+        port, pin = console.get_pin(name)
 
         if mode not in self.__pinModes:
-            raise ValueError('Invalid pin mode. Valid modes: <' + string.join(
-                self.__pinModes.keys(), '|') + '>')
+            raise ValueError('Invalid pin mode. Valid modes: <' +
+                             '|'.join(self.__pinModes.keys()) + '>')
 
         if pull is not None and pull not in self.__pullModes:
-            raise ValueError('Invalid pull mode. Valid modes: <' + string.join(
-                self.__pullModes.keys(), '|') + '>')
+            raise ValueError('Invalid pull mode. Valid modes: <' +
+                             '|'.join(self.__pullModes.keys()) + '>')
+
+        name = 'P' + port.upper() + str(pin)
+        key = ('gpiocfg', name)
+
+        if self.__unchanged(key, (mode, pull)):
+            return self.__skipped(None)
+
+        # Changing the mode can change what the pin outputs
+        self.__shadow.pop(('gpio', name), None)
 
         cmd = 'gpiocfg ' + port + ' ' + str(pin) + ' ' + self.__pinModes[mode]
 
         if pull is not None:
             cmd += ' ' + self.__pullModes[pull]
 
-        line = self.__send_cmd(cmd)
-
-        result = line.strip().split(' ')
+        def parse(result):
+            if result[0] != 'OK':
+                print("Error configuring pin")
 
-        if result[0] != 'OK':
-            print("Error configuring pin")
+        return self.__request(cmd, self.__track(key, parse))
 
     # Read/write gpio value
     def gpio(self, name, value=None):
@@ -410,30 +1434,214 @@ class bridge(object):
                 None - if get failed
                 Integer - pin value
         '''
-        port, pin = _get_pin(name)
+        port, pin = console.get_pin(name)
+
+        key = ('gpio', 'P' + port.upper() + str(pin))
+
+        if value is not None and self.__unchanged(key, int(value) & 1):
+            return self.__skipped(None)
+
+        if self.protocol == 'binary':
+            payload = bytes([ord(port.upper()) - ord('A'), pin])
+
+            if value is not None:
+                payload += bytes([int(value) & 1])
+
+            def parse_frame(response):
+                status, rpayload = response
+                if status == 0 and value is None:
+                    return rpayload[0]
+                else:
+                    return None
+
+            if value is not None:
+                parse_frame = self.__track_frame(key, parse_frame)
+
+            return self.__request_frame(proto.OP_GPIO, payload, parse_frame)
 
         cmd = 'gpio ' + port + ' ' + str(pin)
 
         if value is not None:
             cmd += ' ' + str(value)
 
-        line = self.__send_cmd(cmd)
+        def parse(result):
+            if result[0] == 'OK':
+                if value is not None:
+                    return
+                else:
+                    return int(result[1])
+            else:
+                return None
 
-        result = line.strip().split(' ')
+        if value is not None:
+            parse = self.__track(key, parse)
 
-        if result[0] == 'OK':
-            if value is not None:
-                return
+        return self.__request(cmd, parse)
+
+    # 'Private' function to validate a GPIO port letter
+    def __get_port(self, port):
+        port = str(port).upper()
+
+        if len(port) != 1 or port < 'A' or port > 'E':
+            raise ValueError('Invalid port. Ports are A-E')
+
+        return port
+
+    # Read all pins in a GPIO port
+    def gpio_port_read(self, port):
+        ''' Read all 16 pins of a GPIO port at once
+
+            Args:
+                port: Port letter (A-E)
+
+            Returns:
+                None - if read failed
+                Integer - pin values, with bit n set if pin n is high
+        '''
+        port = self.__get_port(port)
+
+        if self.protocol == 'binary':
+            def parse_frame(response):
+                status, payload = response
+                if status == 0:
+                    return struct.unpack('<H', payload)[0]
+                else:
+                    return None
+
+            return self.__request_frame(
+                proto.OP_GPIO_PORT, bytes([ord(port) - ord('A')]),
+                parse_frame)
+
+        def parse(result):
+            if result[0] == 'OK':
+                return int(result[1], 16)
             else:
-                return int(result[1])
-        else:
-            return None
+                return None
+
+        return self.__request('gpioport ' + port, parse)
+
+    # Write several pins in a GPIO port
+    def gpio_port_write(self, port, mask, value):
+        ''' Set several pins of a GPIO port at once
+
+            All the pins change at the same time (single BSRR write).
+
+            Args:
+                port: Port letter (A-E)
+                mask: Pins to set, with bit n selecting pin n
+                value: Pin values, with bit n for pin n. Pins that aren't in
+                    mask are left alone
+
+            Returns:
+                None - Failed setting pins
+                True - Pins set successfully
+        '''
+        port = self.__get_port(port)
+        mask = int(mask) & 0xFFFF
+        value = int(value) & 0xFFFF
+
+        keys = []
+        for pin in range(16):
+            if mask & (1 << pin):
+                key = ('gpio', 'P' + port + str(pin))
+                keys.append(key)
+                if self.cache:
+                    self.__shadow[key] = (value >> pin) & 1
+
+        def forget():
+            for key in keys:
+                self.__shadow.pop(key, None)
+
+        if self.protocol == 'binary':
+            def parse_frame(response):
+                if response[0] != 0:
+                    forget()
+                return proto.parse_frame_ok_none(response)
+
+            payload = struct.pack('<BHH', ord(port) - ord('A'), mask, value)
+
+            return self.__request_frame(proto.OP_GPIO_PORT, payload,
+                                        parse_frame)
+
+        def parse(result):
+            if result[0] != 'OK':
+                forget()
+            return console.parse_ok_none(result)
+
+        cmd = 'gpioport {} {:X} {:X}'.format(port, mask, value)
+
+        return self.__request(cmd, parse)
+
+    # Read or write any number of pins, one command per port
+    def gpio_many(self, pins):
+        ''' Read or write several GPIO pins with one command per port
+
+            Args:
+                pins: {pin name: value} to write pins, or a list of pin names
+                    to read them
+
+            Returns:
+                Writing:
+                    None - Failed setting pins
+                    True - Pins set successfully
+                Reading:
+                    {pin name: value} (None for pins on ports that failed)
+
+            Example:
+                my_bridge.gpio_many({'PD12': 1, 'PD13': 0, 'PE3': 1})
+                my_bridge.gpio_many(['PA0', 'PD12'])
+        '''
+        write = isinstance(pins, dict)
+
+        # {port: [mask, value]}
+        ports = collections.OrderedDict()
+        names = []
+        for name in pins:
+            port, pin = console.get_pin(name)
+            port = port.upper()
+            names.append((name, port, pin))
+
+            bits = ports.setdefault(port, [0, 0])
+
+            if write:
+                bit = int(pins[name]) & 1
+
+                # Leave out pins that are already set
+                key = ('gpio', 'P' + port + str(pin))
+                if self.cache and self.__shadow.get(key) == bit:
+                    continue
+
+                bits[0] |= 1 << pin
+                bits[1] |= bit << pin
+
+        # Write every command before reading any of the responses
+        if write:
+            results = [self._call_deferred('gpio_port_write', port, *bits)
+                       for port, bits in ports.items() if bits[0]]
+
+            if all(result.result() for result in results):
+                return True
+            else:
+                return None
+
+        results = {port: self._call_deferred('gpio_port_read', port)
+                   for port in ports}
+
+        values = {}
+        for name, port, pin in names:
+            port_value = results[port].result()
+            if port_value is None:
+                values[name] = None
+            else:
+                values[name] = (port_value >> pin) & 1
+
+        return values
 
     # 'Private' function to get an ADC number from a port + pin combination
     def __adc_get_num(self, name):
         ''' Get ADC number from pin name '''
 
-        port, pin = _get_pin(name)
+        port, pin = console.get_pin(name)
 
         cmd = 'adcnum ' + port + ' ' + str(pin)
 
@@ -446,6 +1654,19 @@ class bridge(object):
         else:
             self.__adcs[name] = None
 
+    # Get (and cache) the ADC number for a pin
+    def __adc_num(self, name):
+        name = name.upper()
+
+        # Get adc number from port+pin and save it
+        if name not in self.__adcs:
+            self.__adc_get_num(name)
+
+        if self.__adcs[name] is None:
+            raise ValueError('Not an ADC pin')
+
+        return self.__adcs[name]
+
     # Read adc pin
     def adc(self, name):
         ''' Read ADC pin
@@ -458,25 +1679,135 @@ class bridge(object):
                 float - Pin value in volts
         '''
 
-        name = name.upper()
+        adc_num = self.__adc_num(name)
 
-        # Get adc number from port+pin and save it
-        if name not in self.__adcs:
-            self.__adc_get_num(name)
+        if self.protocol == 'binary':
+            def parse_frame(response):
+                status, payload = response
+                if status == 0:
+                    return struct.unpack('<H', payload)[0] * \
+                        self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL
+                else:
+                    return None
 
-        if self.__adcs[name] is None:
-            raise ValueError('Not an ADC pin')
+            return self.__request_frame(
+                proto.OP_ADC, bytes([adc_num]), parse_frame)
 
-        cmd = 'adc ' + str(self.__adcs[name])
+        cmd = 'adc ' + str(adc_num)
 
-        line = self.__send_cmd(cmd)
+        def parse(result):
+            if result[0] == 'OK':
+                return int(result[1]) * \
+                    self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL
+            else:
+                return None
 
-        result = line.strip().split(' ')
+        return self.__request(cmd, parse)
 
-        if result[0] == 'OK':
-            return int(result[1]) * self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL
+    def adc_scan(self, pins, samples=1, raw=False):
+        ''' Read several ADC pins at once, samples times in a row
+
+            The device scans all the pins back-to-back (as a single regular
+            group) for every sample, so the pins are sampled a few
+            microseconds apart. Large scans are split into several commands,
+            which are pipelined. Requires NumPy.
+
+            Args:
+                pins: List of ADC pin names (e.g. ['PA0', 'PA1', 'PC0'])
+                samples: Number of times to scan the pins
+                raw: Return raw ADC codes instead of volts
+
+            Returns:
+                (samples, pins) NumPy array. Floats in volts, or uint16 ADC
+                codes if raw is set.
+        '''
+        if numpy is None:
+            raise RuntimeError('NumPy is needed for adc_scan')
+
+        self.__ready()
+
+        adc_nums = [self.__adc_num(pin) for pin in pins]
+
+        if len(adc_nums) == 0:
+            raise ValueError('No pins to scan')
+
+        max_rows = self.__ADC_SCAN_MAX_VALUES // len(adc_nums)
+
+        if max_rows == 0:
+            raise ValueError('Too many pins to scan')
+
+        def parse_frame(response):
+            status, payload = response
+            if status != 0:
+                raise IOError('ADC scan failed ({})'.format(status))
+            return numpy.frombuffer(payload, dtype='<u2')
+
+        def parse(result):
+            if result[0] != 'OK':
+                raise IOError('ADC scan failed ({})'.format(' '.join(result)))
+            return numpy.array(result[1:], dtype=numpy.uint16)
+
+        # Write every chunk before reading any of the responses
+        chunks = []
+        for offset in range(0, samples, max_rows):
+            rows = min(max_rows, samples - offset)
+
+            if self.protocol == 'binary':
+                payload = struct.pack('<H', rows) + bytes(adc_nums)
+                chunks.append(
+                    self._write_frame(proto.OP_ADC_SCAN, payload, parse_frame))
+            else:
+                cmd = 'adcscan ' + str(rows) + ' ' + \
+                    ' '.join(str(num) for num in adc_nums)
+                chunks.append(self._write_cmd(cmd, parse))
+
+        values = [chunk.result() for chunk in chunks]
+
+        if values:
+            values = numpy.concatenate(values)
         else:
-            return None
+            values = numpy.empty(0, dtype=numpy.uint16)
+
+        values = values.astype(numpy.uint16).reshape(-1, len(adc_nums))
+
+        if raw:
+            return values
+        else:
+            return values * (self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL)
+
+    def adc_stream(self, pins, rate_hz, fmt='volts'):
+        ''' Stream ADC samples, sampled by the device at a fixed rate
+
+            Requires the binary protocol. As with adc(), the pins should be
+            configured as analog inputs first. Single adc() reads aren't
+            available while the stream is running.
+
+            Args:
+                pins: List of ADC pin names (e.g. ['PA0', 'PA1'])
+                rate_hz: Sample rate (per pin) in Hz
+                fmt: Format of the yielded samples
+                    volts (default) - (N, pins) NumPy float array
+                    raw - (N, pins) NumPy uint16 array of ADC codes
+                    bytes - packed 12-bit samples, as sent by the device
+
+            Returns:
+                AdcStream. Iterating over it yields (time, samples) tuples,
+                where time is when the first sample in the chunk was taken,
+                in seconds since the start of the stream, based on the
+                device's sample clock.
+
+            Example:
+                with my_bridge.adc_stream(['PA1'], 10000) as stream:
+                    for t, samples in stream:
+                        ...
+        '''
+        if self.protocol != 'binary':
+            raise RuntimeError('ADC streaming requires the binary protocol')
+
+        adc_nums = [self.__adc_num(pin) for pin in pins]
+
+        return AdcStream(self, adc_nums, rate_hz, fmt,
+                         self.__ADC_MAX_VOLTAGE/self.__ADC_MAX_VAL)
 
     def dac_enable(self):
         ''' Enable DACs
@@ -485,14 +1816,17 @@ class bridge(object):
                 True - Value set successfully
         '''
 
-        line = self.__send_cmd('dacenable')
+        key = ('dacenable', None)
 
-        result = line.strip().split(' ')
+        # Not skipped when already enabled, enabling resets the outputs
+        for name in self.__dacs:
+            self.__shadow.pop(('dac', name), None)
 
-        if result[0] == 'OK':
-            return True
-        else:
-            return None
+        if self.cache:
+            self.__shadow[key] = True
+
+        return self.__request('dacenable',
+                              self.__track(key, console.parse_ok_none))
 
     # Set DAC output for pin
     def dac(self, name, voltage):
@@ -515,16 +1849,22 @@ class bridge(object):
         if voltage > self.__DAC_MAX_VOLTAGE:
             voltage = self.__DAC_MAX_VOLTAGE
 
+        key = ('dac', name)
+
+        if self.__unchanged(key, voltage):
+            return self.__skipped(True)
+
         dac_val = int(voltage/self.__DAC_MAX_VOLTAGE * self.__DAC_MAX_VAL)
 
-        line = self.__send_cmd('dac {} {}'.format(self.__dacs[name], dac_val))
+        if self.protocol == 'binary':
+            payload = struct.pack('<BH', self.__dacs[name], dac_val)
+            return self.__request_frame(
+                proto.OP_DAC, payload,
+                self.__track_frame(key, proto.parse_frame_ok_none))
 
-        result = line.strip().split(' ')
+        cmd = 'dac {} {}'.format(self.__dacs[name], dac_val)
 
-        if result[0] == 'OK':
-            return True
-        else:
-            return None
+        return self.__request(cmd, self.__track(key, console.parse_ok_none))
 
     # Set PWM output for pin
     def pwm(self, name, duty_cycle):
@@ -547,14 +1887,166 @@ class bridge(object):
         if duty_cycle < 0 or duty_cycle > 1:
             raise ValueError('Duty cycle must be between 0 and 1')
 
+        key = ('pwm', name)
+
+        if self.__unchanged(key, duty_cycle):
+            return self.__skipped(True)
+
         period = 10000
         val = int(period * duty_cycle)
 
-        line = self.__send_cmd('pwm {} {}'.format(self.__pwms[name], val))
+        if self.protocol == 'binary':
+            payload = struct.pack('<BH', self.__pwms[name], val)
+            return self.__request_frame(
+                proto.OP_PWM, payload,
+                self.__track_frame(key, proto.parse_frame_ok_none))
 
-        result = line.strip().split(' ')
+        cmd = 'pwm {} {}'.format(self.__pwms[name], val)
 
-        if result[0] == 'OK':
-            return True
-        else:
-            return None
+        return self.__request(cmd, self.__track(key, console.parse_ok_none))
+
+    def __check_scripts(self):
+        if self.protocol != 'binary' or \
+                'script' not in self.caps.get('features', []):
+            raise IOError('Device does not support scripts')
+
+    def script_load(self, script_id, script):
+        ''' Upload a script to the device (see silta.script)
+
+            Requires the binary protocol.
+
+            Args:
+                script_id: Slot to store it in (0 to caps['scripts'] - 1).
+                    Replaces any script already there
+                script: silta.script.Script
+        '''
+        self.__check_scripts()
+
+        if script_id < 0 or script_id >= self.caps['scripts']:
+            raise ValueError('Invalid script id. Must be between 0-{}'.format(
+                self.caps['scripts'] - 1))
+
+        steps = script.encode(self.__adc_num)
+
+        if not steps:
+            raise ValueError('Empty script (use script_delete to remove one)')
+
+        if len(steps) > self.caps['scriptmax']:
+            raise ValueError('Script too long. Max:', self.caps['scriptmax'])
+
+        if script.read_length() > self.caps['txrxbuf']:
+            raise ValueError('Script reads too much. Max:',
+                             self.caps['txrxbuf'])
+
+        # Until it's confirmed, the old one (if any) is gone
+        self.__scripts.pop(script_id, None)
+
+        def parse_frame(response):
+            if response[0] != 0:
+                raise IOError('Could not load script ({})'.format(response[0]))
+            self.__scripts[script_id] = script
+
+        return self.__request_frame(proto.OP_SCRIPT_LOAD,
+                                    bytes([script_id]) + steps, parse_frame)
+
+    def script_delete(self, script_id):
+        ''' Remove a script from the device '''
+        self.__check_scripts()
+
+        self.__scripts.pop(script_id, None)
+
+        def parse_frame(response):
+            if response[0] != 0:
+                raise IOError('Could not delete script ({})'.format(
+                    response[0]))
+
+        return self.__request_frame(proto.OP_SCRIPT_LOAD, bytes([script_id]),
+                                    parse_frame)
+
+    def script_run(self, script_id):
+        ''' Run a script loaded with script_load
+
+            Args:
+                script_id: Script slot
+
+            Returns:
+                One result per step that reads something (see
+                silta.script.Script.results)
+
+            Raises IOError if a step fails (the steps after it aren't run).
+            The response is waited for up to RESPONSE_TIMEOUT plus the
+            script's delays (see silta.script.Script.duration).
+        '''
+        script = self.__scripts.get(script_id)
+
+        if script is None:
+            raise ValueError('No script loaded as {}'.format(script_id))
+
+        # Whatever the script does to pins happens behind the cache's back
+        for name in script.gpio_pins:
+            self.__shadow.pop(('gpio', name), None)
+
+        # (the firmware reconfigures CS pins, see __set_spi_cs)
+        for name in script.cs_pins:
+            self.__shadow.pop(('gpiocfg', name), None)
+            self.__shadow.pop(('gpio', name), None)
+            self.lastcspin = None
+
+        def parse_frame(response):
+            status, payload = response
+            if status == 0:
+                return script.results(payload)
+
+            if len(payload) == 1:
+                raise IOError('Script {} failed at step {} ({})'.format(
+                    script_id, script.describe_step(payload[0]), status))
+
+            raise IOError('Script {} failed ({})'.format(script_id, status))
+
+        return self.__request_frame(proto.OP_SCRIPT_RUN, bytes([script_id]),
+                                    parse_frame, script.duration())
+
+    def job(self, script_id, period, callback=None, max_runs=1024):
+        ''' Run a loaded script periodically, timed by the device
+
+            The results are sent by the device as they come in, so the rate
+            doesn't depend on USB latency or the host's timing. Requires
+            the binary protocol.
+
+            Args:
+                script_id: Script to run (see script_load)
+                period: Seconds between runs (1ms resolution)
+                callback: Function called with (time, results) for each
+                    run, instead of queueing them for iteration. It's
+                    called while the bridge reads from the device (during
+                    any command, or JobStream.poll())
+                max_runs: Runs to queue for iteration before dropping the
+                    oldest ones
+
+            Returns:
+                JobStream. Iterating over it yields (time, results)
+                tuples (see silta.stream.JobStream).
+
+            Example:
+                with my_bridge.job(1, 0.001) as runs:
+                    for t, (accel,) in runs:
+                        ...
+        '''
+        self.__check_scripts()
+
+        if 'jobs' not in self.caps.get('features', []):
+            raise IOError('Device does not support periodic jobs')
+
+        script = self.__scripts.get(script_id)
+
+        if script is None:
+            raise ValueError('No script loaded as {}'.format(script_id))
+
+        free = [job_id for job_id in range(self.caps.get('jobs', 0))
+                if job_id not in self.__jobs]
+
+        if not free:
+            raise IOError('No free job slots')
+
+        return JobStream(self, free[0], script_id, script, period, callback,
+                         max_runs)
@@ -0,0 +1,253 @@
+''' Silta data streams
+
+Data the device sends on its own (as unsolicited binary protocol frames)
+instead of in response to a command.
+'''
+
+import collections
+import struct
+
+from silta import protocol as proto
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class AdcStream(object):
+    ''' Fixed-rate ADC sample stream (see bridge.adc_stream)
+
+        Iterating yields (time, samples) tuples. Chunks that arrive while
+        nobody is iterating are queued, up to max_chunks; older ones are
+        dropped after that. Chunks lost on either side are counted in
+        `dropped`.
+    '''
+
+    FORMATS = ('volts', 'raw', 'bytes')
+
+    def __init__(self, bridge, adc_nums, rate_hz, fmt='volts',
+                 volts_per_count=1.0, max_chunks=1024):
+        if fmt not in self.FORMATS:
+            raise ValueError('Invalid format. Valid formats: <' +
+                             '|'.join(self.FORMATS) + '>')
+
+        if fmt != 'bytes' and numpy is None:
+            raise RuntimeError("NumPy is needed for the '{}' format. "
+                               "Use fmt='bytes' instead".format(fmt))
+
+        self.bridge = bridge
+        self.channels = len(adc_nums)
+        self.fmt = fmt
+        self.volts_per_count = volts_per_count
+        self.dropped = 0
+
+        self.__chunks = collections.deque(maxlen=max_chunks)
+        self.__next_index = 0
+        self.__running = False
+        self.chunk_rows = 0
+
+        payload = struct.pack('<I', int(rate_hz)) + bytes(adc_nums)
+
+        self.bridge._set_async_handler(
+            proto.OP_ADC_STREAM_DATA, self.__handle_chunk)
+
+        status, info = self.bridge._write_frame(
+            proto.OP_ADC_STREAM, payload).result()
+
+        if status != 0:
+            self.bridge._set_async_handler(proto.OP_ADC_STREAM_DATA, None)
+            raise ValueError('Unable to start ADC stream ({})'.format(status))
+
+        timer_clock, period, self.chunk_rows = struct.unpack('<III', info)
+
+        # Actual rate, which can differ slightly from the requested one
+        self.rate = timer_clock / float(period)
+
+        self.__running = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.__chunks:
+            if not self.__running:
+                raise StopIteration
+
+            self.bridge._poll_async()
+
+        index, data = self.__chunks.popleft()
+
+        return index / self.rate, self.__convert(data)
+
+    def close(self):
+        ''' Stop the stream. Chunks already received can still be read. '''
+        if self.__running:
+            self.__running = False
+            self.bridge._write_frame(proto.OP_ADC_STREAM, b'').result()
+            self.bridge._set_async_handler(proto.OP_ADC_STREAM_DATA, None)
+
+    def __handle_chunk(self, status, payload):
+        index, _ = struct.unpack('<II', payload[:8])
+
+        # Chunks the device overwrote before sending, or that got lost
+        # on the way, show up as a gap in the sample index
+        if index > self.__next_index:
+            self.dropped += \
+                (index - self.__next_index) // max(self.chunk_rows, 1)
+
+        self.__next_index = index + self.chunk_rows
+
+        if len(self.__chunks) == self.__chunks.maxlen:
+            self.dropped += 1
+
+        self.__chunks.append((index, payload[8:]))
+
+    def __convert(self, data):
+        if self.fmt == 'bytes':
+            return data
+
+        packed = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3)
+        packed = packed.astype(numpy.uint16)
+
+        samples = numpy.empty(len(packed) * 2, dtype=numpy.uint16)
+        samples[0::2] = packed[:, 0] | ((packed[:, 1] & 0x0F) << 8)
+        samples[1::2] = (packed[:, 1] >> 4) | (packed[:, 2] << 4)
+        samples = samples.reshape(-1, self.channels)
+
+        if self.fmt == 'raw':
+            return samples
+        else:
+            return samples * self.volts_per_count
+
+
+class JobStream(object):
+    ''' Results of a periodic device job (see bridge.job)
+
+        Iterating yields (time, results) tuples, where time is when the run
+        started, in seconds since the first one (on the device's clock), and
+        results are the script's results (see Script.results). Runs that
+        arrive while nobody is iterating are queued, up to max_runs; older
+        ones are dropped after that.
+
+        Runs lost on either side (the device skips them when it's busy, or
+        when the host isn't reading fast enough) are counted in `dropped`.
+        Runs where a script step failed are counted in `errors` (the last
+        error is in `last_error`) and skipped.
+    '''
+
+    def __init__(self, bridge, job_id, script_id, script, period,
+                 callback=None, max_runs=1024):
+        self.bridge = bridge
+        self.job_id = job_id
+        self.script = script
+        self.callback = callback
+
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+
+        self.__runs = collections.deque(maxlen=max_runs)
+        self.__next_seq = 0
+        self.__first_us = None
+        self.__last_us = 0
+        self.__wraps = 0
+        self.__running = False
+
+        period_ms = int(round(period * 1000))
+        if period_ms < 1:
+            raise ValueError('Period must be at least 1ms')
+
+        # Actual period
+        self.period = period_ms / 1000.0
+
+        self.bridge._set_job_handler(job_id, self.__handle_run)
+
+        status, _ = self.bridge._write_frame(
+            proto.OP_JOB,
+            struct.pack('<BBI', job_id, script_id, period_ms)).result()
+
+        if status != 0:
+            self.bridge._set_job_handler(job_id, None)
+            raise ValueError('Unable to start job ({})'.format(status))
+
+        self.__running = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.__runs:
+            if not self.__running:
+                raise StopIteration
+
+            self.bridge._poll_async()
+
+        return self.__runs.popleft()
+
+    def poll(self):
+        ''' Wait for (up to the bridge's read timeout) and handle runs.
+            For callback users. Any other command on the bridge does it too.
+        '''
+        self.bridge._poll_async()
+
+    def close(self):
+        ''' Stop the job. Runs already received can still be read. '''
+        if self.__running:
+            self.__running = False
+            self.bridge._write_frame(
+                proto.OP_JOB, bytes([self.job_id])).result()
+            self.bridge._set_job_handler(self.job_id, None)
+
+    def __time(self, time_us):
+        ''' Seconds since the first run, from a (wrapping) device time '''
+        if self.__first_us is None:
+            self.__first_us = time_us
+        elif time_us < self.__last_us - (1 << 31):
+            self.__wraps += 1
+
+        self.__last_us = time_us
+
+        return (time_us + (self.__wraps << 32) - self.__first_us) / 1e6
+
+    def __handle_run(self, status, payload):
+        seq, time_us, _ = struct.unpack('<III', payload[:12])
+
+        # Runs the device skipped or couldn't send show up as a gap in the
+        # sequence
+        if seq > self.__next_seq:
+            self.dropped += seq - self.__next_seq
+
+        self.__next_seq = seq + 1
+
+        t = self.__time(time_us)
+
+        if status != 0:
+            self.errors += 1
+            self.last_error = 'step {} failed ({})'.format(
+                self.script.describe_step(payload[12]), status) \
+                if len(payload) == 13 else 'failed ({})'.format(status)
+            return
+
+        results = self.script.results(payload[12:])
+
+        if self.callback is not None:
+            self.callback(t, results)
+            return
+
+        if len(self.__runs) == self.__runs.maxlen:
+            self.dropped += 1
+
+        self.__runs.append((t, results))
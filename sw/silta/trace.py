@@ -0,0 +1,459 @@
+''' Silta transaction tracing
+
+Bridges call their hooks (see stm32f407.bridge.add_hook) with a Transaction
+for every command once its response has been read. Profiler is a hook that
+keeps per-command counters and latency histograms, and can export them (and
+optionally every transaction) as JSON, CSV or a Chrome trace
+(chrome://tracing, ui.perfetto.dev).
+
+Nothing is timed while a bridge has no hooks.
+
+With timing telemetry enabled (bridge.device_timing()), the board also
+reports how long it spent on each command, so the host's latency can be
+split into time on the device (parsing, executing and formatting the
+response) and everything else (USB, host, queueing).
+
+Example:
+    with trace.Profiler(my_bridge) as profiler:
+        run_test(my_bridge)
+    profiler.report()
+    profiler.export_csv('latency.csv')
+'''
+
+import collections
+import csv
+import json
+import math
+import sys
+
+from silta import protocol as proto
+
+# One bridge command, from when it was queued until its response was read
+#   command: Console command name, or binary opcode name (e.g. 'i2c', 'spi')
+#   binary: True for binary protocol frames
+#   bytes_out: Encoded command length
+#   bytes_in: Response length (0 if it never arrived)
+#   start, end: time.perf_counter() timestamps in seconds
+#   ok: False for error responses
+#   device: DeviceTiming, if the board reported it (None otherwise)
+Transaction = collections.namedtuple(
+    'Transaction',
+    'command binary bytes_out bytes_in start end ok device')
+Transaction.__new__.__defaults__ = (None,)
+
+# Time (in seconds) the board spent on a command
+#   parse: Copying, tokenizing and looking up the command (or checking the
+#       frame's CRC)
+#   execute: Running the command (including console number formatting)
+#   format: Writing the response out to the USB fifo
+DeviceTiming = collections.namedtuple('DeviceTiming',
+                                      'parse execute format')
+
+# Binary protocol opcode names, for Transaction.command
+OP_NAMES = {value: name[3:].lower() for name, value in vars(proto).items()
+            if name.startswith('OP_')}
+
+
+def command_name(data, binary):
+    ''' Transaction.command for an encoded command '''
+    if binary:
+        opcode = data[1] & ~proto.TAGGED
+        return OP_NAMES.get(opcode, '{:#04x}'.format(opcode))
+
+    end = data.find(b' ')
+    if end < 0:
+        end = len(data) - 1
+
+    return data[:end].decode()
+
+
+class Histogram(object):
+    ''' HDR-style latency histogram
+
+        Values are kept in log-linear buckets, so any value can be recorded
+        in constant time and memory while percentiles stay within
+        10**-digits of the recorded values.
+    '''
+
+    # Recorded values are integer nanoseconds
+    UNIT = 1e-9
+
+    def __init__(self, digits=2):
+        ''' Args:
+                digits: Significant decimal digits to keep (1 to 5)
+        '''
+        if not 1 <= digits <= 5:
+            raise ValueError('digits must be between 1 and 5')
+
+        self.digits = digits
+
+        # Values below this have their own bucket. Above it, each power of
+        # two is split into half as many buckets.
+        self.__sub_bits = int(math.ceil(math.log2(10 ** digits))) + 1
+        self.__exact = 1 << self.__sub_bits
+
+        self.__buckets = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        ''' Add a value (in seconds) '''
+        value = max(int(round(seconds / self.UNIT)), 0)
+
+        if value >= self.__exact:
+            shift = value.bit_length() - self.__sub_bits
+            bucket = (value >> shift) << shift
+        else:
+            bucket = value
+
+        self.__buckets[bucket] += 1
+        self.count += 1
+        self.total += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        ''' Add all values recorded in another histogram '''
+        if other.digits != self.digits:
+            raise ValueError('Histograms have different precisions')
+
+        self.__buckets.update(other.__buckets)
+        self.count += other.count
+        self.total += other.total
+
+        if other.count:
+            self.min = other.min if self.min is None else \
+                min(self.min, other.min)
+            self.max = other.max if self.max is None else \
+                max(self.max, other.max)
+
+    def __width(self, bucket):
+        ''' Number of values that fall into bucket '''
+        if bucket < self.__exact:
+            return 1
+        return 1 << (bucket.bit_length() - self.__sub_bits)
+
+    def mean(self):
+        ''' Mean value in seconds (None if empty) '''
+        if not self.count:
+            return None
+        return self.total / self.count * self.UNIT
+
+    def percentile(self, percent):
+        ''' Value (in seconds) below which percent % of the values fall
+
+            Returns None if nothing has been recorded
+        '''
+        if not self.count:
+            return None
+
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+
+        seen = 0
+        for bucket in sorted(self.__buckets):
+            seen += self.__buckets[bucket]
+            if seen >= rank:
+                # Middle of the bucket, within what was actually recorded
+                value = bucket + (self.__width(bucket) - 1) // 2
+                return min(max(value, self.min), self.max) * self.UNIT
+
+        return self.max * self.UNIT
+
+    def buckets(self):
+        ''' [(bucket start in seconds, count), ...] in increasing order '''
+        return [(bucket * self.UNIT, self.__buckets[bucket])
+                for bucket in sorted(self.__buckets)]
+
+
+class CommandStats(object):
+    ''' Counters and latency histograms for one command
+
+        latency is the host's view (queued to response read). parse,
+        execute and format are the board's own timing (see DeviceTiming) and
+        transport is whatever's left of the latency (USB, host, queueing),
+        for the commands the board reported timing for.
+    '''
+
+    def __init__(self, command, digits=2):
+        self.command = command
+        self.count = 0
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = Histogram(digits)
+        self.parse = Histogram(digits)
+        self.execute = Histogram(digits)
+        self.format = Histogram(digits)
+        self.transport = Histogram(digits)
+
+    def add(self, transaction):
+        self.count += 1
+        if not transaction.ok:
+            self.errors += 1
+        self.bytes_out += transaction.bytes_out
+        self.bytes_in += transaction.bytes_in
+
+        latency = transaction.end - transaction.start
+        self.latency.record(latency)
+
+        device = transaction.device
+        if device is not None:
+            self.parse.record(device.parse)
+            self.execute.record(device.execute)
+            self.format.record(device.format)
+            self.transport.record(latency - sum(device))
+
+    def summary(self):
+        ''' Flat dict of the counters and latency statistics (in seconds) '''
+        latency = self.latency
+
+        return {
+            'command': self.command,
+            'count': self.count,
+            'errors': self.errors,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'latency_total': latency.total * latency.UNIT,
+            'latency_mean': latency.mean(),
+            'latency_min': latency.min * latency.UNIT
+            if latency.count else None,
+            'latency_p50': latency.percentile(50),
+            'latency_p90': latency.percentile(90),
+            'latency_p99': latency.percentile(99),
+            'latency_max': latency.max * latency.UNIT
+            if latency.count else None,
+            'device_count': self.parse.count,
+            'parse_mean': self.parse.mean(),
+            'execute_mean': self.execute.mean(),
+            'execute_p99': self.execute.percentile(99),
+            'format_mean': self.format.mean(),
+            'transport_mean': self.transport.mean(),
+            'transport_p99': self.transport.percentile(99),
+        }
+
+
+def _open(output):
+    ''' (file, close it when done) for a path or an open file '''
+    if hasattr(output, 'write'):
+        return output, False
+    return open(output, 'w', newline=''), True
+
+
+class Profiler(object):
+    ''' Bridge hook collecting per-command counters and latency histograms
+
+        Latencies run from when a command is queued until its response is
+        read, so they include any time spent waiting behind other commands
+        in a pipeline or batch.
+    '''
+
+    def __init__(self, bridge=None, events=False, max_events=1000000,
+                 digits=2):
+        ''' Args:
+                bridge: Bridge to attach to right away (optional)
+                events: Keep every transaction too (for export_chrome_trace
+                    and the 'events' section of export_json)
+                max_events: Stop keeping transactions after this many.
+                    The rest are only counted in dropped_events.
+                digits: Histogram precision (see Histogram)
+        '''
+        self.stats = collections.OrderedDict()
+        self.events = [] if events else None
+        self.max_events = max_events
+        self.dropped_events = 0
+        self.digits = digits
+
+        self.__bridges = []
+
+        if bridge is not None:
+            self.attach(bridge)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+    def attach(self, bridge):
+        ''' Start profiling a bridge's commands '''
+        bridge.add_hook(self)
+        self.__bridges.append(bridge)
+
+    def detach(self):
+        ''' Stop profiling all attached bridges '''
+        for bridge in self.__bridges:
+            bridge.remove_hook(self)
+        self.__bridges = []
+
+    def reset(self):
+        ''' Forget everything recorded so far '''
+        self.stats = collections.OrderedDict()
+        if self.events is not None:
+            self.events = []
+        self.dropped_events = 0
+
+    def __call__(self, transaction):
+        stats = self.stats.get(transaction.command)
+        if stats is None:
+            stats = CommandStats(transaction.command, self.digits)
+            self.stats[transaction.command] = stats
+
+        stats.add(transaction)
+
+        if self.events is not None:
+            if len(self.events) < self.max_events:
+                self.events.append(transaction)
+            else:
+                self.dropped_events += 1
+
+    def summary(self):
+        ''' List of CommandStats.summary() dicts, busiest command first '''
+        return [stats.summary() for stats in sorted(
+            self.stats.values(), key=lambda stats: -stats.latency.total)]
+
+    def report(self, stream=sys.stdout):
+        ''' Print the summary as a table '''
+        header = '{:<12} {:>8} {:>6} {:>10} {:>10} {:>9} {:>9} {:>9}'.format(
+            'command', 'count', 'errors', 'bytes out', 'bytes in',
+            'total (s)', 'p50 (ms)', 'p99 (ms)')
+
+        stream.write(header + '\n')
+        stream.write('-' * len(header) + '\n')
+
+        rows = self.summary()
+
+        for row in rows:
+            stream.write(
+                '{:<12} {:>8} {:>6} {:>10} {:>10} {:>9.3f} {:>9.3f} '
+                '{:>9.3f}\n'.format(
+                    row['command'], row['count'], row['errors'],
+                    row['bytes_out'], row['bytes_in'], row['latency_total'],
+                    row['latency_p50'] * 1000, row['latency_p99'] * 1000))
+
+        rows = [row for row in rows if row['device_count']]
+        if not rows:
+            return
+
+        # Where the time went, for commands the board reported timing for
+        header = '{:<12} {:>11} {:>13} {:>12} {:>15}'.format(
+            'command', 'parse (us)', 'execute (us)', 'format (us)',
+            'transport (us)')
+
+        stream.write('\n' + header + '\n')
+        stream.write('-' * len(header) + '\n')
+
+        for row in rows:
+            stream.write(
+                '{:<12} {:>11.1f} {:>13.1f} {:>12.1f} {:>15.1f}\n'.format(
+                    row['command'], row['parse_mean'] * 1e6,
+                    row['execute_mean'] * 1e6, row['format_mean'] * 1e6,
+                    row['transport_mean'] * 1e6))
+
+    def export_json(self, output):
+        ''' Save the summary, latency histograms and (if kept) transactions
+
+            Args:
+                output: File name or open text file
+        '''
+        data = {
+            'commands': [],
+            'dropped_events': self.dropped_events,
+        }
+
+        for row in self.summary():
+            row = dict(row)
+            row['histogram'] = self.stats[row['command']].latency.buckets()
+            data['commands'].append(row)
+
+        if self.events is not None:
+            data['events'] = []
+            for event in self.events:
+                event = event._asdict()
+                if event['device'] is not None:
+                    event['device'] = event['device']._asdict()
+                data['events'].append(event)
+
+        output, close = _open(output)
+        try:
+            json.dump(data, output, indent=2)
+            output.write('\n')
+        finally:
+            if close:
+                output.close()
+
+    def export_csv(self, output):
+        ''' Save the summary as CSV, one row per command
+
+            Args:
+                output: File name or open text file
+        '''
+        rows = self.summary()
+
+        output, close = _open(output)
+        try:
+            writer = csv.DictWriter(output, fieldnames=list(
+                CommandStats(None).summary()))
+            writer.writeheader()
+            writer.writerows(rows)
+        finally:
+            if close:
+                output.close()
+
+    def export_chrome_trace(self, output):
+        ''' Save the kept transactions in Chrome's trace event format
+
+            Commands that were in flight at the same time (pipelined) are
+            drawn on separate rows.
+
+            Args:
+                output: File name or open text file
+        '''
+        if self.events is None:
+            raise RuntimeError('Profiler was created without events=True')
+
+        origin = min([event.start for event in self.events] or [0.0])
+
+        lanes = []
+        trace_events = []
+        for event in sorted(self.events, key=lambda event: event.start):
+            # First row that's free by the time this command starts
+            for lane, busy_until in enumerate(lanes):
+                if busy_until <= event.start:
+                    lanes[lane] = event.end
+                    break
+            else:
+                lane = len(lanes)
+                lanes.append(event.end)
+
+            trace_events.append({
+                'name': event.command,
+                'cat': 'binary' if event.binary else 'ascii',
+                'ph': 'X',
+                'ts': (event.start - origin) * 1e6,
+                'dur': (event.end - event.start) * 1e6,
+                'pid': 0,
+                'tid': lane,
+                'args': {
+                    'bytes_out': event.bytes_out,
+                    'bytes_in': event.bytes_in,
+                    'ok': event.ok,
+                },
+            })
+
+            if event.device is not None:
+                trace_events[-1]['args'].update(
+                    {'device_' + name + '_us': seconds * 1e6
+                     for name, seconds in event.device._asdict().items()})
+
+        output, close = _open(output)
+        try:
+            json.dump({'traceEvents': trace_events,
+                       'displayTimeUnit': 'ms'}, output)
+        finally:
+            if close:
+                output.close()